@@ -0,0 +1,77 @@
+"""
+    Tree depth and broadcast hop count of the NetworkGraph placement for various fan-outs.
+
+    N nodes join in the order the root sees it: The Advertise of a node places it (find_live_node and add_node), and
+    its first Reunion Hello turns it on only after the Advertises of --hello-lag later nodes, like in a join burst.
+    Then we report the depth of the tree and how many hops a broadcast from a random peer needs to reach every other
+    peer.
+    The "mixed" rows give 10% of the nodes a capacity hint of 16 children and the rest the default fan-out.
+
+    Run from the repository root:
+
+        python -m benchmark.fanout --nodes 10000
+"""
+import argparse
+import random
+import statistics
+from collections import deque
+
+from src.tools.NetworkGraph import GraphNode, NetworkGraph
+
+
+def build(nodes, max_children, strong_ratio, strong_capacity, hello_lag):
+    graph = NetworkGraph(GraphNode(("000.000.000.000", "00001")), max_children=max_children)
+    waiting = deque()
+    for i in range(nodes):
+        address = ("010.%03d.%03d.%03d" % (i // 62500, i // 250 % 250, i % 250), "00001")
+        capacity = strong_capacity if random.random() < strong_ratio else None
+        parent = graph.find_live_node(address)
+        graph.add_node(address[0], address[1], parent.address, capacity=capacity)
+        waiting.append(address)
+        if len(waiting) > hello_lag:
+            graph.turn_on_node(waiting.popleft())
+    for address in waiting:
+        graph.turn_on_node(address)
+    return graph
+
+
+def broadcast_hops(graph, origin):
+    """
+    :return: Number of hops a broadcast from origin needs to reach the farthest peer of the tree.
+    :rtype: int
+    """
+    distance = {origin: 0}
+    queue = deque([origin])
+    while queue:
+        node = queue.popleft()
+        for neighbour in node.children + ([node.parent] if node.parent is not None else []):
+            if neighbour not in distance:
+                distance[neighbour] = distance[node] + 1
+                queue.append(neighbour)
+    return max(distance.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--fanouts", type=int, nargs="+", default=[2, 3, 4, 8, 16])
+    parser.add_argument("--origins", type=int, default=20, help="Random broadcast origins per tree.")
+    parser.add_argument("--hello-lag", type=int, default=1000,
+                        help="Advertises of later nodes the root handles before the first Hello of a node.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("%-10s %10s %10s %16s %16s" % ("fan-out", "max depth", "mean depth", "mean bcast hops", "max bcast hops"))
+    for mixed in (False, True):
+        for fanout in args.fanouts:
+            random.seed(args.seed)
+            graph = build(args.nodes, fanout, 0.1 if mixed else 0, 16, args.hello_lag)
+            peers = [n for n in graph.nodes if n is not graph.root]
+            hops = [broadcast_hops(graph, random.choice(peers)) for _ in range(args.origins)]
+            depths = [n.depth for n in peers]
+            print("%-10s %10d %10.2f %16.2f %16d" % (("mixed/%d" if mixed else "%d") % fanout, max(depths),
+                                                     statistics.mean(depths), statistics.mean(hops), max(hops)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+    Per-hop latency of Message packets on a chain of local peers.
+
+    A root plus a chain of peers are started on loopback ports in this process; every peer joins the previous one,
+    then the first peer of the chain broadcasts some messages and we record when each peer handles them.
+    The benchmark runs once with the fixed sleep main loop and once with the wake-on-arrival main loop.
+
+    Run from the repository root:
+
+        python -m benchmark.hop_latency --hops 5 --messages 3
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+import time
+
+from src.Peer import Peer
+
+LOCALHOST = "127.000.000.001"
+
+
+class TimedPeer(Peer):
+    """
+    A Peer that records the arrival time of every Message packet it handles.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.message_arrivals = []
+        super().__init__(*args, **kwargs)
+
+    def handle_packet(self, packet):
+        if packet.get_type() == 4:
+            self.message_arrivals.append(time.time())
+        super().handle_packet(packet)
+
+
+def build_chain(base_port, hops, wake_on_arrival, idle_interval):
+    """
+    Start a root and a chain of hops + 1 peers; peer[i] joins peer[i - 1].
+
+    :return: The chain peers in order.
+    :rtype: list
+    """
+    root_address = (LOCALHOST, str(base_port).zfill(5))
+    Peer(LOCALHOST, base_port, is_root=True, wake_on_arrival=wake_on_arrival, idle_interval=idle_interval)
+
+    chain = []
+    for i in range(hops + 1):
+        peer = TimedPeer(LOCALHOST, base_port + 1 + i, root_address=root_address, wake_on_arrival=wake_on_arrival,
+                         idle_interval=idle_interval)
+        if chain:
+            parent_address = chain[-1].stream.get_server_address()
+            peer.stream.add_node(parent_address)
+            peer.parent = peer.stream.get_node_by_server(parent_address[0], parent_address[1])
+            join_packet = peer.packet_factory.new_join_packet(peer.stream.get_server_address())
+            peer.stream.add_message_to_out_buff(parent_address, join_packet.get_buf())
+            peer.stream.send_out_buf_messages()
+        chain.append(peer)
+
+    for peer in chain:
+        threading.Thread(target=peer.run, daemon=True).start()
+    return chain
+
+
+def measure(chain, messages, idle_interval):
+    """
+    Broadcast messages from the head of the chain one by one and wait for each to reach the tail.
+
+    :return: Every observed per-hop delay in seconds.
+    :rtype: list
+    """
+    head, tail = chain[0], chain[-1]
+    # Let every peer handle the Join packets before we start.
+    time.sleep(2 * idle_interval + 0.5)
+
+    delays = []
+    for i in range(messages):
+        sent = time.time()
+        head._user_interface.buffer.append("SendMessage benchmark-%d" % i)
+        head.stream.wake_up()
+        while len(tail.message_arrivals) <= i:
+            time.sleep(0.001)
+        previous = sent
+        for peer in chain[1:]:
+            delays.append(peer.message_arrivals[i] - previous)
+            previous = peer.message_arrivals[i]
+    return delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hops", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--idle-interval", type=float, default=2)
+    parser.add_argument("--base-port", type=int, default=31000)
+    args = parser.parse_args()
+
+    results = []
+    for index, wake_on_arrival in enumerate((False, True)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            chain = build_chain(args.base_port + index * (args.hops + 10), args.hops, wake_on_arrival,
+                                args.idle_interval)
+            delays = measure(chain, args.messages, args.idle_interval)
+        results.append(("wake-on-arrival" if wake_on_arrival else "fixed sleep", delays))
+
+    print("%-16s %12s %12s %12s %14s" % ("main loop", "mean hop(ms)", "p50 hop(ms)", "max hop(ms)", "end-to-end(ms)"))
+    for name, delays in results:
+        print("%-16s %12.1f %12.1f %12.1f %14.1f" % (name, 1000 * statistics.mean(delays),
+                                                     1000 * statistics.median(delays), 1000 * max(delays),
+                                                     1000 * statistics.mean(delays) * args.hops))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+    End-to-end time of a large message across a chain of local peers.
+
+    A root plus a chain of hops + 1 peers are started on loopback ports in this process; every peer joins the previous
+    one, then the head of the chain broadcasts a random payload and we record when the tail has the whole of it.
+    The payload is sent once as a single Message packet, which every peer has to receive completely before relaying
+    it, and once for every fragment size as Fragment packets, which every peer relays as soon as each of them
+    arrives; So the transfers of the hops overlap.
+
+    Run from the repository root:
+
+        python -m benchmark.large_message --megabytes 10 --hops 5 --fragment-sizes 16 64 256
+"""
+import argparse
+import contextlib
+import os
+import threading
+import time
+
+from src.Peer import Peer
+
+LOCALHOST = "127.000.000.001"
+
+
+class SourcePeer(Peer):
+    """
+    A Peer that broadcasts the payloads put in pending from its own main loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.pending = []
+        super().__init__(*args, **kwargs)
+
+    def handle_user_interface_buffer(self):
+        while self.pending:
+            self.send_message(self.pending.pop(0))
+        super().handle_user_interface_buffer()
+
+
+def build_chain(base_port, hops, fragment_size, on_message):
+    """
+    Start a root and a chain of hops + 1 peers; peer[i] joins peer[i - 1].
+
+    :return: The chain peers in order.
+    :rtype: list
+    """
+    root_address = (LOCALHOST, str(base_port).zfill(5))
+    Peer(LOCALHOST, base_port, is_root=True)
+
+    chain = []
+    for i in range(hops + 1):
+        peer_class = SourcePeer if i == 0 else Peer
+        peer = peer_class(LOCALHOST, base_port + 1 + i, root_address=root_address, pipelined_sends=True,
+                          fragment_size=fragment_size, on_message=on_message if i == hops else None)
+        if chain:
+            parent_address = chain[-1].stream.get_server_address()
+            peer.stream.add_node(parent_address)
+            peer.parent = peer.stream.get_node_by_server(parent_address[0], parent_address[1])
+            join_packet = peer.packet_factory.new_join_packet(peer.stream.get_server_address())
+            peer.stream.add_message_to_out_buff(parent_address, join_packet.get_buf())
+            peer.stream.send_out_buf_messages()
+        chain.append(peer)
+
+    for peer in chain:
+        threading.Thread(target=peer.run, daemon=True).start()
+    return chain
+
+
+def measure(base_port, hops, fragment_size, payload, timeout):
+    """
+    :return: Seconds from handing the payload to the head until the tail has it; None after the timeout.
+    :rtype: float
+    """
+    arrived = threading.Event()
+    received = []
+
+    def on_message(message_id, message):
+        received.append(message)
+        arrived.set()
+
+    chain = build_chain(base_port, hops, fragment_size, on_message)
+    # Let every peer handle the Join packets before we start.
+    time.sleep(0.5)
+
+    start = time.time()
+    chain[0].pending.append(payload)
+    chain[0].stream.wake_up()
+    if not arrived.wait(timeout):
+        return None
+    seconds = time.time() - start
+    if received[0] != payload:
+        raise Exception("The payload has arrived corrupted.")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=10)
+    parser.add_argument("--hops", type=int, default=5)
+    parser.add_argument("--fragment-sizes", type=int, nargs="+", default=[16, 64, 256], help="In KiB.")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--base-port", type=int, default=36000)
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.megabytes * 1024 * 1024))
+    modes = [("whole message", len(payload))] + [("%d KiB fragments" % size, size * 1024)
+                                                 for size in args.fragment_sizes]
+
+    print("%-20s %12s %12s" % ("mode", "seconds", "MB/s"))
+    for index, (name, fragment_size) in enumerate(modes):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            seconds = measure(args.base_port + index * (args.hops + 10), args.hops, fragment_size, payload,
+                              args.timeout)
+        if seconds is None:
+            print("%-20s %12s %12s" % (name, "timeout", "-"))
+        else:
+            print("%-20s %12.3f %12.1f" % (name, seconds, len(payload) / seconds / 1e6))
+
+
+if __name__ == "__main__":
+    main()
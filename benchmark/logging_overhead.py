@@ -0,0 +1,86 @@
+"""
+    Message throughput between two local Streams by logging mode.
+
+    Every message is made with PacketFactory.new_message_packet, buffered with Stream.add_message_to_out_buff and
+    sent by Node.send_message, so each of them passes the log statements of the hot path. The modes are:
+
+        print:        Every statement is formatted and written at once by the Thread that logs, like the print calls
+                      these statements replaced.
+        off:          Logging is not configured; A statement costs only its level check.
+        info queued:  Level INFO through the queue of configure_logging; The per-packet DEBUG statements are off.
+        debug queued: Every statement is logged, but formatted and written by the QueueListener Thread.
+
+    The records go to --output, os.devnull by default; A terminal is much slower than that.
+
+    Run from the repository root:
+
+        python -m benchmark.logging_overhead --messages 5000 --size 100
+"""
+import argparse
+import os
+import time
+
+from src.Packet import PacketFactory
+from src.Stream import Stream
+from src.tools.Log import configure_logging, stop_logging
+
+LOCALHOST = "127.000.000.001"
+
+MODES = [("print", "DEBUG", False, "%(message)s"), ("off", None, None, None), ("info queued", "INFO", True, None),
+         ("debug queued", "DEBUG", True, None)]
+
+
+def measure(base_port, messages, size, pipelined, flush_every):
+    """
+    :return: Seconds needed to make and deliver every message.
+    :rtype: float
+    """
+    receiver = Stream(LOCALHOST, base_port)
+    sender = Stream(LOCALHOST, base_port + 1, pipelined=pipelined)
+    sender.add_node(receiver.get_server_address())
+
+    body = "x" * size
+    received = 0
+    start = time.time()
+    for i in range(messages):
+        buf = PacketFactory.new_message_packet(body, sender.get_server_address()).get_buf()
+        sender.add_message_to_out_buff(receiver.get_server_address(), buf)
+        if (i + 1) % flush_every == 0:
+            sender.send_out_buf_messages()
+    sender.send_out_buf_messages()
+    while received < messages:
+        receiver.wait_for_in_buf(1)
+        received += len(PacketFactory.unpack_batches(receiver.pop_in_buf()))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=100, help="Message body size in characters.")
+    parser.add_argument("--flush-every", type=int, default=100, help="Messages buffered between two flushes.")
+    parser.add_argument("--rounds", type=int, default=3, help="We report the fastest round of every mode.")
+    parser.add_argument("--output", default=os.devnull, help="File the log records are written to.")
+    parser.add_argument("--base-port", type=int, default=26000)
+    args = parser.parse_args()
+
+    print("%-14s %-10s %10s %14s" % ("logging", "sending", "seconds", "messages/s"))
+    with open(args.output, "w") as output:
+        index = 0
+        for pipelined in (False, True):
+            for mode, level, queued, fmt in MODES:
+                rounds = []
+                for _ in range(args.rounds):
+                    if level is not None:
+                        configure_logging(level, output, queued, **({"fmt": fmt} if fmt else {}))
+                    rounds.append(measure(args.base_port + 2 * index, args.messages, args.size, pipelined,
+                                          args.flush_every))
+                    stop_logging()
+                    index += 1
+                seconds = min(rounds)
+                print("%-14s %-10s %10.3f %14.0f" % (mode, "pipelined" if pipelined else "ack", seconds,
+                                                      args.messages / seconds))
+
+
+if __name__ == "__main__":
+    main()
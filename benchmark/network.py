@@ -0,0 +1,345 @@
+"""
+    A whole network of Peers on loopback ports in one process, driven like its users would drive it.
+
+    A root and N peers are started in this process, every one with its own main loop Thread. Every peer is told to
+    Register and then to Advertise through Peer.add_command, exactly the commands of the UserInterface; Then random
+    peers broadcast messages with SendMessage while the Reunion daemons keep running. We report:
+
+        register time:    From the Register command of a peer until the root has handled its Register Request.
+        join time:        From the Advertise command of a peer until its parent has handled its Join packet.
+        broadcast:        From a SendMessage command until every other peer has the message (completion), and
+                          until each peer has it (delivery).
+        packets/s:        Packets handled by all peers together while the broadcasts run.
+        reunion overhead: Reunion packets and bytes per second of the idle network, and their share of all packets.
+
+    The root only places new peers under peers which have said Reunion Hello and only counts those as children, so
+    peers Advertise in waves which double in size, and every wave waits for the first Reunion Hello of the previous
+    one; That takes a Reunion interval per wave. A wave still goes under the first peer with a free child slot.
+    With --star every peer Advertises at once and all of them become children of the root.
+
+    Use it to compare a change to Peer, Stream or NetworkGraph against the previous commit on the same machine:
+
+        python -m benchmark.network --peers 30 --broadcasts 50
+        python -m benchmark.network --peers 30 --broadcasts 50 --pipelined --batch-bytes 16384
+
+    With --trace every peer records the stages of its packets in one Tracer, written as a Chrome trace file with
+    the time spent in every stage; --profile samples the stacks of all Threads while the broadcasts run and writes
+    them in the folded format of flamegraph.pl.
+
+        python -m benchmark.network --peers 10 --broadcasts 20 --trace trace.json --profile stacks.txt
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+from src.Packet import PacketFactory
+from src.Peer import Peer
+from src.tools.SamplingProfiler import SamplingProfiler
+from src.tools.Tracer import Tracer
+
+LOCALHOST = "127.000.000.001"
+
+
+class HarnessPeer(Peer):
+    """
+    A Peer that counts the packets it handles and records when messages and the Join packets of its children arrive.
+    Everything is written by its own main loop Thread only.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.packet_counts = Counter()
+        self.packet_bytes = Counter()
+        # Server address of a child -> when we handled its Join packet.
+        self.join_times = {}
+        # Server address of a peer -> when we handled its Register Request; As the root.
+        self.register_times = {}
+        # Message -> when it reached us.
+        self.arrivals = {}
+        super().__init__(*args, on_message=self._on_message, **kwargs)
+
+    def handle_packet(self, packet):
+        packet_type = packet.get_type()
+        self.packet_counts[packet_type] += 1
+        self.packet_bytes[packet_type] += len(packet.get_buf())
+        if packet_type == 3 and packet.get_body()[0:4] == 'JOIN':
+            self.join_times.setdefault(packet.get_source_server_address(), time.time())
+        elif packet_type == 1 and packet.get_body()[0:3] == 'REQ':
+            self.register_times.setdefault(packet.get_source_server_address(), time.time())
+        super().handle_packet(packet)
+
+    def _on_message(self, message_id, message):
+        self.arrivals.setdefault(message, time.time())
+
+
+class LocalNetwork:
+    """
+    A root and peers on consecutive loopback ports starting at base_port.
+    """
+
+    def __init__(self, peers, base_port, max_children=2, **peer_options):
+        """
+
+        :param peers: Number of peers besides the root.
+        :param base_port: Port of the root; Peer i listens on base_port + 1 + i.
+        :param max_children: Default fan-out the root places the peers with.
+        :param peer_options: More Peer constructor options for the root and every peer.
+
+        :type peers: int
+        :type base_port: int
+        :type max_children: int
+        """
+        self.root_address = (LOCALHOST, str(base_port).zfill(5))
+        self.root = HarnessPeer(LOCALHOST, base_port, is_root=True, max_children=max_children, **peer_options)
+        self.peers = [HarnessPeer(LOCALHOST, base_port + 1 + i, root_address=self.root_address, **peer_options)
+                      for i in range(peers)]
+        for peer in self.all_peers():
+            threading.Thread(target=peer.run, daemon=True).start()
+
+    def all_peers(self):
+        """
+
+        :return: The root and the peers.
+        :rtype: list
+        """
+        return [self.root] + self.peers
+
+    def register(self, timeout=30):
+        """
+        Register every peer at once.
+
+        :return: Seconds every peer needed to register, in peer order.
+        :rtype: list
+        """
+        start = time.time()
+        for peer in self.peers:
+            peer.add_command("Register")
+        if not wait_until(lambda: len(self.root.registered_nodes) == len(self.peers), timeout):
+            raise Exception("Only %d of %d peers have registered." % (len(self.root.registered_nodes),
+                                                                      len(self.peers)))
+        return [self.root.register_times[peer.stream.get_server_address()] - start for peer in self.peers]
+
+    def join(self, star=False, timeout=30):
+        """
+        Make the registered peers Advertise and wait for their parents to handle their Join packets; In waves which
+        double in size, or all at once if star.
+
+        :return: Seconds every peer needed to join, in peer order; None for a peer which did not join in time.
+        :rtype: list
+        """
+        waiting = list(self.peers)
+        joined = []
+        seconds = {}
+        while waiting:
+            size = len(waiting) if star else len(joined) + 1
+            wave, waiting = waiting[:size], waiting[size:]
+            start = time.time()
+            for peer in wave:
+                peer.add_command("Advertise")
+            wait_until(lambda: all(self.join_time(peer) is not None for peer in wave), timeout)
+            for peer in wave:
+                if self.join_time(peer) is not None:
+                    seconds[peer] = self.join_time(peer) - start
+            joined.extend(wave)
+            if waiting:
+                # Wait for the first Reunion Hello of the wave, so the root places the next wave under it.
+                wait_until(lambda: all(self.is_alive(peer) for peer in wave), timeout)
+        return [seconds.get(peer) for peer in self.peers]
+
+    def is_alive(self, peer):
+        """
+
+        :return: Whether the root has turned the peer on in its NetworkGraph.
+        :rtype: bool
+        """
+        node = self.root.network_graph.find_node(*peer.stream.get_server_address())
+        return node is not None and node.alive
+
+    def get_depths(self):
+        """
+
+        :return: Depth of every peer in the tree, in peer order; The children of the root have depth 1.
+        :rtype: list
+        """
+        parents = {peer.stream.get_server_address(): peer.parent.get_server_address() for peer in self.peers
+                   if peer.parent is not None}
+        depths = []
+        for peer in self.peers:
+            depth, address = 0, peer.stream.get_server_address()
+            while address in parents and depth <= len(self.peers):
+                depth, address = depth + 1, parents[address]
+            depths.append(depth)
+        return depths
+
+    def join_time(self, peer):
+        """
+
+        :return: When the parent of the peer has handled its Join packet; None if it has not yet.
+        :rtype: float
+        """
+        if peer.parent is None:
+            return None
+        parent_address = peer.parent.get_server_address()
+        for candidate in self.all_peers():
+            if candidate.stream.get_server_address() == parent_address:
+                return candidate.join_times.get(peer.stream.get_server_address())
+        return None
+
+    def broadcast(self, sender, message, timeout=10):
+        """
+        Send a message from the sender and wait until every other peer has it.
+
+        :param sender: One of our peers.
+        :param message: Text of the message; Should be unique.
+
+        :type sender: HarnessPeer
+        :type message: str
+
+        :return: Seconds until every other peer had the message, in the order of all_peers; None for a peer which
+                 did not get it in time.
+        :rtype: list
+        """
+        receivers = [peer for peer in self.all_peers() if peer is not sender]
+        data = message.encode('UTF-8')
+        start = time.time()
+        sender.add_command("SendMessage " + message)
+        wait_until(lambda: all(data in peer.arrivals for peer in receivers), timeout, interval=0.001)
+        return [peer.arrivals[data] - start if data in peer.arrivals else None for peer in receivers]
+
+    def packet_totals(self):
+        """
+
+        :return: Packets and bytes every type has been handled by all peers so far.
+        :rtype: tuple
+        """
+        counts, sizes = Counter(), Counter()
+        for peer in self.all_peers():
+            counts.update(peer.packet_counts)
+            sizes.update(peer.packet_bytes)
+        return counts, sizes
+
+
+def wait_until(predicate, timeout, interval=0.01):
+    """
+    :return: Whether predicate() became true before the timeout.
+    :rtype: bool
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def percentile(values, p):
+    """
+    :return: The nearest-rank p-th percentile of values.
+    :rtype: float
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def summary(values):
+    """
+    :return: Mean, p50, p90, p99 and max of values in milliseconds, formatted in one row.
+    :rtype: str
+    """
+    if not values:
+        return "%10s" % "-"
+    return " ".join("%10.1f" % (1000 * v) for v in (statistics.mean(values), percentile(values, 50),
+                                                     percentile(values, 90), percentile(values, 99), max(values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=20)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    parser.add_argument("--reunion-seconds", type=float, default=10, help="Idle time to measure Reunion traffic.")
+    parser.add_argument("--max-children", type=int, default=2)
+    parser.add_argument("--transport", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--batch-bytes", type=int, default=None)
+    parser.add_argument("--aggregate-reunion", action="store_true")
+    parser.add_argument("--star", action="store_true", help="Advertise every peer at once.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--base-port", type=int, default=24000)
+    parser.add_argument("--trace", help="Write a Chrome trace of every packet to this file.")
+    parser.add_argument("--profile", help="Write the sampled stacks during the broadcasts to this file.")
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="Seconds between two samples.")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    tracer = Tracer() if args.trace else None
+    profiler = SamplingProfiler(args.profile_interval) if args.profile else None
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        network = LocalNetwork(args.peers, args.base_port, max_children=args.max_children, transport=args.transport,
+                               pipelined_sends=args.pipelined, batch_bytes=args.batch_bytes,
+                               aggregate_reunion=args.aggregate_reunion, tracer=tracer)
+        register_seconds = network.register()
+        join_seconds = network.join(star=args.star)
+
+        before, _ = network.packet_totals()
+        if profiler is not None:
+            profiler.start()
+        start = time.time()
+        completions, deliveries, lost = [], [], 0
+        for i in range(args.broadcasts):
+            arrivals = network.broadcast(random.choice(network.all_peers()), "benchmark-%d" % i)
+            lost += arrivals.count(None)
+            arrivals = [a for a in arrivals if a is not None]
+            deliveries.extend(arrivals)
+            if len(arrivals) == args.peers:
+                completions.append(max(arrivals))
+        broadcast_seconds = time.time() - start
+        if profiler is not None:
+            profiler.stop()
+        after, _ = network.packet_totals()
+
+        idle_counts, idle_bytes = network.packet_totals()
+        time.sleep(args.reunion_seconds)
+        counts, sizes = network.packet_totals()
+
+    joined = [s for s in join_seconds if s is not None]
+    depths = Counter(network.get_depths())
+    print("%d peers joined of %d, %d deliveries lost" % (len(joined), args.peers, lost))
+    print("peers by depth: " + ", ".join("%d: %d" % (d, c) for d, c in sorted(depths.items())))
+    print("%-22s %10s %10s %10s %10s %10s" % ("(ms)", "mean", "p50", "p90", "p99", "max"))
+    print("%-22s %s" % ("register", summary(register_seconds)))
+    print("%-22s %s" % ("join", summary(joined)))
+    print("%-22s %s" % ("broadcast completion", summary(completions)))
+    print("%-22s %s" % ("broadcast delivery", summary(deliveries)))
+    print()
+    handled = sum(after.values()) - sum(before.values())
+    print("packets/s while broadcasting: %.0f (%d packets in %.2f s)" % (handled / broadcast_seconds, handled,
+                                                                        broadcast_seconds))
+    reunion_packets = counts[5] - idle_counts[5]
+    reunion_bytes = sizes[5] - idle_bytes[5]
+    idle_total = sum(counts.values()) - sum(idle_counts.values())
+    print("reunion overhead: %.1f packets/s, %.0f bytes/s, %.0f%% of the idle traffic" % (
+        reunion_packets / args.reunion_seconds, reunion_bytes / args.reunion_seconds,
+        100 * reunion_packets / idle_total if idle_total else 0))
+    print("packets handled by type: " + ", ".join("%s %d" % (PacketFactory.TYPE_NAMES.get(t, t), c)
+                                                  for t, c in sorted(counts.items())))
+
+    if tracer is not None:
+        tracer.dump(args.trace)
+        print()
+        print("%-28s %10s %12s %12s" % ("stage", "events", "total ms", "mean us"))
+        for stage, (count, seconds) in sorted(tracer.get_stage_totals().items(), key=lambda item: -item[1][1]):
+            print("%-28s %10d %12.1f %12.1f" % (stage, count, 1000 * seconds, 1e6 * seconds / count))
+    if profiler is not None:
+        profiler.dump(args.profile)
+        print()
+        print("most sampled functions (%d samples of every Thread):" % profiler.samples)
+        for function, samples in profiler.get_top_functions(10):
+            print("  %-50s %d" % (function, samples))
+
+
+if __name__ == "__main__":
+    main()
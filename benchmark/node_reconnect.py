@@ -0,0 +1,63 @@
+"""
+    Cost of removing a node and adding it again, as Peer does after a repeated Advertise.
+
+    A Stream removes a node and adds it again for the same address, then sends it one Message packet; Once with the
+    connection kept in the ConnectionPool of the Stream and once with the pool emptied after every removal, so every
+    new Node connects from scratch.
+
+    Run from the repository root:
+
+        python -m benchmark.node_reconnect --cycles 2000
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from src.Packet import PacketFactory
+from src.Stream import Stream
+
+LOCALHOST = "127.000.000.001"
+
+
+def run(base_port, cycles, reuse):
+    """
+    :return: Seconds per remove, add and send cycle.
+    :rtype: float
+    """
+    receiver = Stream(LOCALHOST, base_port)
+    sender = Stream(LOCALHOST, base_port + 1)
+    address = receiver.get_server_address()
+    buf = bytes(PacketFactory.new_message_packet("x" * 100, sender.get_server_address()).get_buf())
+    sender.add_node(address)
+
+    start = time.time()
+    for _ in range(cycles):
+        sender.remove_node(sender.get_node_by_server(*address))
+        if not reuse:
+            sender.connections.close()
+        sender.add_node(address)
+        sender.add_message_to_out_buff(address, buf)
+        sender.send_out_buf_messages()
+    return (time.time() - start) / cycles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--base-port", type=int, default=37000)
+    args = parser.parse_args()
+
+    results = []
+    for index, reuse in enumerate((False, True)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(("reused" if reuse else "new connection", run(args.base_port + 2 * index, args.cycles,
+                                                                           reuse)))
+
+    print("%-16s %14s" % ("connection", "us/cycle"))
+    for name, seconds in results:
+        print("%-16s %14.1f" % (name, 1e6 * seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+    Parse and serialise rate of every packet type with Packet and BinaryPacket.
+
+    "parse" reads the fields a Peer handler uses (type, length, source address and body) from a received buffer,
+    "relay" additionally serialises the packet again with get_buf, and "build" makes a new packet from its fields
+    and serialises it.
+
+    Run from the repository root:
+
+        python -m benchmark.packet_codec --seconds 0.5
+"""
+import argparse
+import timeit
+
+from src.Packet import BinaryPacket, Packet, PacketFactory
+
+ADDRESS = ("192.168.001.029", "06500")
+
+
+def sample_packets():
+    """
+    :return: One sample packet of every type.
+    :rtype: list
+    """
+    return [
+        ("register", PacketFactory.new_register_packet("REQ", ADDRESS, ADDRESS)),
+        ("advertise", PacketFactory.new_advertise_packet("RES", ADDRESS, ADDRESS)),
+        ("join", PacketFactory.new_join_packet(ADDRESS)),
+        ("message", PacketFactory.new_message_packet("Hello World! " * 20, ADDRESS)),
+        ("reunion", PacketFactory.new_reunion_packet("REQ", ADDRESS, [ADDRESS] * 8)),
+    ]
+
+
+def read_fields(packet):
+    packet.get_type()
+    packet.get_length()
+    packet.get_source_server_address()
+    packet.get_body()
+
+
+def rate(function, seconds):
+    """
+    :return: Calls of function per second.
+    :rtype: float
+    """
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * seconds / elapsed))
+    return number / timer.timeit(number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=0.5, help="Time spent on every measurement.")
+    args = parser.parse_args()
+
+    print("%-10s %-6s %14s %14s %8s" % ("type", "op", "Packet/s", "BinaryPacket/s", "speedup"))
+    for name, packet in sample_packets():
+        buf = bytes(packet.get_buf())
+        fields = (packet.get_version(), packet.get_type(), packet.get_source_server_address(), packet.get_body())
+        string = str(packet.get_version()) + str(packet.get_type()).zfill(2) + str(packet.get_length()).zfill(8) + \
+            packet.get_source_server_ip() + packet.get_source_server_port() + packet.get_body()
+        cases = [
+            ("parse", lambda: read_fields(PacketFactory.parse_buffer(buf, lazy=False)),
+             lambda: read_fields(PacketFactory.parse_buffer(buf))),
+            ("relay", lambda: PacketFactory.parse_buffer(buf, lazy=False).get_buf(),
+             lambda: PacketFactory.parse_buffer(buf).get_buf()),
+            ("build", lambda: Packet(string).get_buf(), lambda: BinaryPacket.from_fields(*fields).get_buf()),
+        ]
+        for op, current, binary in cases:
+            current_rate = rate(current, args.seconds)
+            binary_rate = rate(binary, args.seconds)
+            print("%-10s %-6s %14.0f %14.0f %7.1fx" % (name, op, current_rate, binary_rate, binary_rate / current_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+    Cost of registering and placing many synthetic nodes on a root Peer.
+
+    Register Request, Advertise Request and Reunion Hello packets of synthetic nodes are handed straight to the
+    handle_packet of a local root, so we measure the root's bookkeeping (registration checks, node lookups and
+    NetworkGraph placement) without any network I/O towards the synthetic nodes besides one refused connect each.
+    Every node says Reunion Hello right after joining, so later nodes are placed deeper in the tree.
+
+    Run from the repository root:
+
+        python -m benchmark.root_scaling --nodes 10000
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from src.Packet import PacketFactory
+from src.Peer import Peer
+
+LOCALHOST = "127.000.000.001"
+
+
+def synthetic_address(index):
+    """
+    :return: A loopback address which nobody listens on.
+    :rtype: tuple
+    """
+    return "127.%03d.%03d.%03d" % (1 + index // 62500, index // 250 % 250, index % 250 + 1), "00009"
+
+
+def join(root, address):
+    """
+    Register, advertise and say Reunion Hello for one synthetic node.
+
+    :return: Seconds spent in the root handlers.
+    :rtype: float
+    """
+    register = PacketFactory.parse_buffer(bytes(PacketFactory.new_register_packet("REQ", address).get_buf()))
+    advertise = PacketFactory.parse_buffer(bytes(PacketFactory.new_advertise_packet("REQ", address).get_buf()))
+    hello = PacketFactory.parse_buffer(bytes(PacketFactory.new_reunion_packet("REQ", address, [address]).get_buf()))
+
+    start = time.perf_counter()
+    root.handle_packet(register)
+    root.handle_packet(advertise)
+    root.handle_packet(hello)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--report-every", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=36000)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        root = Peer(LOCALHOST, args.port, is_root=True)
+
+    print("%8s %16s %20s" % ("nodes", "total handler(s)", "per node, last (us)"))
+    total = 0
+    window = 0
+    for i in range(args.nodes):
+        with contextlib.redirect_stdout(io.StringIO()):
+            spent = join(root, synthetic_address(i))
+        total += spent
+        window += spent
+        if (i + 1) % args.report_every == 0:
+            print("%8d %16.3f %20.1f" % (i + 1, total, 1e6 * window / args.report_every))
+            window = 0
+
+
+if __name__ == "__main__":
+    main()
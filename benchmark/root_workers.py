@@ -0,0 +1,77 @@
+"""
+    Packets per second a root Peer handles with 0 (main loop only), 1, 2, 4 and 8 worker processes.
+
+    A load generator makes Reunion Hello packets of synthetic nodes, from the nodes themselves and forwarded
+    through two ancestors, and feeds batches of them to Peer.handle_buffers of a local root, like its main loop
+    would after a wake up. Hello Back answers are buffered for the synthetic nodes but never sent.
+
+    Run from the repository root:
+
+        python -m benchmark.root_workers --nodes 1000 --batches 50 --batch-size 500
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import time
+
+from src.Packet import PacketFactory
+from src.Peer import Peer
+
+LOCALHOST = "127.000.000.001"
+
+
+def synthetic_address(index):
+    return "127.%03d.%03d.%03d" % (1 + index // 62500, index // 250 % 250, index % 250 + 1), "00009"
+
+
+def make_root(port, workers, nodes):
+    root = Peer(LOCALHOST, port, is_root=True, root_workers=workers)
+    root_address = root.stream.get_server_address()
+    for i in range(nodes):
+        address = synthetic_address(i)
+        root.stream.add_node(address)
+        root.network_graph.add_node(address[0], address[1], root_address)
+    return root
+
+
+def make_load(nodes, count):
+    load = []
+    for _ in range(count):
+        path = [synthetic_address(random.randrange(nodes)) for _ in range(3)]
+        load.append(bytes(PacketFactory.new_reunion_packet("REQ", path[-1], path).get_buf()))
+    return load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=38000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        load = [make_load(args.nodes, args.batch_size) for _ in range(args.batches)]
+
+    print("cpus: %d" % os.cpu_count())
+    print("%8s %14s" % ("workers", "packets/s"))
+    for index, workers in enumerate(args.workers):
+        with contextlib.redirect_stdout(io.StringIO()):
+            root = make_root(args.port + index, workers, args.nodes)
+            root.handle_buffers(load[0])
+            start = time.perf_counter()
+            for batch in load:
+                root.handle_buffers(batch)
+                for node in root.stream.nodes:
+                    node.out_buff.clear()
+            elapsed = time.perf_counter() - start
+        print("%8d %14.0f" % (workers, args.batches * args.batch_size / elapsed))
+        root.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+    Latency to a healthy neighbour while another neighbour is slow.
+
+    One Stream has two nodes: a slow neighbour which answers every packet with b'ACK' only after a delay, and a
+    healthy Stream. In every round the sender buffers one Message packet for each of them and calls
+    send_out_buf_messages; we measure the time until the healthy neighbour has the packet.
+    Sending to the nodes one by one makes the healthy neighbour wait for the slow one, with send_workers its latency
+    stays flat.
+
+    Run from the repository root:
+
+        python -m benchmark.slow_neighbour --rounds 20 --delay 0.05
+"""
+import argparse
+import contextlib
+import io
+import socket
+import statistics
+import threading
+import time
+
+from src.Packet import PacketFactory
+from src.Stream import Stream
+
+LOCALHOST = "127.000.000.001"
+
+
+def start_slow_neighbour(port, delay):
+    """
+    Accept connections on the port and answer every received chunk with b'ACK' after delay seconds.
+
+    :return: The listening socket.
+    :rtype: socket.socket
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(5)
+
+    def serve(connection):
+        with connection:
+            while connection.recv(65536):
+                time.sleep(delay)
+                connection.sendall(b'ACK')
+
+    def accept():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(connection,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener
+
+
+def measure(base_port, rounds, delay, send_workers):
+    """
+    :return: Latencies of the healthy neighbour in seconds, one per round.
+    :rtype: list
+    """
+    slow = start_slow_neighbour(base_port, delay)
+    receiver = Stream(LOCALHOST, base_port + 1)
+    sender = Stream(LOCALHOST, base_port + 2, send_workers=send_workers)
+    slow_address = (LOCALHOST, str(base_port))
+    sender.add_node(slow_address)
+    sender.add_node(receiver.get_server_address())
+
+    buf = bytes(PacketFactory.new_message_packet("x" * 100, sender.get_server_address()).get_buf())
+    latencies = []
+    for _ in range(rounds):
+        sender.add_message_to_out_buff(slow_address, buf)
+        sender.add_message_to_out_buff(receiver.get_server_address(), buf)
+        start = time.time()
+        sender.send_out_buf_messages()
+        # Like the main loop of a Peer, flush again until the packet has arrived.
+        while not receiver.pop_in_buf():
+            receiver.wait_for_in_buf(0.001)
+            sender.send_out_buf_messages()
+        latencies.append(time.time() - start)
+    for node in sender.nodes:
+        node.wait_for_pending_send()
+    slow.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds the slow neighbour waits per packet.")
+    parser.add_argument("--base-port", type=int, default=34000)
+    args = parser.parse_args()
+
+    print("%-14s %12s %12s" % ("send_workers", "median ms", "max ms"))
+    for index, send_workers in enumerate((0, 4)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = measure(args.base_port + 3 * index, args.rounds, args.delay, send_workers)
+        print("%-14d %12.2f %12.2f" % (send_workers, statistics.median(latencies) * 1e3, max(latencies) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
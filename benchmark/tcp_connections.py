@@ -0,0 +1,66 @@
+"""
+    A TCPServer with thousands of concurrent local connections.
+
+    We open N connections to a TCPServer whose callback answers every packet with b'ACK', then in every round each
+    connection sends one Message packet and we wait until every connection has its b'ACK'. With select.select the
+    server would be limited to FD_SETSIZE (1024) sockets and pay O(N) per wake up; The selectors based server
+    uses epoll on Linux.
+
+    The process needs a file descriptor per connection on both sides; Raise the limit first if necessary:
+
+        ulimit -n 20000
+        python -m benchmark.tcp_connections --connections 5000 --rounds 5
+"""
+import argparse
+import resource
+import socket
+import threading
+import time
+
+from src.Packet import PacketFactory
+from src.tools.simpletcp.tcpserver import TCPServer
+
+LOCALHOST = "127.000.000.001"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=35000)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = 2 * args.connections + 64
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    server = TCPServer("127.0.0.1", args.port, lambda ip, queue, data: queue.put(b'ACK'),
+                       maximum_connections=socket.SOMAXCONN, recv_bytes=65536,
+                       frame_length=PacketFactory.get_frame_length)
+    threading.Thread(target=server.run, daemon=True).start()
+    time.sleep(0.2)
+
+    start = time.time()
+    connections = [socket.create_connection(("127.0.0.1", args.port)) for _ in range(args.connections)]
+    print("%d connections opened in %.3f s" % (len(connections), time.time() - start))
+
+    packet = bytes(PacketFactory.new_message_packet("x" * 100, (LOCALHOST, str(args.port))).get_buf())
+    print("%-8s %10s %14s" % ("round", "seconds", "packets/s"))
+    for r in range(args.rounds):
+        start = time.time()
+        for connection in connections:
+            connection.sendall(packet)
+        for connection in connections:
+            received = b''
+            while len(received) < 3:
+                received += connection.recv(3 - len(received))
+        seconds = time.time() - start
+        print("%-8d %10.3f %14.0f" % (r, seconds, len(connections) / seconds))
+
+    for connection in connections:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+    Throughput of Message packets between two local Streams.
+
+    One Stream buffers N Message packets for the other and flushes them with send_out_buf_messages; we measure the
+    time until all of them are in the input buffer of the receiver.
+    The benchmark compares the per-packet b'ACK' mode of Node with the pipelined mode, both with and without
+    packing the packets into Batch packets.
+
+    Run from the repository root:
+
+        python -m benchmark.throughput --messages 5000 --size 100
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from src.Packet import PacketFactory
+from src.Stream import Stream
+
+LOCALHOST = "127.000.000.001"
+
+
+def measure(base_port, messages, size, pipelined, flush_every, batch_bytes=None):
+    """
+    :return: Seconds needed to deliver every message.
+    :rtype: float
+    """
+    receiver = Stream(LOCALHOST, base_port)
+    sender = Stream(LOCALHOST, base_port + 1, pipelined=pipelined, batch_bytes=batch_bytes)
+    sender.add_node(receiver.get_server_address())
+
+    buf = PacketFactory.new_message_packet("x" * size, sender.get_server_address()).get_buf()
+    received = 0
+    start = time.time()
+    for i in range(messages):
+        sender.add_message_to_out_buff(receiver.get_server_address(), buf)
+        if (i + 1) % flush_every == 0:
+            sender.send_out_buf_messages()
+    sender.send_out_buf_messages()
+    while received < messages:
+        receiver.wait_for_in_buf(1)
+        received += len(PacketFactory.unpack_batches(receiver.pop_in_buf()))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=100, help="Message body size in characters.")
+    parser.add_argument("--flush-every", type=int, default=100, help="Messages buffered between two flushes.")
+    parser.add_argument("--batch-bytes", type=int, default=16384, help="Body size limit of the Batch packets.")
+    parser.add_argument("--base-port", type=int, default=33000)
+    args = parser.parse_args()
+
+    print("%-18s %10s %14s %12s" % ("mode", "seconds", "messages/s", "MB/s"))
+    modes = [(pipelined, batch_bytes) for batch_bytes in (None, args.batch_bytes) for pipelined in (False, True)]
+    for index, (pipelined, batch_bytes) in enumerate(modes):
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = measure(args.base_port + 2 * index, args.messages, args.size, pipelined, args.flush_every,
+                              batch_bytes)
+        mode = ("pipelined" if pipelined else "ack") + (" batched" if batch_bytes else "")
+        print("%-18s %10.3f %14.0f %12.2f" % (mode, seconds, args.messages / seconds,
+                                              args.messages * (args.size + 20) / seconds / 1e6))
+
+
+if __name__ == "__main__":
+    main()
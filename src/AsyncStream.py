@@ -0,0 +1,110 @@
+from src.Stream import Stream
+from src.Packet import PacketFactory
+from src.tools.AsyncNode import AsyncNode
+from src.tools.Node import Node
+import asyncio
+import threading
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AsyncStream(Stream):
+    """
+    A Stream whose TCP server and outbound Node connections all live on one asyncio event loop.
+
+    Only a single Thread runs the event loop no matter how many Nodes we have, and every Node has its own writer
+    task, so a slow neighbour never blocks sending to the others.
+    The packets on the wire and the Stream API are the same as the thread based Stream.
+    """
+
+    def _start_server(self, ip, port):
+        """
+        Start the event loop Thread and bind our server on it.
+
+        :param ip: 15 characters
+        :param port: 5 characters
+
+        :return:
+        """
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+        log.info("Binding server: %s: %s", ip, port)
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle_connection, AsyncNode.socket_ip(ip), int(port)), self._loop).result()
+
+    def _close_server(self):
+        """
+        Close our server, cancel the tasks of our connections and stop the event loop once they have finished.
+
+        :return:
+        """
+        async def close():
+            self._server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self._loop).add_done_callback(
+            lambda _: self._loop.call_soon_threadsafe(self._loop.stop))
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Read every packet an incoming connection sends and answer each of them with b'ACK'.
+
+        Packets are framed by the Length field of their headers, so they may be split or coalesced by TCP freely.
+
+        :param reader: Reader side of the connection.
+        :param writer: Writer side of the connection.
+
+        :type reader: asyncio.StreamReader
+        :type writer: asyncio.StreamWriter
+
+        :return:
+        """
+        try:
+            while True:
+                header = await reader.readexactly(20)
+                data = header + await reader.readexactly(PacketFactory.get_frame_length(header) - 20)
+                writer.write(bytes('ACK', 'utf8'))
+                self._buffer_in_data(data)
+                await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def get_server_address(self):
+        """
+
+        :return: Our server address
+        :rtype: tuple
+        """
+        return Node.parse_ip(self.ip), Node.parse_port(self.port)
+
+    def add_node(self, server_address, set_register_connection=False):
+        """
+        Will add new AsyncNode to our Stream.
+
+        :param server_address: New node TCPServer address
+        :param set_register_connection: Shows that is this connection a register_connection or not.
+
+        :type server_address: tuple
+        :type set_register_connection: bool
+
+        :return: The node of the address.
+        :rtype: AsyncNode
+        """
+        node = self._find_node(server_address, set_register_connection)
+        if node is not None:
+            return node
+        log.debug("Trying to connect to this address: %s", server_address)
+        node = AsyncNode(server_address, self._loop, set_register=set_register_connection,
+                         connection_pool=self.connections, clock=self.clock, **self.queue_options,
+                         **self._batch_options(set_register_connection))
+
+        self._index_node(node)
+        return node
@@ -39,9 +39,12 @@
         03: Join
         04: Message
         05: Reunion
+        06: Batch
+        07: Fragment
                 e.g: type = '02' => advertise packet.
     Length:
-        This field shows the character numbers for Body of the packet.
+        This field shows the number of bytes of the Body of the packet in the network format; Bodies with
+        non-ASCII text in UTF-8 are longer than their number of characters.
 
     Server IP/Port:
         We need this field for response packet in non-blocking mode.
@@ -59,9 +62,13 @@
                 |                  IP (15 Chars)                 |
                 |------------------------------------------------|
                 |                 Port (5 Chars)                 |
+                |------------------------------------------------|
+                |          Capacity (2 Chars, Optional)          |
                 |________________________________________________|
                 
                 For sending IP/Port of current node to the root to ask if it can register to network or not.
+                A node can also hint how many children it can accept in the tree with Capacity; Without it the
+                root uses its own default fan-out for this node.
             Response:
         
                                  ** Body Format **
@@ -101,22 +108,73 @@
                                 ** Body Format **
                  ________________________________________________
                 |                 JOIN (4 Chars)                 |
+                |------------------------------------------------|
+                |       Codec0 ... CodecN (4 Chars each)         |
                 |________________________________________________|
             
             New node after getting Advertise Response from root must send this packet to specified peer 
             to tell him that they should connect together; When receiving this packet we should update our 
             Client Dictionary in Stream object.
+
+            The optional codec list names the Message codecs the new node accepts; A peer which receives a Join
+            with a codec list answers with a Join of type JACK instead of JOIN and its own codec list, so both
+            ends of the link know what the other one accepts. Without a codec list only uncompressed messages
+            are sent over the link.
             
             For next version Join packet must contain a field for validation the joining action.
             
         Message:
                                 ** Body Format **
                  ________________________________________________
-                |             Message (#Length Chars)            |
+                |             Message ID (16 Chars)              |
+                |------------------------------------------------|
+                |               Codec (4 Chars)                  |
+                |------------------------------------------------|
+                |             Message (#Length - 20 Bytes)       |
                 |________________________________________________|
 
-            The message that want to broadcast to hole network. Right now this type only includes a plain text.
+            The message that want to broadcast to hole network; Any bytes, e.g. a text in UTF-8.
+            The origin of the message gives it a random ID in hexadecimal; Relays do not change it, so every peer
+            can recognise a message it has already seen and stop broadcasting it again.
+            Codec is 'none' for an uncompressed message, otherwise the name of the codec the origin has compressed
+            the message with, e.g. 'zlib'. Relays forward the compressed message as it is to the neighbours
+            which accept the codec, and an uncompressed copy to the others.
         
+        Fragment:
+                                ** Body Format **
+                 ________________________________________________
+                |             Message ID (16 Chars)              |
+                |------------------------------------------------|
+                |               Codec (4 Chars)                  |
+                |------------------------------------------------|
+                |              Index (8 Chars)                   |
+                |------------------------------------------------|
+                |              Count (8 Chars)                   |
+                |------------------------------------------------|
+                |             Data (#Length - 36 Bytes)          |
+                |________________________________________________|
+
+            A large message is broadcast as Count Fragment packets of the same Message ID; Fragment Index (from 0)
+            carries the Index-th slice of the message. Every fragment is compressed on its own, so a relay handles
+            and forwards each fragment as soon as it arrives instead of waiting for the whole message, and peers
+            reassemble the message once all of its fragments are there. Duplicates are recognised by Message ID
+            and Index.
+
+        Batch:
+                                ** Body Format **
+                 ________________________________________________
+                |         Packet0 (Header + Body of Packet0)     |
+                |------------------------------------------------|
+                |         Packet1 (Header + Body of Packet1)     |
+                |------------------------------------------------|
+                |                     ...                        |
+                |________________________________________________|
+
+            Several packets for the same neighbour, back-to-back in the network format; Length is the number of
+            bytes of all of them. Every packet inside is framed by its own Length field, so the receiver handles
+            them one by one as if they had arrived separately. A Batch costs one header and one b'ACK' for all of
+            its packets.
+
         Reunion:
             Hello:
         
@@ -169,10 +227,44 @@
 
                 Root in answer of the Reunion Hello message will send this packet to the target node.
                 In this packet all the nodes (ip, port) exist in order by path traversal to target.
+
+            Aggregated Hello:
+
+                                    ** Body Format **
+                 ________________________________________________
+                |                  AGG (3 Chars)                 |
+                |------------------------------------------------|
+                |           Number of Entries (5 Chars)          |
+                |------------------------------------------------|
+                |                 IP0 (15 Chars)                 |
+                |------------------------------------------------|
+                |                Port0 (5 Chars)                 |
+                |------------------------------------------------|
+                |                     ...                        |
+                |------------------------------------------------|
+                |                 IPN (15 Chars)                 |
+                |------------------------------------------------|
+                |                PortN (5 Chars)                 |
+                |________________________________________________|
+
+                In aggregation mode, instead of forwarding every Reunion Hello of its sub-tree separately, a peer
+                collects the addresses of the Aggregated Hello packets it receives from its children and sends them
+                together with its own address in one Aggregated Hello to its parent in every interval.
+
+            Aggregated Hello Back:
+
+                The same format with AGG replaced by AGB.
+                Root answers every Aggregated Hello with one Aggregated Hello Back of the same addresses; Every peer
+                takes its own address out and sends the others to the children it has received them from.
             
     
 """
 from struct import *
+from src.tools.Codec import NO_CODEC, get_codec
+import os
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class Packet:
@@ -237,22 +329,25 @@ class Packet:
         :rtype: bytearray
         """
 
-        packet = bytearray(self._length + 20)
+        body = self._body.encode('UTF-8')
+        # Length in the network format is the number of body bytes, which is not the number of characters for
+        # non-ASCII text.
+        length = len(body)
+
+        packet = bytearray(length + 20)
 
         pack_into('!h', packet, 0, self._version)
 
         pack_into('!h', packet, 2, self._type)
 
-        pack_into('!l', packet, 4, self._length)
+        pack_into('!l', packet, 4, length)
 
         ip_elements = [int(x) for x in self._source_server_ip.split('.')]
         pack_into('!hhhh', packet, 8, ip_elements[0], ip_elements[1], ip_elements[2], ip_elements[3])
 
         pack_into('!i', packet, 16, int(self._source_server_port))
 
-        fmt = str(int(self._length)) + 's'
-
-        pack_into('!' + fmt, packet, 20, self._body.encode('UTF-8'))
+        packet[20:] = body
 
         return packet
 
@@ -282,23 +377,175 @@ class Packet:
         return self.get_source_server_ip(), self.get_source_server_port()
 
 
+_HEADER = Struct('!hhlhhhhi')
+_VERSION = Struct('!h')
+_TYPE = Struct('!h')
+_LENGTH = Struct('!l')
+_IP = Struct('!hhhh')
+_PORT = Struct('!i')
+_ADDRESS = Struct('!hhhhi')
+
+
+class BinaryPacket:
+    """
+    A Packet variant which wraps the network buffer itself.
+
+    Header fields are decoded lazily from the buffer with precompiled Structs when they are asked for and get_buf
+    returns the wrapped buffer without copying; So a received packet costs almost nothing until it is used.
+    Every getter returns the same values as the Packet getters.
+    """
+
+    __slots__ = ('_buf', '_body')
+
+    def __init__(self, buf):
+        """
+
+        :param buf: One packet in the network format.
+        :type buf: bytes | bytearray | memoryview
+        """
+        self._buf = buf
+        self._body = None
+
+    @staticmethod
+    def from_fields(version, type, source_server_address, body):
+        """
+        Serialise a new packet with a single pack_into of the header into a preallocated buffer.
+
+        Warnings:
+            1. The Length field will be the number of body bytes; A str body is encoded in UTF-8.
+
+        :param version: Packet version
+        :param type: Packet type
+        :param source_server_address: Server address of the packet sender; The format is like
+                                      ('192.168.001.001', '05335').
+        :param body: Packet body
+
+        :type version: int
+        :type type: int
+        :type source_server_address: tuple
+        :type body: str | bytes
+
+        :rtype: BinaryPacket
+        """
+        if isinstance(body, str):
+            body = body.encode('UTF-8')
+        buf = bytearray(20 + len(body))
+        ip = source_server_address[0].split('.')
+        _HEADER.pack_into(buf, 0, version, type, len(body), int(ip[0]), int(ip[1]), int(ip[2]), int(ip[3]),
+                          int(source_server_address[1]))
+        buf[20:] = body
+        return BinaryPacket(buf)
+
+    def get_header(self):
+        """
+
+        :return: Packet header in the network format.
+        :rtype: bytes
+        """
+        return bytes(self._buf[:20])
+
+    def get_version(self):
+        """
+
+        :return: Packet Version
+        :rtype: int
+        """
+        return _VERSION.unpack_from(self._buf, 0)[0]
+
+    def get_type(self):
+        """
+
+        :return: Packet type
+        :rtype: int
+        """
+        return _TYPE.unpack_from(self._buf, 2)[0]
+
+    def get_length(self):
+        """
+
+        :return: Packet length
+        :rtype: int
+        """
+        return _LENGTH.unpack_from(self._buf, 4)[0]
+
+    def get_body(self):
+        """
+        The body is decoded only once, the first time it is asked for.
+
+        :return: Packet body
+        :rtype: str
+        """
+        if self._body is None:
+            self._body = bytes(self._buf[20:20 + self.get_length()]).decode('utf-8')
+        return self._body
+
+    def get_buf(self):
+        """
+
+        :return The packet in the network format; It is the wrapped buffer itself.
+        :rtype: bytes | bytearray | memoryview
+        """
+        return self._buf
+
+    def get_source_server_ip(self):
+        """
+
+        :return: Server IP address for sender of the packet.
+        :rtype: str
+        """
+        return '%03d.%03d.%03d.%03d' % _IP.unpack_from(self._buf, 8)
+
+    def get_source_server_port(self):
+        """
+
+        :return: Server Port address for sender of the packet.
+        :rtype: str
+        """
+        return '%05d' % _PORT.unpack_from(self._buf, 16)[0]
+
+    def get_source_server_address(self):
+        """
+
+        :return: Server address; The format is like ('192.168.001.001', '05335').
+        :rtype: tuple
+        """
+
+        return self.get_source_server_ip(), self.get_source_server_port()
+
+
 class PacketFactory:
     """
     This class is only for making Packet objects.
     """
 
+    # The largest Length field we accept; A connection announcing a bigger packet is closed before we buffer it.
+    MAX_PACKET_LENGTH = 16 * 1024 * 1024
+    # Characters of the Message ID at the start of every Message body.
+    MESSAGE_ID_LENGTH = 16
+    # Bytes of a Fragment body before its data: Message ID, Codec, Index and Count.
+    FRAGMENT_HEADER_LENGTH = 16 + 4 + 8 + 8
+    # Default number of message bytes in one Fragment packet.
+    FRAGMENT_SIZE = 64 * 1024
+    # Type field -> name of the packet type.
+    TYPE_NAMES = {1: "Register", 2: "Advertise", 3: "Join", 4: "Message", 5: "Reunion", 6: "Batch", 7: "Fragment"}
+
     @staticmethod
-    def parse_buffer(buffer):
+    def parse_buffer(buffer, lazy=True):
 
         """
         In this function we will make a new Packet from input buffer with struct.unpack_from method.
 
         :param buffer: The buffer that should be parse to a validate packet format
+        :param lazy: Wrap the buffer in a BinaryPacket instead of decoding it into a string based Packet.
+
+        :type lazy: bool
 
         :return new packet
-        :rtype: Packet
+        :rtype: Packet | BinaryPacket
 
         """
+        if lazy:
+            return BinaryPacket(buffer)
 
         version = str(unpack_from('!h', buffer)[0])
         type = str(unpack_from('!h', buffer, offset=2)[0]).zfill(2)
@@ -314,12 +561,70 @@ class PacketFactory:
 
         return Packet(buf=buffer)
 
+    @staticmethod
+    def new_relay_buffer(packet, source_server_address):
+        """
+        Make the network format of 'packet' with a new source server address in a single copy; The body is copied
+        as it is without being decoded or encoded again.
+
+        :param packet: The packet we want to relay.
+        :param source_server_address: Server address of the relaying peer.
+
+        :type packet: Packet | BinaryPacket
+        :type source_server_address: tuple
+
+        :return: The relayed packet in the network format.
+        :rtype: bytes
+        """
+        buf = memoryview(packet.get_buf())
+        ip = source_server_address[0].split('.')
+        address = _ADDRESS.pack(int(ip[0]), int(ip[1]), int(ip[2]), int(ip[3]), int(source_server_address[1]))
+        return b''.join((buf[:8], address, buf[20:]))
+
+    @staticmethod
+    def get_type_name(buffer):
+        """
+        Name the type of a packet from its network format without parsing it.
+
+        :param buffer: A packet in the network format.
+        :type buffer: bytes
+
+        :return: The name in TYPE_NAMES, or the Type field as a str if it is unknown.
+        :rtype: str
+        """
+        packet_type = _TYPE.unpack_from(buffer, 2)[0]
+        return PacketFactory.TYPE_NAMES.get(packet_type, str(packet_type))
+
+    @staticmethod
+    def get_frame_length(buffer):
+        """
+        Find the size of the first packet in a stream of back-to-back packets by the Length field of its header.
+
+        :param buffer: Bytes received from a connection.
+        :type buffer: bytearray
+
+        :return: Header plus body size of the first packet; None if the header has not been received completely.
+        :rtype: int
+
+        :raise ValueError: If the Length field is negative or bigger than MAX_PACKET_LENGTH.
+        """
+        if len(buffer) < 20:
+            return None
+        length = unpack_from('!l', buffer, offset=4)[0]
+        if length < 0:
+            raise ValueError('Negative packet length.')
+        if length > PacketFactory.MAX_PACKET_LENGTH:
+            raise ValueError('Packet length is bigger than the maximum.')
+        return 20 + length
+
     @staticmethod
     def new_reunion_packet(type, source_address, nodes_array):
         """
-        :param type: Reunion Hello (REQ) or Reunion Hello Back (RES)
+        :param type: Reunion Hello (REQ), Reunion Hello Back (RES), Aggregated Hello (AGG) or Aggregated Hello Back
+                     (AGB)
         :param source_address: IP/Port address of the packet sender.
-        :param nodes_array: [(ip0, port0), (ip1, port1), ...] It is the path to the 'destination'.
+        :param nodes_array: [(ip0, port0), (ip1, port1), ...] It is the path to the 'destination'; For aggregated
+                            types it is the set of the nodes that have said hello.
 
         :type type: str
         :type source_address: tuple
@@ -331,25 +636,55 @@ class PacketFactory:
         """
         version = '1'
         packet_type = '05'
-        if type == 'REQ':
-            body = 'REQ'
-        elif type == 'RES':
-            body = 'RES'
+        if type == 'REQ' or type == 'RES':
+            number_of_entity = str(len(nodes_array)).zfill(2)
+        elif type == 'AGG' or type == 'AGB':
+            number_of_entity = str(len(nodes_array)).zfill(5)
         else:
             return None
 
-        number_of_entity = str(len(nodes_array)).zfill(2)
-
-        print("Creating Reunion packet")
+        log.debug("Creating Reunion packet")
 
-        body = body + number_of_entity
-        for (ip, port) in nodes_array:
-            body = body + ip
-            body = body + port
+        body = type + number_of_entity + ''.join(ip + port for (ip, port) in nodes_array)
         length = str(len(body)).zfill(8)
 
         return Packet(version + packet_type + length + source_address[0] + source_address[1] + body)
 
+    @staticmethod
+    def new_reunion_hello_back(packet, source_address):
+        """
+        Make the answer of the root for a Reunion Hello packet.
+
+        :param packet: The arrived Reunion Hello packet.
+        :param source_address: IP/Port address of the root.
+
+        :type packet: Packet | BinaryPacket
+        :type source_address: tuple
+
+        :return: Address of the node which has said hello, address of the node the answer should be sent to and the
+                 new Reunion Hello Back packet.
+        :rtype: tuple
+        """
+        body = packet.get_body()
+        number_of_entity = int(body[3:5])
+        nodes_array = [(body[i:i + 15], body[i + 15:i + 20]) for i in range(5, 5 + number_of_entity * 20, 20)]
+        nodes_array.reverse()
+        return nodes_array[-1], nodes_array[0], PacketFactory.new_reunion_packet('RES', source_address, nodes_array)
+
+    @staticmethod
+    def parse_aggregated_reunion_body(body):
+        """
+        Extract the addresses of an Aggregated Hello or Aggregated Hello Back body.
+
+        :param body: Packet body.
+        :type body: str
+
+        :return: [(ip0, port0), (ip1, port1), ...]
+        :rtype: list
+        """
+        number_of_entity = int(body[3:8])
+        return [(body[i:i + 15], body[i + 15:i + 20]) for i in range(8, 8 + number_of_entity * 20, 20)]
+
     @staticmethod
     def new_advertise_packet(type, source_server_address, neighbor=None):
         """
@@ -365,14 +700,14 @@ class PacketFactory:
         :rtype Packet
 
         """
-        print("Creating advertisement packet")
+        log.debug("Creating advertisement packet")
         version = '1'
         packet_type = '02'
 
         if type == 'REQ':
             body = 'REQ'
             length = '3'.zfill(8)
-            print("Request adv packet created")
+            log.debug("Request adv packet created")
             return Packet(
                 version + packet_type + length + source_server_address[0] + source_server_address[1].zfill(5) + body)
 
@@ -383,65 +718,89 @@ class PacketFactory:
                 body += neighbor[1]
                 length = '23'.zfill(8)
 
-                print("Response adv packet created")
+                log.debug("Response adv packet created")
                 return Packet(
                     version + packet_type + length + source_server_address[0] + source_server_address[1].zfill(
                         5) + body)
             except Exception as e:
-                print(str(e))
+                log.warning("Can not create the advertise packet: %s", e)
                 # print()
         else:
             raise Exception("Type is incorrect")
 
     @staticmethod
-    def new_join_packet(source_server_address):
+    def new_join_packet(source_server_address, codecs=(), type='JOIN'):
         """
         :param source_server_address: Server address of the packet sender.
+        :param codecs: Names of the Message codecs the sender accepts.
+        :param type: JOIN, or JACK for the answer of a Join with a codec list.
 
         :type source_server_address: tuple
+        :type codecs: list
+        :type type: str
 
         :return New join packet.
         :rtype Packet
 
         """
-        print("Creating join packet")
+        if type != 'JOIN' and type != 'JACK':
+            raise Exception("Irregular join type.")
+        log.debug("Creating join packet")
         version = '1'
         packet_type = '03'
-        length = '4'.zfill(8)
-        body = 'JOIN'
+        body = type + ''.join(codecs)
+        length = str(len(body)).zfill(8)
 
         return Packet(
             version + packet_type + length + source_server_address[0] + source_server_address[1].zfill(5) + body)
 
     @staticmethod
-    def new_register_packet(type, source_server_address, address=(None, None)):
+    def parse_join_codecs(body):
+        """
+        Extract the codec list of a Join body.
+
+        :param body: Packet body.
+        :type body: str
+
+        :return: Codec names.
+        :rtype: list
+        """
+        return [body[i:i + 4] for i in range(4, len(body) - 3, 4)]
+
+    @staticmethod
+    def new_register_packet(type, source_server_address, address=(None, None), capacity=None):
         """
         :param type: Type of Register packet
         :param source_server_address: Server address of the packet sender.
         :param address: If type is request we need address; The format is like ('192.168.001.001', '05335').
+        :param capacity: For request type; Maximum number of children the sender accepts in the tree (1 to 99).
 
         :type type: str
         :type source_server_address: tuple
         :type address: tuple
+        :type capacity: int
 
         :return New Register packet.
         :rtype Packet
 
         """
-        print("Creating register packet")
+        if capacity is not None and not 1 <= capacity <= 99:
+            raise Exception("Capacity must be between 1 and 99.")
+        log.debug("Creating register packet")
         version = "1"
         packet_type = "01"
 
         if type == "REQ":
-            length = "23".zfill(8)
             body = "REQ" + '.'.join(str(int(part)).zfill(3) for part in source_server_address[0].split('.')) + \
                    str(source_server_address[1]).zfill(5)
-            print("Request register packet created")
-            print("Address for packet is: ", address)
+            if capacity is not None:
+                body += str(capacity).zfill(2)
+            length = str(len(body)).zfill(8)
+            log.debug("Request register packet created; Address for packet is: %s", address)
         elif type == "RES":
             length = "6".zfill(8)
             body = "RESACK"
-            print("Response register packet created")
+            log.debug("Response register packet created")
         else:
             raise Exception("Irregular register type.")
 
@@ -451,23 +810,339 @@ class PacketFactory:
         pass
 
     @staticmethod
-    def new_message_packet(message, source_server_address):
+    def new_message_packet(message, source_server_address, message_id=None, codec=None, compression_threshold=0):
         """
         Packet for sending a broadcast message to hole network.
 
-        :param message: Our message
+        :param message: Our message; A str is sent in UTF-8.
         :param source_server_address: Server address of the packet sender.
+        :param message_id: MESSAGE_ID_LENGTH hexadecimal characters; None makes a new random ID.
+        :param codec: Name of a registered codec to compress the message with; None sends it uncompressed.
+        :param compression_threshold: Messages shorter than this many bytes are not compressed.
 
-        :type message: str
+        :type message: str | bytes
         :type source_server_address: tuple
+        :type message_id: str
+        :type codec: str
+        :type compression_threshold: int
 
-        :return: New Message packet.
-        :rtype: Packet
+        :return: New Message packet
+        :rtype: BinaryPacket
         """
-        version = '1'
-        packet_type = '04'
-        body = message
-        length = str(len(message)).zfill(8)
-        print("Message packet created")
-        return Packet(
-            version + packet_type + length + source_server_address[0] + source_server_address[1].zfill(5) + body)
+        message_id = PacketFactory.__check_message_id(message_id)
+        log.debug("Message packet created")
+        if isinstance(message, str):
+            message = message.encode('UTF-8')
+        codec, data = PacketFactory.__compress(message, codec, compression_threshold)
+        return BinaryPacket.from_fields(1, 4, source_server_address, (message_id + codec).encode('ascii') + data)
+
+    @staticmethod
+    def new_fragment_packets(message, source_server_address, message_id=None, codec=None, compression_threshold=0,
+                             fragment_size=FRAGMENT_SIZE):
+        """
+        Split a large message into Fragment packets of the same Message ID.
+
+        :param message: Our message; A str is sent in UTF-8.
+        :param source_server_address: Server address of the packet sender.
+        :param message_id: MESSAGE_ID_LENGTH hexadecimal characters; None makes a new random ID.
+        :param codec: Name of a registered codec to compress every fragment with; None sends them uncompressed.
+        :param compression_threshold: Fragments shorter than this many bytes are not compressed.
+        :param fragment_size: Message bytes in every fragment.
+
+        :type message: str | bytes
+        :type source_server_address: tuple
+        :type message_id: str
+        :type codec: str
+        :type compression_threshold: int
+        :type fragment_size: int
+
+        :return: The Fragment packets in order.
+        :rtype: list
+        """
+        message_id = PacketFactory.__check_message_id(message_id)
+        if fragment_size < 1:
+            raise Exception("Fragment size must be positive.")
+        if isinstance(message, str):
+            message = message.encode('UTF-8')
+        view = memoryview(message)
+        count = max(1, -(-len(message) // fragment_size))
+        if count > 99999999:
+            raise Exception("Too many fragments.")
+
+        packets = []
+        for index in range(count):
+            fragment_codec, data = PacketFactory.__compress(view[index * fragment_size:(index + 1) * fragment_size],
+                                                            codec, compression_threshold)
+            fields = '%s%s%08d%08d' % (message_id, fragment_codec, index, count)
+            packets.append(BinaryPacket.from_fields(1, 7, source_server_address, fields.encode('ascii') + data))
+        return packets
+
+    @staticmethod
+    def __check_message_id(message_id):
+        """
+
+        :param message_id: A Message ID or None.
+        :type message_id: str
+
+        :return: The Message ID; A new random one for None.
+        :rtype: str
+        """
+        if message_id is None:
+            return PacketFactory.new_message_id()
+        if len(message_id) != PacketFactory.MESSAGE_ID_LENGTH:
+            raise Exception("Irregular message ID.")
+        return message_id
+
+    @staticmethod
+    def __compress(data, codec, compression_threshold):
+        """
+        Compress the data if it is long enough and the codec makes it shorter.
+
+        :param data: Uncompressed data.
+        :param codec: Codec name or None.
+        :param compression_threshold: Data shorter than this many bytes is not compressed.
+
+        :type data: bytes | memoryview
+        :type codec: str
+        :type compression_threshold: int
+
+        :return: The name of the codec the data has been compressed with, NO_CODEC if it has not, and the data.
+        :rtype: tuple
+        """
+        if codec is None:
+            return NO_CODEC, data
+        if get_codec(codec) is None:
+            raise Exception("Unknown codec.")
+        if len(data) >= compression_threshold:
+            compressed = get_codec(codec).compress(data)
+            if len(compressed) < len(data):
+                return codec, compressed
+        return NO_CODEC, data
+
+    @staticmethod
+    def new_batch_buffer(buffers, source_server_address):
+        """
+        Pack several packets into one Batch packet.
+
+        :param buffers: Packets in the network format.
+        :param source_server_address: Server address of the packet sender.
+
+        :type buffers: list
+        :type source_server_address: tuple
+
+        :return: The Batch packet in the network format.
+        :rtype: bytes
+        """
+        buffers = [bytes(b) for b in buffers]
+        ip = source_server_address[0].split('.')
+        header = _HEADER.pack(1, 6, sum(len(b) for b in buffers), int(ip[0]), int(ip[1]), int(ip[2]), int(ip[3]),
+                              int(source_server_address[1]))
+        return b''.join([header] + buffers)
+
+    @staticmethod
+    def split_batch(packet):
+        """
+        Take the packets out of a Batch packet.
+
+        :param packet: A Batch packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: The packets inside in the network format; A truncated packet at the end is left out.
+        :rtype: list
+
+        :raise ValueError: If a Length field inside is negative or bigger than MAX_PACKET_LENGTH.
+        """
+        buf = bytes(packet.get_buf())
+        end = min(len(buf), 20 + packet.get_length())
+        buffers = []
+        offset = 20
+        while offset < end:
+            length = PacketFactory.get_frame_length(buf[offset:offset + 20])
+            if length is None or offset + length > end:
+                log.warning("Truncated packet in a Batch packet.")
+                break
+            buffers.append(buf[offset:offset + length])
+            offset += length
+        return buffers
+
+    @staticmethod
+    def unpack_batches(buffers):
+        """
+        Replace every Batch packet in a list of arrived packets with the packets inside it.
+
+        :param buffers: Packets in the network format.
+        :type buffers: list
+
+        :return: Packets in the network format in arrival order.
+        :rtype: list
+        """
+        unpacked = []
+        for b in buffers:
+            packet = BinaryPacket(b)
+            if len(b) >= 20 and packet.get_version() == 1 and packet.get_type() == 6:
+                try:
+                    unpacked.extend(PacketFactory.split_batch(packet))
+                except ValueError:
+                    log.warning("Corrupted Batch packet.")
+            else:
+                unpacked.append(b)
+        return unpacked
+
+    @staticmethod
+    def new_message_id():
+        """
+
+        :return: A random Message ID.
+        :rtype: str
+        """
+        return os.urandom(PacketFactory.MESSAGE_ID_LENGTH // 2).hex()
+
+    @staticmethod
+    def get_message_id(packet):
+        """
+        Read the Message ID of a Message packet straight from its buffer, without decoding the body.
+
+        :param packet: A Message packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Message ID
+        :rtype: str
+        """
+        return bytes(packet.get_buf()[20:20 + PacketFactory.MESSAGE_ID_LENGTH]).decode('ascii', 'replace')
+
+    @staticmethod
+    def get_message_codec(packet):
+        """
+        Read the Codec field of a Message packet straight from its buffer.
+
+        :param packet: A Message packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Codec name; NO_CODEC for an uncompressed message.
+        :rtype: str
+        """
+        start = 20 + PacketFactory.MESSAGE_ID_LENGTH
+        return bytes(packet.get_buf()[start:start + 4]).decode('ascii', 'replace')
+
+    @staticmethod
+    def parse_message(packet):
+        """
+        Extract the fields of a Message packet whose message is a text.
+
+        :param packet: A Message packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Message ID and the message.
+        :rtype: tuple
+
+        :raise ValueError: If the message is compressed with a codec we do not know, can not be decompressed or is
+                           not UTF-8.
+        """
+        message_id, data = PacketFactory.parse_message_data(packet)
+        return message_id, data.decode('UTF-8')
+
+    @staticmethod
+    def parse_message_data(packet):
+        """
+        Extract the fields of a Message packet and decompress its message.
+
+        :param packet: A Message packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Message ID and the message.
+        :rtype: tuple
+
+        :raise ValueError: If the message is compressed with a codec we do not know or can not be decompressed.
+        """
+        start = 20 + PacketFactory.MESSAGE_ID_LENGTH + 4
+        return PacketFactory.get_message_id(packet), PacketFactory.__decompress(packet, start)
+
+    @staticmethod
+    def parse_fragment(packet):
+        """
+        Extract the fields of a Fragment packet and decompress its data.
+
+        :param packet: A Fragment packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Message ID, Index, Count and the data of the fragment.
+        :rtype: tuple
+
+        :raise ValueError: If a field is irregular or the data can not be decompressed.
+        """
+        start = 20 + PacketFactory.MESSAGE_ID_LENGTH + 4
+        fields = bytes(packet.get_buf()[start:start + 16])
+        if len(fields) != 16 or not fields.isdigit():
+            raise ValueError("Irregular fragment fields.")
+        index, count = int(fields[0:8]), int(fields[8:16])
+        if not 0 <= index < count:
+            raise ValueError("Irregular fragment index.")
+        data = PacketFactory.__decompress(packet, 20 + PacketFactory.FRAGMENT_HEADER_LENGTH)
+        return PacketFactory.get_message_id(packet), index, count, data
+
+    @staticmethod
+    def get_fragment_key(packet):
+        """
+        Read the Message ID and Index of a Fragment packet straight from its buffer; They tell duplicate fragments
+        apart like Message IDs do for Message packets.
+
+        :param packet: A Fragment packet.
+        :type packet: Packet | BinaryPacket
+
+        :return: Message ID followed by Index.
+        :rtype: str
+        """
+        start = 20 + PacketFactory.MESSAGE_ID_LENGTH
+        return PacketFactory.get_message_id(packet) + bytes(packet.get_buf()[start + 4:start + 12]).decode('ascii',
+                                                                                                            'replace')
+
+    @staticmethod
+    def __decompress(packet, start):
+        """
+
+        :param packet: A Message or Fragment packet.
+        :param start: Offset of the data in the packet buffer.
+
+        :type packet: Packet | BinaryPacket
+        :type start: int
+
+        :return: The uncompressed data.
+        :rtype: bytes
+
+        :raise ValueError: If the data is compressed with a codec we do not know or can not be decompressed, or it
+                           would be longer than MAX_PACKET_LENGTH uncompressed.
+        """
+        data = bytes(packet.get_buf()[start:20 + packet.get_length()])
+        codec = PacketFactory.get_message_codec(packet)
+        if codec != NO_CODEC:
+            if get_codec(codec) is None:
+                raise ValueError("Unknown codec.")
+            try:
+                data = get_codec(codec).decompress(data, PacketFactory.MAX_PACKET_LENGTH)
+            except Exception as e:
+                raise ValueError(str(e))
+        return data
+
+    @staticmethod
+    def new_uncompressed_relay_buffer(packet, source_server_address):
+        """
+        Make the network format of a compressed Message or Fragment packet with a new source server address and its
+        data uncompressed; For the neighbours which do not accept the codec of the packet.
+
+        :param packet: The compressed Message or Fragment packet we want to relay.
+        :param source_server_address: Server address of the relaying peer.
+
+        :type packet: Packet | BinaryPacket
+        :type source_server_address: tuple
+
+        :return: The relayed packet in the network format.
+        :rtype: bytes
+
+        :raise ValueError: If the data can not be decompressed.
+        """
+        start = 20 + PacketFactory.MESSAGE_ID_LENGTH
+        end = 20 + PacketFactory.FRAGMENT_HEADER_LENGTH if packet.get_type() == 7 else start + 4
+        data = PacketFactory.__decompress(packet, end)
+        buf = bytes(packet.get_buf())
+        body = b''.join((buf[20:start], NO_CODEC.encode('ascii'), buf[start + 4:end], data))
+        return bytes(BinaryPacket.from_fields(1, packet.get_type(), source_server_address, body).get_buf())
@@ -1,11 +1,23 @@
 from src.Stream import Stream
-from src.Packet import Packet, PacketFactory
+from src.AsyncStream import AsyncStream
+from src.Packet import BinaryPacket, Packet, PacketFactory
 from src.UserInterface import UserInterface
 from src.tools.SemiNode import SemiNode
 from src.tools.NetworkGraph import NetworkGraph, GraphNode
+from src.tools.PacketWorkerPool import PacketWorkerPool
+from src.tools.SeenCache import SeenCache
+from src.tools.FragmentBuffer import FragmentBuffer
+from src.tools.Codec import CODECS, NO_CODEC, get_codec
+from src.tools.Clock import Clock
+from src.tools.Metrics import Metrics
+from src.tools.MetricsServer import MetricsServer
+from collections import OrderedDict
+import logging
 import time
 import threading
 
+log = logging.getLogger(__name__)
+
 
 """
     Peer is our main object in this project.
@@ -16,7 +28,14 @@ import threading
 
 
 class Peer:
-    def __init__(self, server_ip, server_port, is_root=False, root_address=None):
+    def __init__(self, server_ip, server_port, is_root=False, root_address=None, wake_on_arrival=True,
+                 idle_interval=2, transport="threaded",
+                 pipelined_sends=False, max_children=2, capacity=None, aggregate_reunion=False, root_workers=0,
+                 max_queue_packets=None, max_queue_bytes=None, queue_policy="drop-oldest", send_workers=0,
+                 send_timeout=None, message_cache_size=4096, message_cache_ttl=60, batch_bytes=None, batch_linger=0,
+                 compression=None, compression_threshold=256, fragment_size=PacketFactory.FRAGMENT_SIZE,
+                 max_message_bytes=FragmentBuffer.MAX_MESSAGE_BYTES, on_message=None, reconnect_attempts=5,
+                 reconnect_backoff=0.1, clock=None, reunion_thread=True, metrics=None, metrics_port=None, tracer=None):
         """
         The Peer object constructor.
 
@@ -37,15 +56,120 @@ class Peer:
         :param server_port: Server Port address for this Peer that should be pass to Stream.
         :param is_root: Specify that is this Peer root or not.
         :param root_address: Root IP/Port address if we are a client.
+        :param wake_on_arrival: If True the main loop wakes up as soon as a packet arrives, otherwise it sleeps
+                                idle_interval seconds in every iteration.
+        :param idle_interval: Maximum seconds the main loop waits between two iterations.
+        :param transport: "threaded" for a Stream with a TCPServer Thread and blocking Nodes, "asyncio" for an
+                          AsyncStream hosting every connection on a single event loop, or a callable which makes our
+                          stream from server_ip, server_port and the queue options; e.g. Simulator.make_stream.
+        :param pipelined_sends: Write every Node out_buff at once instead of waiting for b'ACK' after each packet;
+                                AsyncStream Nodes always work this way.
+        :param max_children: If we are root; Default maximum number of children of every node in the tree.
+        :param capacity: If we are a client; The number of children we can accept (1 to 99), sent to the root in our
+                         Register Request packet. None lets the root decide.
+        :param aggregate_reunion: If we are a client; Send the Reunion Hellos of our sub-tree together with ours in
+                                  one Aggregated Hello packet per interval instead of forwarding each of them.
+        :param root_workers: If we are root; Number of worker processes which parse the arrived packets and prepare
+                             the Reunion answers. With 0 everything is handled in our main loop.
+        :param max_queue_packets: Maximum number of packets waiting for every neighbour; None means no limit.
+        :param max_queue_bytes: Maximum total bytes waiting for every neighbour; None means no limit.
+        :param queue_policy: What happens to a packet for a neighbour whose queue is full: "block", "drop-oldest",
+                             "drop-newest" or "disconnect"; See Node.add_message_to_out_buff.
+        :param send_workers: Number of Threads which send to our neighbours concurrently, so one slow neighbour does
+                             not delay the others; 0 sends to them one by one. AsyncStream does not need them.
+        :param send_timeout: Seconds after which a neighbour that does not accept our packets is removed; None waits
+                             forever.
+        :param reconnect_attempts: Consecutive failed connection attempts to a neighbour after which it is removed;
+                                   Until then the packets for it are kept. None never gives up.
+        :param reconnect_backoff: Seconds we wait before connecting to a neighbour again after its first failure;
+                                  The wait doubles with every further failure.
+        :param message_cache_size: Number of recent Message IDs we remember to drop duplicate Message packets.
+        :param message_cache_ttl: Seconds we remember a Message ID.
+        :param batch_bytes: Pack the packets for every neighbour into Batch packets of at most this many bytes; None
+                            sends every packet on its own.
+        :param batch_linger: With batch_bytes; Seconds a packet may wait for more packets to the same neighbour.
+        :param compression: Name of a registered codec (see src.tools.Codec) to compress the messages we send with;
+                            None sends them uncompressed. Neighbours which do not accept the codec get them
+                            uncompressed anyway.
+        :param compression_threshold: Messages shorter than this many bytes are not compressed.
+        :param fragment_size: Messages longer than this many bytes are sent in Fragment packets of this size, so
+                              they are relayed through the tree fragment by fragment.
+        :param max_message_bytes: Longest message in Fragment packets we reassemble; Longer ones are still relayed
+                                  but never handed to on_message.
+        :param on_message: Called with the Message ID and the message bytes of every new message that reaches us,
+                           after it has been relayed; Messages in fragments once they are complete. With None
+                           messages are only relayed, never decompressed or reassembled.
+        :param clock: Source of the current time for our Reunion logic, NetworkGraph, seen messages, fragments and
+                      the batch_linger of our Stream; A VirtualClock when a Simulator drives us. Wall-clock time by
+                      default.
+        :param reunion_thread: Run our Reunion daemon in a Thread of ours. With False whoever drives us calls
+                               reunion_step instead, at the time it returns and whenever reunion_wake_up is set.
+        :param metrics: Where we and our stream count packets, bytes and timings; We make our own by default. Read
+                        it with metrics.get_snapshot or metrics.render_text.
+        :param metrics_port: Serve our metrics at http://127.0.0.1:<metrics_port>/metrics; None serves nothing.
+        :param tracer: Record the stages of every packet we and our stream handle in it, see Tracer; Peers of one
+                       process may share it. None records nothing.
 
         :type server_ip: str
         :type server_port: int
         :type is_root: bool
         :type root_address: tuple
+        :type wake_on_arrival: bool
+        :type idle_interval: float
+        :type transport: str
+        :type pipelined_sends: bool
+        :type max_children: int
+        :type capacity: int
+        :type aggregate_reunion: bool
+        :type root_workers: int
+        :type max_queue_packets: int
+        :type max_queue_bytes: int
+        :type queue_policy: str
+        :type send_workers: int
+        :type send_timeout: float
+        :type reconnect_attempts: int
+        :type reconnect_backoff: float
+        :type message_cache_size: int
+        :type message_cache_ttl: float
+        :type batch_bytes: int
+        :type batch_linger: float
+        :type compression: str
+        :type compression_threshold: int
+        :type fragment_size: int
+        :type max_message_bytes: int
+        :type on_message: callable
+        :type clock: Clock
+        :type reunion_thread: bool
+        :type metrics: Metrics
+        :type metrics_port: int
+        :type tracer: Tracer
         """
+        if capacity is not None and not 1 <= capacity <= 99:
+            raise Exception("Capacity must be between 1 and 99.")
+        if compression is not None and get_codec(compression) is None:
+            raise Exception("Unknown codec.")
         self._is_root = is_root
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.tracer = tracer
+        self.clock = clock if clock is not None else Clock()
+
+        queue_options = {"max_queue_packets": max_queue_packets, "max_queue_bytes": max_queue_bytes,
+                         "queue_policy": queue_policy, "batch_bytes": batch_bytes, "batch_linger": batch_linger,
+                         "metrics": self.metrics, "tracer": tracer, "clock": self.clock}
+        if transport == "threaded":
+            self.stream = Stream(server_ip, server_port, pipelined=pipelined_sends, send_workers=send_workers,
+                                 send_timeout=send_timeout, reconnect_attempts=reconnect_attempts,
+                                 reconnect_backoff=reconnect_backoff, **queue_options)
+        elif transport == "asyncio":
+            self.stream = AsyncStream(server_ip, server_port, reconnect_attempts=reconnect_attempts,
+                                      reconnect_backoff=reconnect_backoff, **queue_options)
+        elif callable(transport):
+            self.stream = transport(server_ip, server_port, **queue_options)
+        else:
+            raise Exception("Unknown transport.")
 
-        self.stream = Stream(server_ip, server_port)
+        self.wake_on_arrival = wake_on_arrival
+        self.idle_interval = idle_interval
 
         self.parent = None
 
@@ -53,24 +177,84 @@ class Peer:
         self.neighbours = []
         self.flagg = True
 
+        # IDs of the Message packets we have broadcast; A message that comes back, e.g. through a temporary cycle
+        # in the tree, is counted by type in the duplicate_messages metric and not broadcast again.
+        self.seen_messages = SeenCache(message_cache_size, message_cache_ttl, clock=self.clock)
+
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+
+        self.fragment_size = fragment_size
+        # Fragments of the large messages which have not arrived completely yet.
+        self.fragments = FragmentBuffer(ttl=message_cache_ttl, max_message_bytes=max_message_bytes,
+                                        clock=self.clock)
+        self.on_message = on_message
+
         self.reunion_accept = True
-        self.reunion_daemon_thread = threading.Thread(target=self.run_reunion_daemon)
-        self.reunion_sending_time = time.time()
+        self.reunion_daemon_thread = None
+        if reunion_thread:
+            self.reunion_daemon_thread = threading.Thread(target=self.run_reunion_daemon, daemon=True)
+        # Set when reunion_step should run before the time it has returned, e.g. when a Hello Back has arrived.
+        self.reunion_wake_up = threading.Event()
+        self.reunion_started = False
+        self.reunion_sending_time = self.clock.time()
+        # When our next Reunion Hello is due, or for an aggregating Peer our next Aggregated Hello.
+        self.reunion_due_time = None
         self.reunion_pending = False
+        self.last_hello_time = None
+        # When we sent our last Advertise Request; For the advertise_response_seconds metric.
+        self.advertise_sending_time = None
+
+        self.aggregate_reunion = aggregate_reunion
+        # Addresses from our sub-tree which have said hello since our last Aggregated Hello.
+        self.reunion_batch = {}
+        self.reunion_batch_lock = threading.Lock()
+        # The child address every sub-tree address has said hello through; For routing Aggregated Hello Backs.
+        self.reunion_routes = {}
+        # Sub-tree address -> when its route was last refreshed by an Aggregated Hello, the oldest first.
+        self.reunion_route_times = OrderedDict()
 
-        self._user_interface = UserInterface()
+        self._user_interface = UserInterface(on_command=self.stream.wake_up)
 
         self.packet_factory = PacketFactory()
 
         if self._is_root:
             self.network_nodes = []
-            self.registered_nodes = []
-            self.network_graph = NetworkGraph(GraphNode((server_ip, str(server_port).zfill(5))))
-            self.reunion_daemon_thread.start()
+            self.registered_nodes = {}
+            self.network_graph = NetworkGraph(GraphNode((server_ip, str(server_port).zfill(5))),
+                                              max_children=max_children, clock=self.clock)
+            # The reunion daemon and the main loop both change our NetworkGraph.
+            self.network_graph_lock = threading.Lock()
+            self.packet_worker_pool = None
+            if root_workers > 0:
+                self.packet_worker_pool = PacketWorkerPool(root_workers, self.stream.get_server_address())
+            self.metrics.add_collector(self.__collect_root_metrics)
+            self.start_reunion_daemon()
         else:
             self.root_address = root_address
+            self.capacity = capacity
             self.stream.add_node(root_address, set_register_connection=True)
 
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, metrics_port)
+
+    def __collect_root_metrics(self, metrics):
+        """
+        Set the gauges of our network as root; A collector of our metrics.
+
+        :param metrics: Our metrics.
+        :type metrics: Metrics
+
+        :return:
+        """
+        with self.network_graph_lock:
+            nodes = list(self.network_graph.nodes)
+        metrics.set_gauge("registered_nodes", len(self.registered_nodes))
+        metrics.set_gauge("graph_nodes", len(nodes) - 1)
+        metrics.set_gauge("live_graph_nodes", sum(1 for node in nodes if node.alive) - 1)
+        metrics.set_gauge("root_children", len(self.network_graph.root.children))
+
     def start_user_interface(self):
         """
         For starting UserInterface thread.
@@ -82,6 +266,19 @@ class Peer:
 
         self._user_interface.start()
 
+    def add_command(self, command):
+        """
+        Buffer a command as if the user had typed it, e.g. 'Register' or 'SendMessage Hello', and wake up the main
+        loop to handle it; For driving a Peer from a program. It may be called from any Thread.
+
+        :param command: One of the commands of handle_user_interface_buffer.
+        :type command: str
+
+        :return:
+        """
+        self._user_interface.buffer.append(command)
+        self.stream.wake_up()
+
     def handle_user_interface_buffer(self):
         """
         In every interval we should parse user command that buffered from our UserInterface.
@@ -98,31 +295,38 @@ class Peer:
         available_commands = ['Register', 'Advertise', 'SendMessage']
         #
         # print("user interface handler ", self._user_interface.buffer)
-        for buffer in self._user_interface.buffer:
+        # Take the buffer first; Commands buffered meanwhile by another Thread wait for the next call.
+        buffers, self._user_interface.buffer = self._user_interface.buffer, []
+        for buffer in buffers:
             if len(buffer) == 0:
                 continue
 
-            print('User interface handler buffer:', buffer)
+            log.debug('User interface handler buffer: %s', buffer)
+            if self.tracer is not None:
+                # Every packet a command makes belongs to one span.
+                self.tracer.set_current_span(self.tracer.new_span())
 
             if buffer.split(' ', 1)[0] == available_commands[0]:
                 # print("Handling buffer/register in UI")
                 self.stream.add_message_to_out_buff(self.root_address,
                                                     self.packet_factory.new_register_packet("REQ",
                                                                                             self.stream.get_server_address(),
-                                                                                            self.root_address).get_buf())
+                                                                                            self.root_address,
+                                                                                            self.capacity).get_buf())
             elif buffer.split(' ', 1)[0] == available_commands[1]:
                 # print("Handling buffer/advertise in UI")
                 self.stream.add_message_to_out_buff(self.root_address,
                                                     self.packet_factory.new_advertise_packet("REQ",
                                                                                              self.stream.get_server_address()).get_buf())
+                self.advertise_sending_time = self.clock.time()
 
             elif buffer.split(' ', 1)[0] == available_commands[2]:
                 # print("Handling buffer/SendMessage in UI")
-                self.send_broadcast_packet(self.packet_factory.new_message_packet(buffer.split(' ', 1)[1],
-                                                                                  self.stream.get_server_address()).get_buf())
+                self.send_message(buffer.split(' ', 1)[1])
             else:
                 print('Unknown Command!!!')
-        self._user_interface.buffer = []
+        if self.tracer is not None:
+            self.tracer.set_current_span(None)
 
     def run(self):
         """
@@ -133,7 +337,8 @@ class Peer:
             2. Handle all packets were received from our Stream server.
             3. Parse user_interface_buffer to make message packets.
             4. Send packets stored in nodes buffer of our Stream object.
-            5. ** sleep the current thread for 2 seconds **
+            5. ** wait until a new packet arrives or idle_interval seconds passed **
+               We wake up earlier if the packets of a neighbour stop lingering for a Batch.
 
         Warnings:
             1. At first check reunion daemon condition; Maybe we have a problem in this time
@@ -143,37 +348,191 @@ class Peer:
         :return:
         """
 
-        print("Running the peer...")
-        while True:
+        log.info("Running the peer...")
+        try:
+            while True:
 
-            time.sleep(2)
-            temp_array = self.stream.read_in_buf()
-
-            if not self.reunion_accept:
-                print("Reunion failure")
-
-                for b in self.stream.read_in_buf():
-                    # print("In main while: ", b)
-                    p = self.packet_factory.parse_buffer(b)
-                    # print("In for: ", p.get_type())
-                    if p.get_type() == 2:
-                        self.handle_packet(p)
-                        temp_array.remove(b)
-                        # self.stream.send_out_buf_messages(only_register=True)
-                        break
-                continue
+                timeout = self.idle_interval
+                linger_timeout = self.stream.get_linger_timeout()
+                if linger_timeout is not None:
+                    timeout = min(timeout, linger_timeout)
+
+                if self.wake_on_arrival:
+                    self.stream.wait_for_in_buf(timeout)
+                else:
+                    time.sleep(timeout)
+
+                self.run_once()
+        finally:
+            self.close()
+
+    def run_once(self):
+        """
+        One iteration of our main loop after waiting: Handle the arrived packets and the user commands, then send
+        the out_buff of our nodes; In Reunion failure mode only look for an Advertise packet.
+        A Simulator calls it whenever our stream wakes up. Its duration goes into the loop_seconds metric.
 
-            for b in temp_array:
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            self.__run_once()
+        finally:
+            self.metrics.observe("loop_seconds", time.perf_counter() - start)
+
+    def __run_once(self):
+        if not self.reunion_accept:
+            log.debug("Reunion failure")
+
+            # Only an Advertise Response, which may come inside a Batch, gets us back into the network; The other
+            # packets wait in the input buffer until then.
+            buffers = self.packet_factory.unpack_batches(self.stream.pop_in_buf())
+            for i, b in enumerate(buffers):
                 # print("In main while: ", b)
-                p = self.packet_factory.parse_buffer(b)
-                self.handle_packet(p)
-                # self.packets.remove(p)
-            self.stream.clear_in_buff()
+                if len(b) >= 20 and BinaryPacket(b).get_type() == 2:
+                    del buffers[i]
+                    self.__handle_buffer(b)
+                    # self.stream.send_out_buf_messages(only_register=True)
+                    break
+            self.stream.unread_in_buf(buffers)
+            return
+
+        self.handle_buffers(self.stream.pop_in_buf())
+
+        self.handle_user_interface_buffer()
+        # print("Main while before user_interface handler")
+        # self.send_broadcast_packets()
+        self.stream.send_out_buf_messages()
+
+    def close(self):
+        """
+        Release what we have started besides our Reunion daemon: the worker processes of a root, our metrics server
+        and our Stream with its server and connections. run calls it when the main loop stops, whether by an
+        exception or by KeyboardInterrupt; Closing again does nothing.
+
+        :return:
+        """
+        if self._is_root and self.packet_worker_pool is not None:
+            self.packet_worker_pool.close()
+            self.packet_worker_pool = None
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        self.stream.close()
+
+    def handle_buffers(self, buffers):
+        """
+        Handle the packets arrived from our Stream server.
+
+        If we are a root with worker processes, the Reunion Hello packets are parsed there, sharded by their source
+        address, and we only apply the compact results to our NetworkGraph and Stream; Batch packets are unpacked
+        first, so the workers see the packets inside them. We handle the other packets ourselves while the workers
+        are busy, so their Advertise and Register come before the Hellos of the same batch.
+
+        A packet we fail to parse or handle is dropped with a warning, so one malformed packet never stops our main
+        loop.
+
+        :param buffers: Arrived packets in the network format.
+        :type buffers: list
+
+        :return:
+        """
+        if self._is_root and self.packet_worker_pool is not None:
+            self.__handle_buffers_in_workers(self.packet_factory.unpack_batches(buffers))
+            return
+
+        for b in buffers:
+            # print("In main while: ", b)
+            self.__handle_buffer(b, traced=self.tracer is not None)
+            # self.packets.remove(p)
+
+    def __handle_buffers_in_workers(self, buffers):
+        """
+        Hand the Reunion Hello packets to our worker processes, handle the other packets meanwhile and then apply
+        the results of the workers.
+
+        The Hellos are counted in the packets_in and bytes_in metrics like the packets we handle ourselves; The time
+        we have waited for the workers goes into root_worker_wait_seconds.
+
+        :param buffers: Arrived packets in the network format, without Batch packets.
+        :type buffers: list
+
+        :return:
+        """
+        pool = self.packet_worker_pool
+        hellos = []
+        others = []
+        for b in buffers:
+            (hellos if pool.is_worker_packet(b) else others).append(b)
+        pending = pool.submit(hellos)
+        for b in others:
+            self.__handle_buffer(b, traced=self.tracer is not None)
+
+        start = time.perf_counter()
+        results = pool.collect(pending)
+        end = time.perf_counter()
+        self.metrics.observe("root_worker_wait_seconds", end - start)
+        if self.tracer is not None:
+            self.tracer.record(self.stream.trace_pid, "PacketWorkerPool.collect", start, end, packets=len(hellos))
+
+        # The Hellos a worker could not handle come back to us, and handle_packet counts them.
+        returned = [result[1] for result in results if result[0] == PacketWorkerPool.PACKET]
+        if len(hellos) > len(returned):
+            self.metrics.increment("packets_in", len(hellos) - len(returned), type="Reunion")
+            self.metrics.increment("bytes_in", sum(map(len, hellos)) - sum(map(len, returned)), type="Reunion")
+        for result in results:
+            if result[0] == PacketWorkerPool.REUNION:
+                _, hello_addresses, sender_address, reply = result
+                self.__update_reunion_nodes(hello_addresses)
+                self.stream.add_message_to_out_buff(sender_address, reply)
+        for b in returned:
+            self.__handle_buffer(b)
+
+    def __handle_buffer(self, buffer, traced=False):
+        """
+        Parse and handle an arrived packet; If that fails, log a warning and drop the packet.
 
-            self.handle_user_interface_buffer()
-            # print("Main while before user_interface handler")
-            # self.send_broadcast_packets()
-            self.stream.send_out_buf_messages()
+        :param buffer: The packet in the network format.
+        :param traced: Whether to record the packet in our tracer.
+
+        :type buffer: bytes
+        :type traced: bool
+
+        :return:
+        """
+        try:
+            if traced:
+                self.__trace_buffer(buffer)
+            else:
+                self.handle_packet(self.packet_factory.parse_buffer(buffer))
+        except Exception as e:
+            log.warning("Dropped a packet we could not handle: %r", e, exc_info=log.isEnabledFor(logging.DEBUG))
+
+    def __trace_buffer(self, buffer):
+        """
+        Parse and handle an arrived packet, recording in our tracer how long it has waited in the input buffer of
+        our stream and how long parsing it took; The packets we make meanwhile get its span ID.
+
+        :param buffer: The packet in the network format.
+        :type buffer: bytes
+
+        :return:
+        """
+        tracer = self.tracer
+        pid = self.stream.trace_pid
+        span, arrival_time = tracer.take_mark((pid, "in"), buffer)
+        start = tracer.clock()
+        if span is None:
+            span = tracer.new_span()
+        else:
+            tracer.record(pid, "Stream.in_buf", arrival_time, start, span=span)
+        p = self.packet_factory.parse_buffer(buffer)
+        tracer.record(pid, "PacketFactory.parse_buffer", start, tracer.clock(), span=span)
+        tracer.set_current_span(span)
+        try:
+            self.handle_packet(p)
+        finally:
+            tracer.set_current_span(None)
 
     def run_reunion_daemon(self):
         """
@@ -184,6 +543,7 @@ class Peer:
             1. Check if we are the network root or not; The actions are identical.
             2. If it's the root Peer, in every interval check the latest Reunion packet arrival time from every nodes;
                If time is over for the node turn it off (Maybe you need to remove it from our NetworkGraph).
+               NetworkGraph keeps a heap of these times, so we only look at the nodes whose time is over.
             3. If it's a non-root peer split the actions by considering whether we are waiting for Reunion Hello Back
                Packet or it's the time to send new Reunion Hello packet.
 
@@ -197,45 +557,164 @@ class Peer:
             4. Suppose that you are a non-root Peer and Reunion was failed, In this time you should make a new Advertise
                Request packet and send it through your register_connection to the root; Don't forget to send this packet
                here, because in Reunion Failure mode our main loop will not work properly and everything will got stock!
+            5. The actions themselves are in reunion_step; Here we only wait between its calls, and wake up early
+               when reunion_wake_up is set, so a Reunion Hello is sent 4 seconds after the last Hello Back arrived.
 
         :return:
         """
-        if self._is_root:
-            while True:
-                for n in self.network_graph.nodes:
-                    if time.time() > n.latest_reunion_time + 36 and n is not self.network_graph.root:
-                        print("We have lost a node!", n.address)
-                        for child in n.children:
-                            #   TODO    Turn all sub-tree off; not only children.
-                            self.network_graph.turn_off_node(child.address)
-                        self.network_graph.turn_off_node(n.address)
-                        self.network_graph.remove_node(n.address)
-                #   TODO    Handle this section
-                time.sleep(2)
+        delay = self.reunion_step()
+        while True:
+            self.reunion_wake_up.wait(delay)
+            self.reunion_wake_up.clear()
+            delay = self.reunion_step()
+
+    def start_reunion_daemon(self):
+        """
+        Start our Reunion daemon once; Without a Thread of ours only reunion_wake_up is set, so whoever drives us
+        starts calling reunion_step.
 
+        :return:
+        """
+        if self.reunion_started:
+            return
+        self.reunion_started = True
+        if self.reunion_daemon_thread is not None:
+            self.reunion_daemon_thread.start()
         else:
-            while True:
-                if not self.reunion_pending:
-                    self.reunion_accept = True
-                    time.sleep(4)
-                    packet = self.packet_factory.new_reunion_packet("REQ", self.stream.get_server_address(),
-                                                           [self.stream.get_server_address()])
-                    self.stream.add_message_to_out_buff(self.parent.get_server_address(), packet.get_buf())
+            self.reunion_wake_up.set()
+
+    def reunion_step(self):
+        """
+        Do the Reunion actions which are due by our clock; See run_reunion_daemon.
+
+        Root:         Every 2 seconds turn off the nodes whose last Reunion Hello is older than 36 seconds.
+        Aggregating:  Every second send the buffered addresses of our sub-tree in an Aggregated Hello; Ours too
+                      every 4 seconds unless we still wait for its Hello Back.
+        Others:       4 seconds after our Reunion is accepted send a new Reunion Hello.
+        Not root:     If the Hello Back has not arrived 38 seconds after our Hello, our Reunion has failed.
+
+        :return: Seconds until reunion_step should be called again.
+        :rtype: float
+        """
+        now = self.clock.time()
+        if self._is_root:
+            with self.network_graph_lock:
+                for n in self.network_graph.pop_expired_nodes(now - 36):
+                    log.info("We have lost a node! %s", n.address)
+                    self.network_graph.turn_off_subtree(n.address)
+                    self.network_graph.remove_node(n.address)
+            #   TODO    Handle this section
+            return 2
+
+        with self.reunion_batch_lock:
+            self.__expire_reunion_routes(now)
+        if self.aggregate_reunion:
+            if self.reunion_due_time is None:
+                self.reunion_due_time = now + 1
+            if now < self.reunion_due_time:
+                return self.reunion_due_time - now
+            self.reunion_due_time = now + 1
+
+            with self.reunion_batch_lock:
+                nodes_array = list(self.reunion_batch)
+                self.reunion_batch = {}
+
+            if not self.reunion_pending:
+                self.__accept_reunion()
+                if self.last_hello_time is None or now >= self.last_hello_time + 4:
+                    nodes_array.append(self.stream.get_server_address())
+                    self.last_hello_time = now
                     self.reunion_pending = True
-                    self.reunion_sending_time = time.time()
+                    self.reunion_sending_time = now
                     self.flagg = True
-                else:
-                    if time.time() > self.reunion_sending_time+38 and self.flagg:
+            elif now > self.reunion_sending_time + 38 and self.flagg:
+                self.__reunion_failed()
+
+            if nodes_array and self.reunion_accept:
+                packet = self.packet_factory.new_reunion_packet("AGG", self.stream.get_server_address(),
+                                                                nodes_array)
+                self.stream.add_message_to_out_buff(self.parent.get_server_address(), packet.get_buf())
+                self.stream.wake_up()
+            return 1
+
+        if not self.reunion_pending:
+            self.__accept_reunion()
+            if self.reunion_due_time is None:
+                self.reunion_due_time = now + 4
+            if now < self.reunion_due_time:
+                return self.reunion_due_time - now
+            self.reunion_due_time = None
+            packet = self.packet_factory.new_reunion_packet("REQ", self.stream.get_server_address(),
+                                                            [self.stream.get_server_address()])
+            self.stream.add_message_to_out_buff(self.parent.get_server_address(), packet.get_buf())
+            self.reunion_pending = True
+            self.reunion_sending_time = now
+            self.flagg = True
+            self.stream.wake_up()
+        elif now >= self.reunion_sending_time + 38 and self.flagg:
+            self.__reunion_failed()
+        if self.flagg:
+            return self.reunion_sending_time + 38 - now
+        # We wait for an Advertise Response, which wakes us up.
+        return 38
+
+    def __accept_reunion(self):
+        """
+        Leave the Reunion failure mode, if we are in it, and wake up the main loop to send what has waited.
 
-                        print("Ooops, Reunion was failed.")
+        :return:
+        """
+        if not self.reunion_accept:
+            self.reunion_accept = True
+            self.stream.wake_up()
 
-                        self.reunion_accept = False
-                        advertise_packet = self.packet_factory.new_advertise_packet("REQ", self.stream.get_server_address())
-                        self.stream.add_message_to_out_buff(self.root_address, advertise_packet.get_buf())
-                        self.flagg = False
-                        self.stream.send_out_buf_messages(only_register=True)
-                        # Reunion failed.
-                        #   TODO    Make sure that parent will completely detach from our clients
+    def __reunion_failed(self):
+        """
+        Our Reunion Hello Back did not arrive in time; Stop the main loop and ask the root for a new neighbour.
+
+        :return:
+        """
+        log.warning("Ooops, Reunion was failed.")
+
+        self.reunion_accept = False
+        advertise_packet = self.packet_factory.new_advertise_packet("REQ", self.stream.get_server_address())
+        self.stream.add_message_to_out_buff(self.root_address, advertise_packet.get_buf())
+        self.advertise_sending_time = self.clock.time()
+        self.metrics.increment("reunion_failures")
+        self.flagg = False
+        # Our sub-tree says hello again once we have a new parent; Until then no Hello Back can come through us.
+        with self.reunion_batch_lock:
+            self.reunion_routes.clear()
+            self.reunion_route_times.clear()
+        self.stream.send_out_buf_messages(only_register=True)
+        # Reunion failed.
+        #   TODO    Make sure that parent will completely detach from our clients
+
+    def send_message(self, message):
+        """
+        Broadcast a new message through the network; In one Message packet, or in Fragment packets if it is longer
+        than fragment_size.
+
+        :param message: Our message; A str is sent in UTF-8.
+        :type message: str | bytes
+
+        :return: Message ID of the message.
+        :rtype: str
+        """
+        if isinstance(message, str):
+            message = message.encode('UTF-8')
+        if len(message) <= self.fragment_size:
+            packets = [self.packet_factory.new_message_packet(message, self.stream.get_server_address(),
+                                                              codec=self.compression,
+                                                              compression_threshold=self.compression_threshold)]
+        else:
+            packets = self.packet_factory.new_fragment_packets(message, self.stream.get_server_address(),
+                                                               codec=self.compression,
+                                                               compression_threshold=self.compression_threshold,
+                                                               fragment_size=self.fragment_size)
+        for packet in packets:
+            self.send_broadcast_packet(packet.get_buf())
+        return PacketFactory.get_message_id(packets[0])
 
     def send_broadcast_packet(self, broadcast_packet):
         """
@@ -245,18 +724,42 @@ class Peer:
         Warnings:
             1. Don't send Message packets through register_connections.
 
-        :param broadcast_packet: The packet that should be broadcast through network.
-        :type broadcast_packet: Packet
+        :param broadcast_packet: The Message or Fragment packet buffer that should be broadcast through network.
+        :type broadcast_packet: bytearray
+
+        :return:
+        """
+        packet = BinaryPacket(bytes(broadcast_packet))
+        if packet.get_type() == 7:
+            self.seen_messages.check_and_add(PacketFactory.get_fragment_key(packet))
+        else:
+            self.seen_messages.check_and_add(PacketFactory.get_message_id(packet))
+        self.__broadcast_message(packet, packet.get_buf())
+
+    def __broadcast_message(self, packet, buffer, exclude_address=None):
+        """
+        Add a Message or Fragment packet to the out_buff of every neighbour; Compressed as it is for the neighbours
+        which accept its codec, and uncompressed for the others.
+
+        :param packet: The Message or Fragment packet.
+        :param buffer: The packet in the network format with our address as its source.
+        :param exclude_address: Server address of a neighbour that should not get the message, e.g. the sender.
+
+        :type packet: Packet | BinaryPacket
+        :type buffer: bytes
+        :type exclude_address: tuple
 
         :return:
         """
+        codec = self.packet_factory.get_message_codec(packet)
+        if codec == NO_CODEC:
+            return self.stream.add_message_to_broadcast_buffs(buffer, exclude_address=exclude_address)
+
+        def make_fallback():
+            return self.packet_factory.new_uncompressed_relay_buffer(packet, self.stream.get_server_address())
 
-        for n in self.stream.nodes:
-            # print(n.get_standard_server_address())
-            # print(self.root_address)
-            # if n.get_standard_server_address() != self.root_address:
-            if not n.is_register_connection:
-                self.stream.add_message_to_out_buff(n.get_server_address(), broadcast_packet)
+        self.stream.add_message_to_broadcast_buffs(buffer, exclude_address=exclude_address, codec=codec,
+                                                   make_fallback=make_fallback)
 
     def handle_packet(self, packet):
         """
@@ -266,14 +769,43 @@ class Peer:
         Code design suggestion:
             1.It's better to check packet validation right now; For example: Validation of the packet length.
 
+        Every packet, and every packet inside a Batch, is counted by type in the packets_in and bytes_in metrics and
+        the time we have spent on it goes into handle_packet_seconds; With a tracer it is recorded there as well.
+
         :param packet: The arrived packet that should be handled.
 
         :type packet Packet
 
         """
-        if packet.get_length() != len(packet.get_body()):
+        start = time.perf_counter()
+        packet_type = PacketFactory.TYPE_NAMES.get(packet.get_type(), str(packet.get_type()))
+        self.__dispatch_packet(packet)
+        self.metrics.increment("packets_in", type=packet_type)
+        self.metrics.increment("bytes_in", len(packet.get_buf()), type=packet_type)
+        end = time.perf_counter()
+        self.metrics.observe("handle_packet_seconds", end - start, type=packet_type)
+        if self.tracer is not None:
+            # The Message ID finds the hops of a message in the other Peers.
+            args = {"message": PacketFactory.get_message_id(packet)} if packet.get_type() in (4, 7) else {}
+            self.tracer.record(self.stream.trace_pid, "Peer.handle_packet", start, end,
+                               span=self.tracer.get_current_span(), type=packet_type, **args)
+
+    def __dispatch_packet(self, packet):
+        if packet.get_version() == 1 and packet.get_type() == 6:
+            # The body of a Batch is binary; Handle the packets inside it one by one.
+            try:
+                buffers = self.packet_factory.split_batch(packet)
+            except ValueError:
+                log.warning('Corrupted Batch packet.')
+                return
+            for b in buffers:
+                self.__handle_buffer(b)
+            return
+
+        if packet.get_length() != len(packet.get_buf()) - 20:
             # print("packet.get_length() = ", packet.get_length(), packet.get_body(), packet.get_source_server_ip(),packet.get_source_server_port())
-            return print('Packet Length is incorrect.')
+            log.warning('Packet Length is incorrect.')
+            return
         # print("Handling the packet...")
         if packet.get_version() == 1:
             if packet.get_type() == 1:
@@ -286,13 +818,16 @@ class Peer:
                 self.__handle_message_packet(packet)
             elif packet.get_type() == 5:
                 self.__handle_reunion_packet(packet)
+            elif packet.get_type() == 7:
+                self.__handle_fragment_packet(packet)
             else:
-                print('Unexpected type:\t', packet.get_type())
+                log.warning('Unexpected type:\t%s', packet.get_type())
                 # self.packets.remove(packet)
 
     def __check_registered(self, source_address):
         """
         If the Peer is root of the network we need to find that is a node registered or not.
+        registered_nodes maps the standard address of every registered node to its SemiNode.
 
         :param source_address: Unknown IP/Port address.
         :type source_address: tuple
@@ -300,10 +835,7 @@ class Peer:
         :return:
         """
 
-        for n in self.registered_nodes:
-            if n.get_address() == source_address:
-                return True
-        return False
+        return (SemiNode.parse_ip(source_address[0]), SemiNode.parse_port(source_address[1])) in self.registered_nodes
 
     def __handle_advertise_packet(self, packet):
         """
@@ -350,23 +882,28 @@ class Peer:
 
             # TODO Here we should check that is the node was advertised in past then update our GraphNode
 
-            neighbor = self.__get_neighbour(packet.get_source_server_address())
+            server_address = packet.get_source_server_address()
+            registered_node = self.registered_nodes[(SemiNode.parse_ip(server_address[0]),
+                                                     SemiNode.parse_port(server_address[1]))]
+
+            with self.network_graph_lock:
+                neighbor = self.__get_neighbour(packet.get_source_server_address())
+                node = self.network_graph.find_node(server_address[0], server_address[1])
+
+                if node is not None:
+                    self.network_graph.turn_on_node(server_address)
+                #
+                # else:
+                #     self.network_graph.add_node(node, neighbor.address)
+                #
+                self.network_graph.add_node(server_address[0], server_address[1], neighbor,
+                                            capacity=registered_node.capacity)
+
             # print("Neighbor: \t", neighbor)
             p = self.packet_factory.new_advertise_packet(type='RES',
                                                          source_server_address=self.stream.get_server_address(),
                                                          neighbor=neighbor)
 
-            server_address = packet.get_source_server_address()
-            node = self.network_graph.find_node(server_address[0], server_address[1])
-
-            if node is not None:
-                self.network_graph.turn_on_node(server_address)
-            #
-            # else:
-            #     self.network_graph.add_node(node, neighbor.address)
-            #
-            self.network_graph.add_node(server_address[0], server_address[1], neighbor)
-
             # print("We want to add this to the node: ", packet.get_source_server_address())
             self.network_nodes.append(SemiNode(packet.get_source_server_ip(), packet.get_source_server_port()))
 
@@ -375,22 +912,25 @@ class Peer:
 
         elif packet.get_body()[0:3] == 'RES':
             # print("Packet is in Response type")
-            self.stream.add_node((packet.get_body()[3:18], packet.get_body()[18:23]))
-            if self.parent:
-                if self.stream.get_node_by_server(self.parent.server_ip, self.parent.server_port) in self.stream.nodes:
-                    self.stream.remove_node(self.parent)
-            self.parent = self.stream.get_node_by_server(packet.get_body()[3:18], packet.get_body()[18:23])
+            if self.advertise_sending_time is not None:
+                self.metrics.observe("advertise_response_seconds", self.clock.time() - self.advertise_sending_time)
+                self.advertise_sending_time = None
+            new_parent = self.stream.add_node((packet.get_body()[3:18], packet.get_body()[18:23]))
+            # Our old parent may have been removed already, e.g. after its connection failed, or be the new one.
+            if self.parent and self.parent is not new_parent and self.parent in self.stream.nodes:
+                self.stream.remove_node(self.parent)
+            self.parent = new_parent
 
             addr = self.stream.get_server_address()
-            join_packet = self.packet_factory.new_join_packet(addr)
+            join_packet = self.packet_factory.new_join_packet(addr, codecs=list(CODECS))
             self.stream.add_message_to_out_buff(self.parent.get_server_address(), join_packet.get_buf())
             self.reunion_pending = False
+            self.reunion_wake_up.set()
 
-            if not self.reunion_daemon_thread.isAlive():
-                # print("Reunion thread started")
-                self.reunion_daemon_thread.start()
+            # print("Reunion thread started")
+            self.start_reunion_daemon()
         else:
-            raise print('Unexpected Type.')
+            raise Exception('Unexpected Type.')
 
     def __handle_register_packet(self, packet):
         """
@@ -412,11 +952,11 @@ class Peer:
         if pbody[0:3] == 'REQ':
             # print("Packet is in Request type")
             if not self._is_root:
-                raise print('Register request packet send to a root node!')
+                raise Exception('Register request packet send to a root node!')
             else:
 
                 if self.__check_registered(packet.get_source_server_address()):
-                    print(packet.get_source_server_address(), 'Trying to register again')
+                    log.info('%s Trying to register again', packet.get_source_server_address())
                     return
 
                 res = self.packet_factory.new_register_packet(type='RES',
@@ -425,14 +965,22 @@ class Peer:
                 self.stream.add_node((packet.get_source_server_ip(), packet.get_source_server_port()),
                                      set_register_connection=True)
                 # self.stream.add_client(pbody[3:18], pbody[18:23])
-                self.registered_nodes.append(SemiNode(packet.get_body()[3:18], packet.get_body()[18:23]))
+                capacity = None
+                if len(pbody) > 23:
+                    if len(pbody) == 25 and pbody[23:25].isdecimal() and int(pbody[23:25]) >= 1:
+                        capacity = int(pbody[23:25])
+                    else:
+                        log.warning("Ignoring the invalid capacity %r of %s.", pbody[23:],
+                                    packet.get_source_server_address())
+                registered_node = SemiNode(pbody[3:18], pbody[18:23], capacity)
+                self.registered_nodes[registered_node.get_address()] = registered_node
                 self.stream.add_message_to_out_buff(packet.get_source_server_address(), res.get_buf())
                 # self.stream.add_message_to_out_buf((pbody[3:18], pbody[18:23]), res)
 
         if pbody[0:3] == 'RES':
-            print("Register Response sent")
+            log.debug("Register Response sent")
             if pbody[3:6] == "ACK":
-                print('ACK! Registered accomplished')
+                log.info('ACK! Registered accomplished')
             else:
                 raise Exception('Root did not send ack in the register response packet!')
 
@@ -449,7 +997,7 @@ class Peer:
         """
         if address in self.neighbours:
             return True
-        print(self.parent.get_server_address(), " ", address)
+        log.debug("%s %s", self.parent.get_server_address(), address)
         if address == self.parent.get_server_address():
             return True
         return False
@@ -458,9 +1006,13 @@ class Peer:
         """
         Only broadcast message to the other nodes.
 
+        The relayed packet is the arrived one with our address as its source, so its body is never re-encoded;
+        A compressed message is only uncompressed, once, if some neighbour does not accept its codec.
+
         Warnings:
             1. Do not forget to ignore messages from unknown sources.
             2. Make sure that you are not sending a message to a register_connection.
+            3. Drop the messages whose Message ID we have seen recently.
 
         :param packet:
 
@@ -471,20 +1023,58 @@ class Peer:
         # print("Handling message packet...")
         # print("The message was just arrived is: ", packet.get_body(), " and source of the packet is: ",
         #       packet.get_source_server_address())
-        new_packet = self.packet_factory.new_message_packet(packet.get_body(), self.stream.get_server_address())
-        # for n in self.stream.nodes:
-        #     print("From here:\t", n.get_server_address(), " ", n.is_register_connection)
-
         if not self.__check_neighbour(packet.get_source_server_address()):
             # print("The message is from an unknown source.")
             return
 
-        for n in self.stream.nodes:
-            if not n.is_register_connection:
-                if n.get_server_address() != packet.get_source_server_address():
-                    # print("Node considered to send message to: ", n.get_server_address())
-                    self.stream.add_message_to_out_buff(n.get_server_address(), new_packet.get_buf())
-                    print('Message sent to', n.get_server_address)
+        if self.seen_messages.check_and_add(PacketFactory.get_message_id(packet)):
+            self.metrics.increment("duplicate_messages", type="Message")
+            return
+
+        # Serialise once; every neighbour gets the very same immutable buffer.
+        relay_buffer = self.packet_factory.new_relay_buffer(packet, self.stream.get_server_address())
+        self.__broadcast_message(packet, relay_buffer, exclude_address=packet.get_source_server_address())
+
+        if self.on_message is not None:
+            try:
+                message_id, message = self.packet_factory.parse_message_data(packet)
+            except ValueError as e:
+                log.warning("Can not read the message: %s", e)
+                return
+            self.on_message(message_id, message)
+
+    def __handle_fragment_packet(self, packet):
+        """
+        Relay a fragment of a large message at once, then keep it until its message is complete.
+
+        Fragments are forwarded like Message packets as soon as they arrive, so a message spends one fragment
+        time per hop instead of its whole transfer time; Duplicates are recognised by Message ID and Index.
+
+        :param packet: The arrived Fragment packet.
+        :type packet: Packet | BinaryPacket
+
+        :return:
+        """
+        if not self.__check_neighbour(packet.get_source_server_address()):
+            return
+
+        if self.seen_messages.check_and_add(PacketFactory.get_fragment_key(packet)):
+            self.metrics.increment("duplicate_messages", type="Fragment")
+            return
+
+        relay_buffer = self.packet_factory.new_relay_buffer(packet, self.stream.get_server_address())
+        self.__broadcast_message(packet, relay_buffer, exclude_address=packet.get_source_server_address())
+
+        if self.on_message is None:
+            return
+        try:
+            message_id, index, count, data = self.packet_factory.parse_fragment(packet)
+        except ValueError as e:
+            log.warning("Can not read the fragment: %s", e)
+            return
+        message = self.fragments.add(message_id, index, count, data)
+        if message is not None:
+            self.on_message(message_id, message)
 
     def __handle_reunion_packet(self, packet):
         """
@@ -500,6 +1090,16 @@ class Peer:
             Check that you are the end node or not; If not only remove your IP/Port address and send packet to the next
             address, otherwise you received your response from root and everything is fine.
 
+        Aggregated Hello:
+            If you are root Peer update every address in the packet like a Reunion Hello and answer with one
+            Aggregated Hello Back of the same addresses to the sender; Otherwise remember which child the addresses
+            came from and buffer them for our next Aggregated Hello, or relay them to our parent at once if we do
+            not aggregate our Reunion Hellos.
+
+        Aggregated Hello Back:
+            If your address is in the packet your Reunion is accepted; Send the other addresses to the children they
+            came from, one packet per child.
+
         Warnings:
             1. Every time adding or removing an address from packet don't forget to update Entity Number field.
             2. If you are the root, update last Reunion Hello arrival packet from the sender node and turn it on.
@@ -513,21 +1113,10 @@ class Peer:
         if packet.get_body()[0:3] == "REQ":
             # print("Packet is in Request type")
             if self._is_root:
-                number_of_entity = int(packet.get_body()[3:5])
-                node_array = []
-                ip_and_ports = packet.get_body()[5:]
-                sender_ip = ip_and_ports[(number_of_entity - 1) * 20: (number_of_entity - 1) * 20 + 15]
-                sender_port = ip_and_ports[(number_of_entity - 1) * 20 + 15: (number_of_entity - 1) * 20 + 20]
-                for i in range(number_of_entity):
-                    ip = ip_and_ports[i * 20:i * 20 + 15]
-                    port = ip_and_ports[i * 20 + 15:i * 20 + 20]
-                    node_array.insert(0, (ip, port))
-                self.network_graph.turn_on_node(packet.get_source_server_address())
-                node = self.network_graph.find_node(packet.get_source_server_ip(), packet.get_source_server_port())
-                node.latest_reunion_time = time.time()
-                p = self.packet_factory.new_reunion_packet(type='RES', source_address=self.stream.get_server_address(),
-                                                           nodes_array=node_array)
-                self.stream.add_message_to_out_buff((sender_ip, sender_port), p.get_buf())
+                hello_address, sender_address, p = self.packet_factory.new_reunion_hello_back(
+                    packet, self.stream.get_server_address())
+                self.__update_reunion_nodes([hello_address])
+                self.stream.add_message_to_out_buff(sender_address, p.get_buf())
             else:
                 number_of_entity = int(packet.get_body()[3:5])
                 node_array = []
@@ -558,8 +1147,8 @@ class Peer:
             if first_ip == self_address[0] and first_port == self_address[1]:
 
                 if number_of_entity == 1:
-                    print('Reunion Hello Back Packet Received')
-                    self.reunion_pending = False
+                    log.debug('Reunion Hello Back Packet Received')
+                    self.__reunion_accepted()
                     return
 
                 sender_ip = ip_and_ports[20:35]
@@ -572,14 +1161,108 @@ class Peer:
                                                            source_address=self.stream.get_server_address(),
                                                            nodes_array=node_array)
                 self.stream.add_message_to_out_buff((sender_ip, sender_port), p.get_buf())
+        elif packet.get_body()[0:3] == 'AGG':
+            nodes_array = self.packet_factory.parse_aggregated_reunion_body(packet.get_body())
+            if self._is_root:
+                self.__update_reunion_nodes(nodes_array)
+                p = self.packet_factory.new_reunion_packet(type='AGB', source_address=self.stream.get_server_address(),
+                                                           nodes_array=nodes_array)
+                self.stream.add_message_to_out_buff(packet.get_source_server_address(), p.get_buf())
+            else:
+                child_address = packet.get_source_server_address()
+                now = self.clock.time()
+                with self.reunion_batch_lock:
+                    for address in nodes_array:
+                        self.reunion_routes[address] = child_address
+                        self.reunion_route_times[address] = now
+                        self.reunion_route_times.move_to_end(address)
+                        if self.aggregate_reunion:
+                            self.reunion_batch[address] = None
+                    self.__expire_reunion_routes(now)
+                if not self.aggregate_reunion:
+                    # Our reunion daemon sends no Aggregated Hellos, so relay this one to our parent right away.
+                    p = self.packet_factory.new_reunion_packet(type='AGG',
+                                                               source_address=self.stream.get_server_address(),
+                                                               nodes_array=nodes_array)
+                    self.stream.add_message_to_out_buff(self.parent.get_server_address(), p.get_buf())
+        elif packet.get_body()[0:3] == 'AGB':
+            self_address = self.stream.get_server_address()
+            children_arrays = {}
+            for address in self.packet_factory.parse_aggregated_reunion_body(packet.get_body()):
+                if address == self_address:
+                    log.debug('Reunion Hello Back Packet Received')
+                    self.__reunion_accepted()
+                    continue
+                child_address = self.reunion_routes.get(address)
+                if child_address is None:
+                    continue
+                if self.stream.get_node_by_server(*child_address) is None:
+                    # The child is no longer our neighbour; Its sub-tree says hello through someone else now.
+                    with self.reunion_batch_lock:
+                        self.reunion_routes.pop(address, None)
+                        self.reunion_route_times.pop(address, None)
+                    continue
+                children_arrays.setdefault(child_address, []).append(address)
+            for child_address, nodes_array in children_arrays.items():
+                p = self.packet_factory.new_reunion_packet(type='AGB', source_address=self_address,
+                                                           nodes_array=nodes_array)
+                self.stream.add_message_to_out_buff(child_address, p.get_buf())
         else:
-            raise print('Unexpected type')
+            raise Exception('Unexpected type')
+
+    def __expire_reunion_routes(self, now):
+        """
+        Forget the routes which no Aggregated Hello has refreshed for 38 seconds; By then the Hello Back of the node
+        is too late anyway, and the node has moved, died or says hello through another child. Call it holding
+        reunion_batch_lock.
+
+        :param now: Current time by our clock.
+        :type now: float
+
+        :return:
+        """
+        deadline = now - 38
+        while self.reunion_route_times:
+            address, refresh_time = next(iter(self.reunion_route_times.items()))
+            if refresh_time > deadline:
+                return
+            del self.reunion_route_times[address]
+            del self.reunion_routes[address]
+
+    def __reunion_accepted(self):
+        """
+        Our Reunion Hello Back has arrived; Count its round trip in the reunion_rtt_seconds metric and wake up our
+        Reunion daemon for the next Hello.
+
+        :return:
+        """
+        if self.reunion_pending:
+            self.metrics.observe("reunion_rtt_seconds", self.clock.time() - self.reunion_sending_time)
+        self.reunion_pending = False
+        self.reunion_wake_up.set()
+
+    def __update_reunion_nodes(self, addresses):
+        """
+        As root, turn on the nodes which have said Reunion Hello and save the time.
+
+        :param addresses: Addresses of the nodes.
+        :type addresses: list
+
+        :return:
+        """
+        with self.network_graph_lock:
+            for address in addresses:
+                self.network_graph.turn_on_node(address)
+                self.network_graph.update_reunion_time(address)
 
     def __handle_join_packet(self, packet):
         """
         When a Join packet received we should add new node to our nodes array.
         In reality there is a security level that forbid joining every nodes to our network.
 
+        If the Join has a codec list we remember the codecs the new node accepts and answer with a JACK Join of
+        ours; A JACK Join only tells us the codecs of the neighbour we have joined.
+
         :param packet: Arrived register packet.
 
 
@@ -587,11 +1270,25 @@ class Peer:
 
         :return:
         """
-        print('Join packet sent')
+        body = packet.get_body()
+        codecs = self.packet_factory.parse_join_codecs(body)
+        if body[0:4] == 'JACK':
+            node = self.stream.get_node_by_server(*packet.get_source_server_address())
+            if node is not None:
+                node.codecs = frozenset(codecs)
+            return
+
+        log.debug('Join packet sent')
         self.stream.add_node(packet.get_source_server_address())
         self.neighbours.append(packet.get_source_server_address())
 
-        pass
+        if len(body) > 4:
+            node = self.stream.get_node_by_server(*packet.get_source_server_address())
+            if node is not None:
+                node.codecs = frozenset(codecs)
+            answer = self.packet_factory.new_join_packet(self.stream.get_server_address(), codecs=list(CODECS),
+                                                         type='JACK')
+            self.stream.add_message_to_out_buff(packet.get_source_server_address(), answer.get_buf())
 
     def __get_neighbour(self, sender):
         """
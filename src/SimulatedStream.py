@@ -0,0 +1,121 @@
+from src.Stream import Stream
+from src.tools.Node import Node
+from src.tools.SimulatedNode import SimulatedNode
+
+
+class SimulatedStream(Stream):
+    """
+    A Stream without sockets or Threads whose packets travel through a Simulator in virtual time.
+
+    Packets sent to our nodes are delivered to the SimulatedStream of their address after the link delay of the
+    Simulator, and wake_up asks the Simulator to run the main loop iteration of our Peer; See Simulator.add_peer.
+    Nobody may wait for us in wait_for_in_buf, and out_buff never lingers for a Batch because virtual time does not
+    pass while a Peer handles its packets.
+    send_out_buf_messages only visits the nodes which have queued packets, so a simulated root with a node for every
+    registered peer costs as much as its traffic and not as much as its nodes.
+    """
+
+    def __init__(self, simulator, ip, port, **stream_options):
+        """
+
+        :param simulator: The Simulator we live in.
+        :param ip: 15 characters
+        :param port: 5 characters
+        :param stream_options: The queue and batch options of Stream.
+
+        :type simulator: Simulator
+        """
+        self.simulator = simulator
+        self._server_address = (Node.parse_ip(ip), Node.parse_port(port))
+        # Nodes whose out_buff has packets; dicts are used as insertion ordered sets.
+        self.queued_nodes = {}
+        super().__init__(ip, port, **stream_options)
+        self.batch_linger = 0
+
+    def _start_server(self, ip, port):
+        """
+        Take our address in the Simulator instead of binding a server.
+
+        :param ip: 15 characters
+        :param port: 5 characters
+
+        :return:
+        """
+        self.simulator.bind(self)
+
+    def _close_server(self):
+        """
+        Leave the Simulator; Packets sent to our address are lost from now on.
+
+        :return:
+        """
+        self.simulator.fail(self._server_address)
+
+    def get_server_address(self):
+        """
+
+        :return: Our server address
+        :rtype: tuple
+        """
+        return self._server_address
+
+    def add_node(self, server_address, set_register_connection=False):
+        """
+        Will add new SimulatedNode to our Stream.
+
+        :param server_address: New node server address
+        :param set_register_connection: Shows that is this connection a register_connection or not.
+
+        :type server_address: tuple
+        :type set_register_connection: bool
+
+        :return: The node of the address.
+        :rtype: SimulatedNode
+        """
+        node = self._find_node(server_address, set_register_connection)
+        if node is not None:
+            return node
+        node = SimulatedNode(server_address, self, set_register=set_register_connection,
+                             connection_pool=self.connections, clock=self.clock, **self.queue_options,
+                             **self._batch_options(set_register_connection))
+
+        self._index_node(node)
+        return node
+
+    def send_out_buf_messages(self, only_register=False):
+        """
+        Send the out_buff of every node which has queued packets; Only of the register_connections if only_register.
+
+        :return:
+        """
+        for n in list(self.queued_nodes):
+            if only_register and not n.is_register_connection:
+                continue
+            del self.queued_nodes[n]
+            self.send_messages_to_node(n)
+
+    def deliver(self, packets):
+        """
+        Buffer packets which have arrived through the Simulator and wake up our Peer.
+
+        :param packets: Packets in the network format, in the order they were sent.
+        :type packets: list
+
+        :return:
+        """
+        if self.tracer is not None:
+            for b in packets:
+                self._trace_arrival(b)
+        self._server_in_buf.extend(packets)
+        self.wake_up()
+
+    def wait_for_in_buf(self, timeout=None):
+        raise Exception("A SimulatedStream is driven by its Simulator; Nobody can wait for it.")
+
+    def wake_up(self):
+        """
+        Ask the Simulator to run the main loop iteration of our Peer at the current virtual time.
+
+        :return:
+        """
+        self.simulator.wake(self.get_server_address())
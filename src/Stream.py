@@ -1,12 +1,24 @@
 from src.tools.simpletcp.tcpserver import TCPServer
 
 from src.tools.Node import Node
+from src.tools.Clock import Clock
+from src.tools.ConnectionPool import ConnectionPool
+from src.Packet import PacketFactory
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import socket
 import threading
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class Stream:
 
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, pipelined=False, max_queue_packets=None, max_queue_bytes=None,
+                 queue_policy="drop-oldest", send_workers=0, send_timeout=None, batch_bytes=None, batch_linger=0,
+                 reconnect_attempts=5, reconnect_backoff=0.1, max_reconnect_backoff=5, metrics=None, tracer=None,
+                 clock=None):
         """
         The Stream object constructor.
 
@@ -16,26 +28,153 @@ class Stream:
 
         :param ip: 15 characters
         :param port: 5 characters
+        :param pipelined: Make every Node send its whole out_buff at once without waiting for b'ACK' per packet.
+        :param max_queue_packets: Maximum number of packets in the out_buff of every Node; None means no limit.
+        :param max_queue_bytes: Maximum total bytes in the out_buff of every Node; None means no limit.
+        :param queue_policy: What a Node does when its out_buff is full; One of Node.QUEUE_POLICIES.
+        :param send_workers: Number of Threads which send the out_buff of our nodes concurrently, so a slow node
+                             does not hold up the others; With 0 send_out_buf_messages sends to the nodes one by one.
+        :param send_timeout: Seconds after which a node that does not accept our packets fails and is removed;
+                             None waits forever.
+        :param batch_bytes: Pack the packets for every node except the register_connections into Batch packets of
+                            at most this many bytes; None sends every packet on its own.
+        :param batch_linger: With batch_bytes; Seconds send_out_buf_messages may keep the packets of a node back
+                             waiting for more of them, unless they already fill batch_bytes.
+        :param reconnect_attempts: Consecutive failed connection attempts to a node after which it is removed; Until
+                                   then its packets are kept and sent once it is connected again. None never gives
+                                   up.
+        :param reconnect_backoff: Seconds we wait before connecting again after the first failure of a node; The
+                                  wait doubles with every further failure.
+        :param max_reconnect_backoff: Maximum seconds we wait before connecting again.
+        :param metrics: Count the packets and bytes we queue for our nodes by type in it, and give it the queue
+                        depth of every node; None counts nothing.
+        :param tracer: Record the arrival, queueing and sending of every packet in it, as a process named by our
+                       address; None records nothing.
+        :param clock: Source of the time batch_linger is measured in, for us and our nodes; Wall-clock time by
+                      default.
         """
+        if queue_policy not in Node.QUEUE_POLICIES:
+            raise Exception("Unknown queue policy.")
 
         ip = Node.parse_ip(ip)
         port = Node.parse_port(port)
 
         self._server_in_buf = []
+        self._in_buf_condition = threading.Condition()
+        self._in_buf_arrived = False
+
+        self.pipelined = pipelined
+        self.queue_options = {"max_queue_packets": max_queue_packets, "max_queue_bytes": max_queue_bytes,
+                              "queue_policy": queue_policy}
+        self.send_timeout = send_timeout
+        # Our outbound connections; Nodes removed and added again for the same address reuse them.
+        self.connections = ConnectionPool(timeout=send_timeout, backoff=reconnect_backoff,
+                                          max_backoff=max_reconnect_backoff, max_failures=reconnect_attempts)
+        self.batch_bytes = batch_bytes
+        self.batch_linger = batch_linger if batch_bytes is not None else 0
+        self.clock = clock if clock is not None else Clock()
+        self._send_executor = None
+        if send_workers > 0:
+            self._send_executor = ThreadPoolExecutor(send_workers, thread_name_prefix="stream-send")
+        # Drops of the nodes we have removed.
+        self._removed_dropped_packets = 0
+        self._removed_dropped_bytes = 0
+        self.nodes = []
+        self._nodes_by_address = {}
+        # (server address, is_register_connection) -> node; add_node keeps at most one node of every kind.
+        self._nodes_by_kind = {}
+        self._broadcast_nodes = None
+        self.ip = ip
+        self.port = port
+        self._closed = False
+
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_collector(self.collect_metrics)
+
+        self.tracer = tracer
+        self.trace_pid = None
+        if tracer is not None:
+            self.trace_pid = tracer.add_process("%s:%s" % (ip, port))
+
+        self._start_server(ip, port)
+
+    def _start_server(self, ip, port):
+        """
+        Bind our TCPServer and run it in a separate Thread.
+
+        :param ip: 15 characters
+        :param port: 5 characters
+
+        :return:
+        """
 
         def cb(ip, queue, data):
             queue.put(bytes('ACK', 'utf8'))
             # self.messages_dic.update({ip: self.messages_dic.get(ip).append(data)})
-            self._server_in_buf.append(data)
+            self._buffer_in_data(data)
 
-        print("Binding server: ", ip, ": ", port)
-        self._server = TCPServer(ip, int(port), cb)
-        tcpserver_thread = threading.Thread(target=self._server.run)
+        log.info("Binding server: %s: %s", ip, port)
+        self._server = TCPServer(ip, int(port), cb, maximum_connections=socket.SOMAXCONN, recv_bytes=65536,
+                                 frame_length=PacketFactory.get_frame_length)
+        tcpserver_thread = threading.Thread(target=self._server.run, daemon=True)
         # self._server.run()
         tcpserver_thread.start()
-        self.nodes = []
-        self.ip = ip
-        self.port = port
+
+    def close(self):
+        """
+        Stop our server, close the connections of our nodes and stop our send workers; The Stream is useless
+        afterwards. Closing again does nothing.
+
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for node in self.nodes:
+            node.close()
+        self.connections.close()
+        self._close_server()
+        if self._send_executor is not None:
+            self._send_executor.shutdown(wait=False)
+
+    def _close_server(self):
+        """
+        Stop our TCPServer; Its Thread closes its sockets and exits.
+
+        :return:
+        """
+        self._server.close()
+
+    def _buffer_in_data(self, data):
+        """
+        Append a received packet to our input buffer and wake up the main loop; Called from the server thread.
+
+        :param data: Exactly one complete packet; The server reassembles packets from the byte stream of every
+                     connection by the Length field of their headers.
+        :type data: bytes
+
+        :return:
+        """
+        if self.tracer is not None:
+            self._trace_arrival(data)
+        with self._in_buf_condition:
+            self._server_in_buf.append(data)
+            self._in_buf_arrived = True
+            self._in_buf_condition.notify_all()
+
+    def _trace_arrival(self, data):
+        """
+        Give an arrived packet a new span ID in our tracer; Peer.handle_buffers takes it from there.
+
+        :param data: The packet.
+        :type data: bytes
+
+        :return:
+        """
+        now = self.tracer.clock()
+        span = self.tracer.mark((self.trace_pid, "in"), data)
+        self.tracer.record(self.trace_pid, "ServerSocket", now, span=span, bytes=len(data))
 
     def get_server_address(self):
         """
@@ -51,24 +190,126 @@ class Stream:
 
         :return:
         """
-        self._server_in_buf.clear()
+        with self._in_buf_condition:
+            self._server_in_buf.clear()
+
+    def wait_for_in_buf(self, timeout=None):
+        """
+        Block until our TCPServer callback buffers new data or the timeout expires.
+
+        The TCPServer thread notifies us as soon as a packet arrives, so the main loop can handle it immediately
+        instead of sleeping for a fixed interval.
+
+        Warnings:
+            1. Only data arrived after the previous call will wake us up; Packets which are still waiting in the
+               input buffer (e.g. in Reunion failure mode) will not make this function return immediately.
+
+        :param timeout: Maximum seconds to wait; None means wait forever.
+        :type timeout: float
+
+        :return: Whether new data has arrived.
+        :rtype: bool
+        """
+        with self._in_buf_condition:
+            arrived = self._in_buf_condition.wait_for(lambda: self._in_buf_arrived, timeout)
+            self._in_buf_arrived = False
+            return arrived
+
+    def wake_up(self):
+        """
+        Wake up anyone who is blocked in wait_for_in_buf without buffering any data.
+
+        :return:
+        """
+        with self._in_buf_condition:
+            self._in_buf_arrived = True
+            self._in_buf_condition.notify_all()
+
+    def pop_in_buf(self):
+        """
+        Atomically take every buffered input of our TCPServer and leave an empty buffer behind.
+
+        Unlike read_in_buf followed by clear_in_buff, data that arrives in between can not be lost.
+
+        :return: TCPServer input buffer.
+        :rtype: list
+        """
+        with self._in_buf_condition:
+            buf = self._server_in_buf
+            self._server_in_buf = []
+            return buf
 
     def add_node(self, server_address, set_register_connection=False):
         """
         Will add new node to our Stream.
 
+        If we already have a node of the same kind for the address it is kept with its connection and out_buff, so
+        e.g. a repeated Advertise does not open a new connection.
+
         :param server_address: New node TCPServer address
         :param set_register_connection: Shows that is this connection a register_connection or not.
 
         :type server_address: tuple
         :type set_register_connection: bool
 
-        :return:
+        :return: The node of the address.
+        :rtype: Node
+        """
+        node = self._find_node(server_address, set_register_connection)
+        if node is not None:
+            return node
+        log.debug("Trying to connect to this address: %s", server_address)
+        node = Node(server_address, set_register=set_register_connection, pipelined=self.pipelined,
+                    connection_pool=self.connections, clock=self.clock, **self.queue_options,
+                    **self._batch_options(set_register_connection))
+
+        self._index_node(node)
+        return node
+
+    def _find_node(self, server_address, set_register_connection):
         """
-        print("Trying to connect to this address: ", server_address)
-        node = Node(server_address, set_register=set_register_connection)
 
+        :param server_address: A node TCPServer address.
+        :param set_register_connection: Whether we look for a register_connection.
+
+        :type server_address: tuple
+        :type set_register_connection: bool
+
+        :return: Our node of the address and kind, or None.
+        :rtype: Node
+        """
+        address = (Node.parse_ip(server_address[0]), Node.parse_port(server_address[1]))
+        return self._nodes_by_kind.get((address, set_register_connection))
+
+    def _batch_options(self, set_register_connection):
+        """
+        Register connections carry the control packets of the root and the Reunion failure mode of Peer, which
+        looks for an Advertise packet among the raw arrived packets; They are never batched.
+
+        :param set_register_connection: Whether the new node is a register_connection.
+        :type set_register_connection: bool
+
+        :return: The batch options for a new node.
+        :rtype: dict
+        """
+        if set_register_connection or self.batch_bytes is None:
+            return {}
+        return {"batch_bytes": self.batch_bytes, "batch_linger": self.batch_linger,
+                "batch_source_address": self.get_server_address()}
+
+    def _index_node(self, node):
+        """
+        Append the node to our nodes and update the indexes over them.
+
+        :param node: The new node.
+        :type node: Node
+
+        :return:
+        """
         self.nodes.append(node)
+        self._nodes_by_address.setdefault(node.get_server_address(), node)
+        self._nodes_by_kind[(node.get_server_address(), node.is_register_connection)] = node
+        self._broadcast_nodes = None
 
     def remove_node(self, node):
         """
@@ -83,12 +324,23 @@ class Stream:
         :return:
         """
         self.nodes.remove(node)
+        address = node.get_server_address()
+        if self._nodes_by_kind.get((address, node.is_register_connection)) is node:
+            del self._nodes_by_kind[(address, node.is_register_connection)]
+        if self._nodes_by_address.get(address) is node:
+            del self._nodes_by_address[address]
+            other = self._nodes_by_kind.get((address, not node.is_register_connection))
+            if other is not None:
+                self._nodes_by_address[address] = other
+        self._broadcast_nodes = None
+        self._removed_dropped_packets += node.dropped_packets
+        self._removed_dropped_bytes += node.dropped_bytes
         node.close()
 
     def get_node_by_server(self, ip, port):
         """
 
-        Will find the node that has IP/Port address of input.
+        Will find the node that has IP/Port address of input; It is a dictionary lookup.
 
         Warnings:
             1. Before comparing the address parse it to a standard format with Node.parse_### functions.
@@ -99,11 +351,7 @@ class Stream:
         :return: The node that input address.
         :rtype: Node
         """
-        port = Node.parse_port(port)
-        ip = Node.parse_ip(ip)
-        for nd in self.nodes:
-            if nd.get_server_address()[0] == ip and nd.get_server_address()[1] == port:
-                return nd
+        return self._nodes_by_address.get((Node.parse_ip(ip), Node.parse_port(port)))
 
     def add_message_to_out_buff(self, address, message):
         """
@@ -118,14 +366,152 @@ class Stream:
 
         :return:
         """
-        print("add message to out buff: ", address, " ", message)
+        log.debug("add message to out buff: %s %s", address, message)
         n = self.get_node_by_server(address[0], address[1])
         # if n is None:
         #     n = self.get_node_by_client(address[0], address[1])
         if n is None:
-            return print("Unexpected address to add message to out buffer.")
+            log.warning("Unexpected address to add message to out buffer: %s", address)
+            return
 
         n.add_message_to_out_buff(message)
+        if self.metrics is not None:
+            self._count_out(message, 1)
+        if self.tracer is not None:
+            self._trace_queued(n, message)
+
+    def _trace_queued(self, node, message):
+        """
+        Remember when a packet was queued for a node, with the span ID of the packet we are handling, or a new one.
+
+        :param node: The node.
+        :param message: The packet.
+
+        :type node: Node
+        :type message: bytes
+
+        :return:
+        """
+        self.tracer.mark((self.trace_pid, id(node)), message, self.tracer.get_current_span())
+
+    def _count_out(self, message, count):
+        """
+        Count a packet we have queued for count nodes in our metrics.
+
+        :param message: The packet in the network format.
+        :param count: Number of nodes.
+
+        :type message: bytes
+        :type count: int
+
+        :return:
+        """
+        packet_type = PacketFactory.get_type_name(message)
+        self.metrics.increment("packets_out", count, type=packet_type)
+        self.metrics.increment("bytes_out", count * len(message), type=packet_type)
+
+    def collect_metrics(self, metrics):
+        """
+        Set the queue depth gauges of our nodes and the drop gauges; Called by metrics before every snapshot, maybe
+        from another Thread.
+
+        :param metrics: Our metrics.
+        :type metrics: Metrics
+
+        :return:
+        """
+        metrics.clear_gauges("queue_packets")
+        metrics.clear_gauges("queue_bytes")
+        for n in list(self.nodes):
+            node = "%s:%s" % n.get_server_address()
+            kind = "register" if n.is_register_connection else "neighbour"
+            metrics.set_gauge("queue_packets", len(n.out_buff), node=node, kind=kind)
+            metrics.set_gauge("queue_bytes", n.out_buff_bytes, node=node, kind=kind)
+        dropped_packets, dropped_bytes = self.get_dropped()
+        metrics.set_gauge("dropped_packets", dropped_packets)
+        metrics.set_gauge("dropped_bytes", dropped_bytes)
+        metrics.set_gauge("nodes", len(self.nodes))
+
+    def get_dropped(self):
+        """
+        Packets our nodes have dropped because their out_buff was full, including the nodes we have removed.
+
+        :return: Number of the dropped packets and their total bytes.
+        :rtype: tuple
+        """
+        return (self._removed_dropped_packets + sum(n.dropped_packets for n in self.nodes),
+                self._removed_dropped_bytes + sum(n.dropped_bytes for n in self.nodes))
+
+    def get_broadcast_nodes(self):
+        """
+        Nodes which broadcast messages should be sent to; It is computed once after every add_node/remove_node.
+
+        :return: Every node which is not a register_connection.
+        :rtype: tuple
+        """
+        if self._broadcast_nodes is None:
+            self._broadcast_nodes = tuple(n for n in self.nodes if not n.is_register_connection)
+        return self._broadcast_nodes
+
+    def add_message_to_broadcast_buffs(self, message, exclude_address=None, codec=None, make_fallback=None):
+        """
+        Add the same message object to the output buffer of every broadcast node.
+
+        :param message: Serialised packet; Should be immutable because it is shared between the nodes.
+        :param exclude_address: Server address of a node that should not get the message, e.g. the sender.
+        :param codec: If the message is compressed, name of its codec; Only the nodes which accept it get message.
+        :param make_fallback: Makes the packet for the nodes which do not accept codec; It is called at most once.
+                              If it raises ValueError those nodes get nothing.
+
+        :type message: bytes
+        :type exclude_address: tuple
+        :type codec: str
+        :type make_fallback: function
+
+        :return:
+        """
+        fallback = None
+        sent = fallback_sent = 0
+        for n in self.get_broadcast_nodes():
+            if n.get_server_address() == exclude_address:
+                continue
+            if codec is None or codec in n.codecs:
+                n.add_message_to_out_buff(message)
+                sent += 1
+                if self.tracer is not None:
+                    self._trace_queued(n, message)
+                continue
+            if fallback is None:
+                try:
+                    fallback = make_fallback()
+                except ValueError as e:
+                    log.warning("Can not uncompress the message: %s", e)
+                    fallback = b''
+            if fallback:
+                n.add_message_to_out_buff(fallback)
+                fallback_sent += 1
+                if self.tracer is not None:
+                    self._trace_queued(n, fallback)
+        if self.metrics is not None:
+            if sent:
+                self._count_out(message, sent)
+            if fallback_sent:
+                self._count_out(fallback, fallback_sent)
+
+    def unread_in_buf(self, buffers):
+        """
+        Put packets taken with pop_in_buf back in front of our input buffer, so the next pop_in_buf returns them
+        first; It does not wake up wait_for_in_buf.
+
+        :param buffers: Packets in the network format in arrival order.
+        :type buffers: list
+
+        :return:
+        """
+        if not buffers:
+            return
+        with self._in_buf_condition:
+            self._server_in_buf = buffers + self._server_in_buf
 
     def read_in_buf(self):
         """
@@ -140,6 +526,10 @@ class Stream:
         """
         Send buffered messages to the 'node'
 
+        With send_workers the messages are handed over to a worker Thread and we do not wait for them; A failure
+        of the previous hand over is noticed here. When the worker is done and the node has new messages, or it has
+        failed, we wake up the main loop so it calls us again without waiting for its idle interval.
+
         Warnings:
             1. Insert an exception handler here; Maybe the node socket you want to send message has turned off and you
                need to remove this node from stream nodes.
@@ -149,20 +539,101 @@ class Stream:
 
         :return:
         """
+        if self.tracer is not None:
+            return self._trace_send(node)
+        self._send_to_node(node)
+
+    def _send_to_node(self, node):
+        """
+        Send the out_buff of the node, or hand it over to a send worker; Remove the node if its connection has
+        failed for good.
+
+        :param node:
+        :type node Node
 
+        :return:
+        """
         try:
-            node.send_message()
-        except:
+            if self._send_executor is None:
+                node.send_message()
+            else:
+                future = node.send_message_in(self._send_executor)
+                if future is not None:
+                    future.add_done_callback(functools.partial(self._on_send_done, node))
+        except (OSError, ConnectionError):
             self.remove_node(node)
 
+    def _on_send_done(self, node, future):
+        """
+        A send worker is done with a batch of the node; Wake up the main loop if the batch has failed, or has
+        packets to send again, or the node has new packets, so it calls send_messages_to_node again.
+
+        :param node: The node of the batch.
+        :param future: What Node.send_message_in has returned.
+
+        :type node: Node
+        :type future: concurrent.futures.Future
+
+        :return:
+        """
+        if future.exception() is not None or future.result() is not None or node.out_buff:
+            self.wake_up()
+
+    def _trace_send(self, node):
+        """
+        send_messages_to_node, recording in our tracer how long the packets which have left the out_buff of the node
+        waited there and how long sending them took; With send_workers only the hand over to a worker is timed.
+        Packets kept in out_buff, e.g. after a failure, keep their marks for the next time.
+
+        :param node:
+        :type node Node
+
+        :return:
+        """
+        packets = list(node.out_buff)
+        start = self.tracer.clock()
+        self._send_to_node(node)
+        end = self.tracer.clock()
+        kept = {id(b) for b in node.out_buff}
+        spans = []
+        for b in packets:
+            if id(b) in kept:
+                continue
+            span, queued_time = self.tracer.take_mark((self.trace_pid, id(node)), b)
+            if span is not None:
+                spans.append(span)
+                self.tracer.record(self.trace_pid, "Node.out_buff", queued_time, start, span=span)
+        if spans:
+            self.tracer.record(self.trace_pid, "Node.send_message", start, end, spans=spans,
+                               node="%s:%s" % node.get_server_address())
+
+    def get_linger_timeout(self):
+        """
+
+        :return: Seconds until the out_buff of a node stops lingering, so send_out_buf_messages should be called
+                 again; None if no node is lingering.
+        :rtype: float
+        """
+        if not self.batch_linger:
+            return None
+        deadlines = [d for d in (n.get_linger_deadline() for n in self.nodes) if d is not None]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - self.clock.time())
+
     def send_out_buf_messages(self, only_register=False):
         """
         In this function we will send hole out buffers to their own clients.
 
+        Nodes whose out_buff is lingering for more packets are skipped; See Node.is_lingering.
+
         :return:
         """
 
-        for n in self.nodes:
+        now = self.clock.time()
+        for n in list(self.nodes):
+            if n.is_lingering(now):
+                continue
             if only_register:
                 if n.is_register_connection:
                     self.send_messages_to_node(n)
@@ -5,10 +5,22 @@ import time
 class UserInterface(threading.Thread):
     buffer = []
 
+    def __init__(self, on_command=None):
+        """
+
+        :param on_command: Called after every new command was buffered; e.g. for waking up the Peer main loop.
+        :type on_command: callable
+        """
+        super().__init__(daemon=True)
+        self.buffer = []
+        self.on_command = on_command
+
     def run(self):
         while True:
             message = input("Write your command:\n")
             self.buffer.append(message)
+            if self.on_command is not None:
+                self.on_command()
 
     # Which the user or client sees and works with. run() #This method runs every time to
     #  see whether there is new messages or not.
@@ -0,0 +1,4 @@
+import logging
+
+# Our modules log to children of this logger; They are silent until src.tools.Log.configure_logging is called.
+logging.getLogger(__name__).addHandler(logging.NullHandler())
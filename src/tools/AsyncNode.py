@@ -0,0 +1,187 @@
+import asyncio
+
+from src.tools.Node import Node
+from collections import deque
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AsyncNode(Node):
+    def __init__(self, server_address, loop, set_root=False, set_register=False, **node_options):
+        """
+        The AsyncNode object constructor.
+
+        This is the asyncio flavour of Node; Its connection lives on the event loop of an AsyncStream and a writer
+        task owns the socket, so sending to this Node never blocks the main loop or the other Nodes.
+
+        Warnings:
+            1. Connecting happens in the background; If it fails, or the connection breaks later, the Node is marked
+               as detached. The next send_message puts the packets the writer task has not written back in front of
+               out_buff and connects again once the connection pool allows it, like the threaded Node; Only after
+               the pool has given up on our address does it raise ConnectionError, so the AsyncStream removes us.
+
+        :param server_address:
+        :param loop: The event loop which hosts every connection of our AsyncStream.
+        :param set_root:
+        :param set_register:
+        :param node_options: The out_buff options of Node: max_queue_packets, max_queue_bytes and queue_policy bound
+                             out_buff between two send_message calls, batch_bytes, batch_linger and
+                             batch_source_address pack it into Batch packets, connection_pool counts our failures and
+                             clock times batch_linger.
+
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self._loop = loop
+        # Batches handed over to the writer task; A deque, so the main loop can take back what it has not written.
+        self._batches = deque()
+        # The batch the writer task was writing when our connection broke.
+        self._unsent = []
+        super().__init__(server_address, set_root=set_root, set_register=set_register, **node_options)
+
+    def _connect(self):
+        """
+        Start the writer task of this Node on the event loop.
+
+        :return:
+        """
+        self.detached = False
+        self._failure_counted = False
+        self._reader_done = False
+        self._wake_up = asyncio.Event()
+        self._task = asyncio.run_coroutine_threadsafe(self._run_writer(), self._loop)
+
+    async def _run_writer(self):
+        """
+        Connect to the Node TCPServer and write every batch of packets handed over by send_message.
+
+        :return:
+        """
+        try:
+            reader, writer = await asyncio.open_connection(AsyncNode.socket_ip(self.server_ip),
+                                                           int(self.server_port, 10))
+        except OSError:
+            log.info("Node %s: %s was detached.", self.server_ip, self.server_port)
+            self.detached = True
+            return
+        self.connections.succeed(self.get_server_address())
+
+        response_task = self._loop.create_task(self._discard_responses(reader))
+        batch = []
+        try:
+            while not self._reader_done:
+                await self._wake_up.wait()
+                self._wake_up.clear()
+                while self._batches and not self._reader_done:
+                    batch = self._batches.popleft()
+                    for b in batch:
+                        writer.write(bytes(b))
+                    await writer.drain()
+                    batch = []
+        except OSError:
+            pass
+        finally:
+            log.info("Node %s: %s was detached.", self.server_ip, self.server_port)
+            self._unsent = batch
+            self.detached = True
+            response_task.cancel()
+            writer.close()
+
+    async def _discard_responses(self, reader):
+        """
+        Consume the b'ACK' responses of the Node TCPServer so they do not pile up in our socket; When the server
+        closes our connection, stop the writer task.
+
+        :param reader: Reader side of our connection.
+        :type reader: asyncio.StreamReader
+
+        :return:
+        """
+        try:
+            while await reader.read(2048):
+                pass
+        except OSError:
+            pass
+        self._reader_done = True
+        self._wake_up.set()
+
+    def send_message(self):
+        """
+        Hand over out_buff to the writer task without waiting for the network.
+
+        :return:
+        """
+        if self.overflowed:
+            raise ConnectionError("Node out_buff overflowed.")
+        if self.detached and not self._reconnect():
+            return
+        if not self.out_buff:
+            return
+        self._batches.append(list(self._take_out_buff()))
+        self._loop.call_soon_threadsafe(self._wake_up.set)
+
+    def _reconnect(self):
+        """
+        After our writer task has stopped, put the packets it has not written back in front of out_buff, count the
+        failure in our connection pool and start a new writer task once the pool allows it.
+
+        :return: Whether we have started a new writer task.
+        :rtype: bool
+
+        :raise ConnectionError: If the connection pool has given up on our address.
+        """
+        unsent = [self._unsent] if self._unsent else []
+        self._unsent = []
+        while self._batches:
+            unsent.append(self._batches.popleft())
+        packets = [b for batch in unsent for b in batch]
+        if packets:
+            log.info("Connection to %s: %s has broken; %d packets are kept to be sent again.", self.server_ip,
+                     self.server_port, len(packets))
+        for b in reversed(packets):
+            self.out_buff.appendleft(b)
+            self.out_buff_bytes += len(b)
+        self._trim_out_buff()
+        if self.out_buff and self._first_queued_time is None:
+            self._first_queued_time = self.clock.time()
+
+        address = self.get_server_address()
+        if not self._failure_counted:
+            self.connections.fail(address)
+            self._failure_counted = True
+        if self.connections.is_unreachable(address):
+            raise ConnectionError("Node is unreachable.")
+        if self.connections.is_waiting(address):
+            return False
+        self._connect()
+        return True
+
+    def send_message_in(self, executor):
+        """
+        send_message never waits for the network here, so we do not need the executor.
+
+        :param executor: Ignored.
+
+        :return: None; The writer task has no future to wait for.
+        """
+        self.send_message()
+        return None
+
+    def close(self):
+        """
+        Cancelling the writer task, which closes our connection.
+        :return:
+        """
+        self._task.cancel()
+
+    @staticmethod
+    def socket_ip(ip):
+        """
+        Change the input IP to the format the socket library expects; e.g. '192.168.1.1' for '192.168.001.001'.
+        :param ip: Input IP
+        :type ip: str
+
+        :return: Formatted IP
+        :rtype: str
+        """
+        return '.'.join(str(int(part)) for part in ip.split('.'))
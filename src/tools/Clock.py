@@ -0,0 +1,50 @@
+import time
+
+
+class Clock:
+    """
+    Source of the current time of a Peer, its NetworkGraph, caches and Stream; Wall-clock time.
+    """
+
+    def time(self):
+        """
+
+        :return: Seconds since the epoch.
+        :rtype: float
+        """
+        return time.time()
+
+
+class VirtualClock(Clock):
+    """
+    Time of a discrete-event simulation; It only moves when the Simulator advances it to its next event.
+    """
+
+    def __init__(self, now=0.0):
+        """
+
+        :param now: Start time.
+        :type now: float
+        """
+        self.now = now
+
+    def time(self):
+        """
+
+        :return: Current virtual time.
+        :rtype: float
+        """
+        return self.now
+
+    def advance_to(self, now):
+        """
+        Move the time forward to now.
+
+        :param now: New time; Never earlier than the current time.
+        :type now: float
+
+        :return:
+        """
+        if now < self.now:
+            raise Exception("Virtual time can not go backwards.")
+        self.now = now
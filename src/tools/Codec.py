@@ -0,0 +1,102 @@
+import zlib
+
+
+class Codec:
+    """
+    Interface of the payload compression codecs of Message packets.
+
+    A codec is known by a name of exactly 4 characters, which goes into the Codec field of the Message body and
+    into the codec list of Join packets. Register new codecs with register_codec on every peer that should use them.
+    """
+    name = None
+
+    def compress(self, data):
+        """
+
+        :param data: Uncompressed payload.
+        :type data: bytes
+
+        :return: Compressed payload.
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+    def decompress(self, data, max_length):
+        """
+
+        :param data: Compressed payload.
+        :param max_length: Maximum length of the uncompressed payload; A few bytes may inflate to gigabytes, so
+                           stop before that instead of allocating them.
+
+        :type data: bytes
+        :type max_length: int
+
+        :return: Uncompressed payload.
+        :rtype: bytes
+
+        :raise ValueError: If the data is corrupted or its uncompressed payload is longer than max_length.
+        """
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        """
+
+        :param level: zlib compression level from 1 (fastest) to 9 (smallest).
+        :type level: int
+        """
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, max_length):
+        decompressor = zlib.decompressobj()
+        try:
+            data = decompressor.decompress(data, max_length)
+        except zlib.error as e:
+            raise ValueError(str(e))
+        # The rest may only be the checksum of a payload of exactly max_length bytes.
+        if decompressor.unconsumed_tail and decompressor.decompress(decompressor.unconsumed_tail, 1):
+            raise ValueError("Uncompressed payload is longer than %d bytes." % max_length)
+        if not decompressor.eof:
+            raise ValueError("Compressed payload is incomplete.")
+        return data
+
+
+# Codec field of an uncompressed Message body.
+NO_CODEC = 'none'
+
+CODECS = {}
+
+
+def register_codec(codec):
+    """
+    Make the codec available to compress and decompress Message payloads.
+
+    :param codec: The codec; Replaces a registered codec of the same name.
+    :type codec: Codec
+
+    :return:
+    """
+    if codec.name is None or len(codec.name) != 4 or not codec.name.isascii() or codec.name == NO_CODEC:
+        raise Exception("Codec name must be 4 ASCII characters.")
+    CODECS[codec.name] = codec
+
+
+def get_codec(name):
+    """
+
+    :param name: Codec name.
+    :type name: str
+
+    :return: The registered codec of the name, or None.
+    :rtype: Codec
+    """
+    return CODECS.get(name)
+
+
+register_codec(ZlibCodec())
@@ -0,0 +1,197 @@
+from src.tools.simpletcp.clientsocket import ClientSocket
+from collections import OrderedDict
+import time
+
+
+class ConnectionPool:
+    """
+    Outbound connections of a Stream to the TCPServers of other peers.
+
+    A Node borrows its ClientSocket with acquire and gives it back with release when it is removed; The connection
+    is kept open, so a Node added again for the same address, e.g. after a new Advertise, starts without connecting.
+    When connecting to an address fails, or a Node reports its connection as broken with fail, we wait before the
+    next connection attempt to that address; The wait doubles with every consecutive failure up to max_backoff.
+    """
+
+    def __init__(self, timeout=None, backoff=0.1, max_backoff=5, max_failures=5, max_idle=64):
+        """
+
+        :param timeout: Seconds after which connecting, a write or a read of a connection fails with socket.timeout;
+                        None waits forever.
+        :param backoff: Seconds we wait after the first failure of an address.
+        :param max_backoff: Maximum seconds we wait between two connection attempts.
+        :param max_failures: After this many consecutive failures of an address is_unreachable tells so; None
+                             never gives up.
+        :param max_idle: Maximum number of released connections we keep open.
+
+        :type timeout: float
+        :type backoff: float
+        :type max_backoff: float
+        :type max_failures: int
+        :type max_idle: int
+        """
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_failures = max_failures
+        self.max_idle = max_idle
+        # (ip, port) -> [ClientSocket]; Released connections, the least recently released first.
+        self._idle = OrderedDict()
+        # (ip, port) -> [number of consecutive failures, time.monotonic of the next connection attempt]; Unlike
+        # time.time it does not jump with changes of the system clock.
+        self._failures = {}
+        self.connects = 0
+        self.reuses = 0
+
+    def acquire(self, address):
+        """
+        Take a released connection to the address, or connect to it.
+
+        :param address: Server address; The format is like ('192.168.001.001', '05335').
+        :type address: tuple
+
+        :return: A connected ClientSocket.
+        :rtype: ClientSocket
+
+        :raise ConnectionError: If we are still waiting after the last failure of the address.
+        :raise OSError: If connecting fails.
+        """
+        client = self._take_idle(address)
+        if client is not None:
+            self.reuses += 1
+            return client
+
+        if self.is_waiting(address):
+            raise ConnectionError("Waiting to reconnect.")
+        try:
+            client = ClientSocket(address[0], int(address[1], 10), single_use=False, timeout=self.timeout)
+        except OSError:
+            self.fail(address)
+            raise
+        self.succeed(address)
+        self.connects += 1
+        return client
+
+    def _take_idle(self, address):
+        """
+        Take a released connection to the address which is still open; The peer may have closed a connection while
+        it was idle, and its failure must not count against the address when we send through it.
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return: The most recently released open connection, or None.
+        :rtype: ClientSocket
+        """
+        idle = self._idle.get(address)
+        while idle:
+            client = idle.pop()
+            try:
+                # Drop the responses left unread; It raises if the peer has closed or reset the connection.
+                client.discard_responses()
+            except OSError:
+                client.close()
+                continue
+            if not idle:
+                del self._idle[address]
+            return client
+        self._idle.pop(address, None)
+        return None
+
+    def succeed(self, address):
+        """
+        Forget the failures of an address after connecting to it has worked; e.g. for an AsyncNode, which connects
+        on its own.
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return:
+        """
+        self._failures.pop(address, None)
+
+    def release(self, address, client):
+        """
+        Keep a healthy connection open for the next acquire of the address.
+
+        :param address: Server address of the connection.
+        :param client: The connection.
+
+        :type address: tuple
+        :type client: ClientSocket
+
+        :return:
+        """
+        self._idle.setdefault(address, []).append(client)
+        self._idle.move_to_end(address)
+        while sum(len(clients) for clients in self._idle.values()) > self.max_idle:
+            oldest_address, clients = next(iter(self._idle.items()))
+            clients.pop(0).close()
+            if not clients:
+                del self._idle[oldest_address]
+
+    def fail(self, address, client=None):
+        """
+        Count a failure of the address and schedule its next connection attempt.
+
+        :param address: Server address.
+        :param client: The broken connection, if any; It is closed.
+
+        :type address: tuple
+        :type client: ClientSocket
+
+        :return:
+        """
+        if client is not None:
+            client.close()
+        failures = self._failures.get(address, [0, 0])[0] + 1
+        delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+        self._failures[address] = [failures, time.monotonic() + delay]
+
+    def is_waiting(self, address):
+        """
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return: Whether we are still waiting before the next connection attempt after the last failure of the
+                 address.
+        :rtype: bool
+        """
+        failure = self._failures.get(address)
+        return failure is not None and time.monotonic() < failure[1]
+
+    def is_unreachable(self, address):
+        """
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return: Whether the address has failed max_failures times in a row.
+        :rtype: bool
+        """
+        failure = self._failures.get(address)
+        return self.max_failures is not None and failure is not None and failure[0] >= self.max_failures
+
+    def get_retry_time(self, address):
+        """
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return: When we may connect to the address again, in time.monotonic seconds; None if it has not failed.
+        :rtype: float
+        """
+        failure = self._failures.get(address)
+        return None if failure is None else failure[1]
+
+    def close(self):
+        """
+        Close every released connection.
+
+        :return:
+        """
+        for clients in self._idle.values():
+            for client in clients:
+                client.close()
+        self._idle.clear()
@@ -0,0 +1,143 @@
+from src.tools.Clock import Clock
+from collections import OrderedDict
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class FragmentBuffer:
+    """
+    Reassembles the messages which arrive in Fragment packets.
+
+    The fragments of at most max_messages messages are kept at a time, each for ttl seconds after its first fragment
+    has arrived; A message which is still incomplete by then, or when newer messages need its room, is dropped.
+    Messages are kept in the order their first fragment has arrived, so both happen from the front of an OrderedDict.
+
+    A message may not grow beyond max_message_bytes; One whose Count times the size of its fragment is bigger is
+    refused at once. The fragments we keep of all messages together may not exceed max_total_bytes; The oldest
+    messages are dropped to make room.
+    """
+    MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+    MAX_TOTAL_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_messages=64, ttl=60, max_message_bytes=MAX_MESSAGE_BYTES, max_total_bytes=MAX_TOTAL_BYTES,
+                 clock=None):
+        """
+
+        :param max_messages: Maximum number of incomplete messages we keep.
+        :param ttl: Seconds we wait for the fragments of a message.
+        :param max_message_bytes: Maximum length of a reassembled message.
+        :param max_total_bytes: Maximum total length of the fragments we keep.
+        :param clock: Source of the arrival times of fragments; Wall-clock time by default.
+
+        :type max_messages: int
+        :type ttl: float
+        :type max_message_bytes: int
+        :type max_total_bytes: int
+        :type clock: Clock
+        """
+        if max_messages < 1:
+            raise Exception("Fragment buffer size must be positive.")
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_message_bytes = max_message_bytes
+        self.max_total_bytes = max_total_bytes
+        self.clock = clock if clock is not None else Clock()
+        # Message ID -> [first arrival time, Count, {Index: data}, bytes of the fragments]
+        self._messages = OrderedDict()
+        self.total_bytes = 0
+        self.dropped_messages = 0
+
+    def add(self, message_id, index, count, data, now=None):
+        """
+        Keep a fragment and hand out its message once every fragment of it is here.
+
+        :param message_id: Message ID of the fragment.
+        :param index: Index of the fragment.
+        :param count: Number of fragments of the message.
+        :param data: Uncompressed data of the fragment.
+        :param now: Current time; For tests.
+
+        :type message_id: str
+        :type index: int
+        :type count: int
+        :type data: bytes
+        :type now: float
+
+        :return: The whole message if this was its last missing fragment, otherwise None.
+        :rtype: bytes
+        """
+        if now is None:
+            now = self.clock.time()
+        self._expire(now)
+
+        if count == 1:
+            return data
+        entry = self._messages.get(message_id)
+        if entry is None:
+            if count * len(data) > self.max_message_bytes:
+                log.warning("Refused a message of %d fragments of %d bytes.", count, len(data))
+                self.dropped_messages += 1
+                return None
+            entry = self._messages[message_id] = [now, count, {}, 0]
+            if len(self._messages) > self.max_messages:
+                self._drop_oldest()
+        elif entry[1] != count:
+            log.warning("Fragment count does not match the other fragments of its message.")
+            return None
+
+        old = entry[2].get(index)
+        added = len(data) - (len(old) if old is not None else 0)
+        if entry[3] + added > self.max_message_bytes:
+            log.warning("Dropped a message longer than %d bytes.", self.max_message_bytes)
+            self._remove(message_id)
+            self.dropped_messages += 1
+            return None
+        entry[2][index] = data
+        entry[3] += added
+        self.total_bytes += added
+        if len(entry[2]) == count:
+            self._remove(message_id)
+            return b''.join(entry[2][i] for i in range(count))
+        while self.total_bytes > self.max_total_bytes:
+            self._drop_oldest()
+        return None
+
+    def _remove(self, message_id):
+        """
+        Forget a message and its fragments.
+
+        :param message_id: Message ID of the message.
+        :type message_id: str
+
+        :return:
+        """
+        entry = self._messages.pop(message_id)
+        self.total_bytes -= entry[3]
+
+    def _drop_oldest(self):
+        """
+        Drop the message whose first fragment has arrived first.
+
+        :return:
+        """
+        self._remove(next(iter(self._messages)))
+        self.dropped_messages += 1
+
+    def _expire(self, now):
+        """
+        Drop the incomplete messages whose first fragment arrived ttl seconds ago.
+
+        :param now: Current time.
+        :type now: float
+
+        :return:
+        """
+        deadline = now - self.ttl
+        while self._messages:
+            if next(iter(self._messages.values()))[0] > deadline:
+                return
+            self._drop_oldest()
+
+    def __len__(self):
+        return len(self._messages)
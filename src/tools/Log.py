@@ -0,0 +1,82 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Every module of ours logs to a child of this logger, e.g. "src.Peer" through logging.getLogger(__name__).
+LOGGER_NAME = "src"
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s [%(threadName)s] %(message)s"
+
+_handler = None
+_listener = None
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves even the formatting of a record to the QueueListener Thread; Our queue never leaves
+    the process, so the record does not have to be made picklable first.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level="INFO", stream=None, queued=True, fmt=FORMAT):
+    """
+    Show our log records of the level and above; Nothing is logged until this is called.
+
+    Log statements below the level only cost a level check: Their arguments are formatted only if a record is made.
+    With queued the records go through a queue.SimpleQueue to a QueueListener Thread which formats and writes them,
+    so the main loop never waits for the terminal; Arguments of a log statement must not change after it then.
+    Calling it again replaces the previous configuration.
+
+    :param level: Name or number of the lowest level to show, e.g. "DEBUG" to see every packet.
+    :param stream: Where to write the records; sys.stdout by default.
+    :param queued: Write from a Thread of its own instead of the Thread that logs.
+    :param fmt: logging.Formatter format of a record.
+
+    :type level: str | int
+    :type queued: bool
+    :type fmt: str
+
+    :return: The logger of ours.
+    :rtype: logging.Logger
+    """
+    global _handler, _listener
+    stop_logging()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    if queued:
+        _listener = logging.handlers.QueueListener(queue.SimpleQueue(), handler)
+        _handler = _LocalQueueHandler(_listener.queue)
+        _listener.start()
+    else:
+        _handler = handler
+    logger.addHandler(_handler)
+    return logger
+
+
+def stop_logging():
+    """
+    Remove the handler and the level of configure_logging; Records still in the queue are written first. Called at
+    exit.
+
+    :return:
+    """
+    global _handler, _listener
+    if _handler is not None:
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.removeHandler(_handler)
+        logger.setLevel(logging.NOTSET)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
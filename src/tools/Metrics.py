@@ -0,0 +1,241 @@
+from bisect import bisect_left
+import threading
+
+# Upper bounds in seconds of the histogram buckets; From 10 microseconds to 100 seconds, about 3 per decade.
+DEFAULT_BUCKETS = tuple(scale * 10.0 ** exponent for exponent in range(-5, 2) for scale in (1, 2.5, 5)) + (100.0,)
+
+
+class Histogram:
+    """
+    Counts of observed values in fixed buckets, plus their number and sum; Cheap enough for every packet.
+    """
+
+    __slots__ = ('bounds', 'buckets', 'count', 'sum')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        """
+
+        :param bounds: Increasing upper bounds of the buckets; Bigger values go into one more bucket.
+        :type bounds: tuple
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+
+        :param value: The observed value, e.g. seconds.
+        :type value: float
+
+        :return:
+        """
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_percentile(self, p):
+        """
+
+        :param p: Percentile between 0 and 100.
+        :type p: float
+
+        :return: Upper bound of the bucket of the p-th percentile; None without observations, infinity if it is
+                 bigger than our last bound.
+        :rtype: float
+        """
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def get_mean(self):
+        """
+
+        :return: Mean of the observed values; None without observations.
+        :rtype: float
+        """
+        return self.sum / self.count if self.count else None
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of a Peer, each known by its name and optional labels, e.g.
+    increment("packets_in", type="Message").
+
+    Updates may come from any Thread. Readers pull a copy with get_snapshot, or the Prometheus text format with
+    render_text, e.g. from a MetricsServer; Collectors added with add_collector update the gauges right before.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, labels) -> value; labels is a tuple of (key, value) pairs in the order they were given.
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Add amount to a counter.
+
+        :param name: Name of the counter.
+        :param amount: What to add.
+        :param labels: Labels of the counter.
+
+        :type name: str
+        :type amount: int | float
+
+        :return:
+        """
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to a histogram.
+
+        :param name: Name of the histogram.
+        :param value: The observed value.
+        :param labels: Labels of the histogram.
+
+        :type name: str
+        :type value: float
+
+        :return:
+        """
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set a gauge, e.g. a queue depth.
+
+        :param name: Name of the gauge.
+        :param value: Its current value.
+        :param labels: Labels of the gauge.
+
+        :type name: str
+        :type value: int | float
+
+        :return:
+        """
+        with self._lock:
+            self._gauges[(name, tuple(labels.items()))] = value
+
+    def clear_gauges(self, name):
+        """
+        Forget every gauge of the name, whatever its labels; e.g. before setting the queue depths of the nodes we
+        still have.
+
+        :param name: Name of the gauges.
+        :type name: str
+
+        :return:
+        """
+        with self._lock:
+            for key in [key for key in self._gauges if key[0] == name]:
+                del self._gauges[key]
+
+    def add_collector(self, collector):
+        """
+
+        :param collector: Called with us before every snapshot; It should set the gauges it is responsible for.
+        :type collector: callable
+
+        :return:
+        """
+        self._collectors.append(collector)
+
+    def get_counter(self, name, **labels):
+        """
+
+        :return: The value of a counter; 0 if it has never been incremented.
+        :rtype: int | float
+        """
+        with self._lock:
+            return self._counters.get((name, tuple(labels.items())), 0)
+
+    def get_histogram(self, name, **labels):
+        """
+
+        :return: A copy of a histogram; None if nothing has been observed in it.
+        :rtype: Histogram
+        """
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(labels.items())))
+            return None if histogram is None else Metrics._copy_histogram(histogram)
+
+    def get_snapshot(self):
+        """
+        Run the collectors and copy every metric.
+
+        :return: A dict with "counters", "gauges" and "histograms", each mapping (name, labels) to the value or a
+                 Histogram copy.
+        :rtype: dict
+        """
+        for collector in self._collectors:
+            collector(self)
+        with self._lock:
+            return {"counters": dict(self._counters), "gauges": dict(self._gauges),
+                    "histograms": {key: Metrics._copy_histogram(h) for key, h in self._histograms.items()}}
+
+    @staticmethod
+    def _copy_histogram(histogram):
+        copy = Histogram(histogram.bounds)
+        copy.buckets = list(histogram.buckets)
+        copy.count = histogram.count
+        copy.sum = histogram.sum
+        return copy
+
+    def render_text(self, prefix="peer_"):
+        """
+        Every metric in the Prometheus text exposition format.
+
+        :param prefix: Put before every metric name.
+        :type prefix: str
+
+        :return: The metrics, one sample per line.
+        :rtype: str
+        """
+        snapshot = self.get_snapshot()
+        lines = []
+        for kind, metrics in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for name in sorted({key[0] for key in metrics}):
+                lines.append("# TYPE %s%s %s" % (prefix, name, kind))
+                for (metric_name, labels), value in sorted(metrics.items(), key=lambda item: str(item[0])):
+                    if metric_name == name:
+                        lines.append("%s%s%s %s" % (prefix, name, Metrics._format_labels(labels), value))
+
+        histograms = snapshot["histograms"]
+        for name in sorted({key[0] for key in histograms}):
+            lines.append("# TYPE %s%s histogram" % (prefix, name))
+            for (metric_name, labels), histogram in sorted(histograms.items(), key=lambda item: str(item[0])):
+                if metric_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (float('inf'),), histogram.buckets):
+                    cumulative += count
+                    lines.append("%s%s_bucket%s %d" % (prefix, name, Metrics._format_labels(
+                        labels + (("le", "+Inf" if bound == float('inf') else repr(bound)),)), cumulative))
+                lines.append("%s%s_sum%s %r" % (prefix, name, Metrics._format_labels(labels), histogram.sum))
+                lines.append("%s%s_count%s %d" % (prefix, name, Metrics._format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in labels) + "}"
@@ -0,0 +1,61 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+
+class MetricsServer:
+    """
+    A small HTTP server which answers GET /metrics with the render_text of a Metrics, for Prometheus or curl.
+
+    It runs in a daemon Thread of its own and only reads the Metrics, so it never slows down the main loop besides
+    the lock of a snapshot.
+    """
+
+    def __init__(self, metrics, port, ip="127.0.0.1"):
+        """
+
+        :param metrics: The Metrics we serve.
+        :param port: TCP port to listen on; 0 picks a free one, see get_port.
+        :param ip: Address to listen on; Only the local machine by default.
+
+        :type metrics: Metrics
+        :type port: int
+        :type ip: str
+        """
+        self.metrics = metrics
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    return self.send_error(404)
+                body = server.metrics.render_text().encode('UTF-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((ip, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def get_port(self):
+        """
+
+        :return: The TCP port we listen on.
+        :rtype: int
+        """
+        return self._server.server_address[1]
+
+    def close(self):
+        """
+        Stop serving and close our socket.
+
+        :return:
+        """
+        self._server.shutdown()
+        self._server.server_close()
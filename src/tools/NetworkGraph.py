@@ -1,3 +1,7 @@
+from src.tools.Clock import Clock
+import bisect
+import heapq
+import itertools
 import time
 
 
@@ -16,6 +20,13 @@ class GraphNode:
         self.port = address[1]
         self.address = address
         self.alive = False
+        self.depth = 0
+        self.number_of_live_children = 0
+        # Children placed under us which have not said their first Reunion Hello yet; See NetworkGraph.add_node.
+        self.number_of_reserved_children = 0
+        # Until when our parent keeps a child slot for us, if we have been placed and are not alive yet.
+        self.reserved_until = None
+        self.capacity = None
 
     def set_parent(self, parent):
         self.parent = parent
@@ -30,20 +41,81 @@ class GraphNode:
     def add_child(self, child):
         self.children.append(child)
 
+    def remove_child(self, child):
+        self.children.remove(child)
+
 
 class NetworkGraph:
-    def __init__(self, root):
+    def __init__(self, root, max_children=2, clock=None, reservation_ttl=12):
+        """
+
+        :param root: Root of the network.
+        :param max_children: Default maximum number of live and reserved children of every node; GraphNode.capacity
+                             overrides it.
+        :param clock: Source of the Reunion times of new nodes, of update_reunion_time and of reservations;
+                      Wall-clock time by default.
+        :param reservation_ttl: Seconds a node placed by add_node keeps its slot under its parent, and may get
+                                children of its own, before its first Reunion Hello turns it on.
+
+        :type root: GraphNode
+        :type max_children: int
+        :type clock: Clock
+        :type reservation_ttl: float
+        """
         self.root = root
+        self.max_children = max_children
+        self.clock = clock if clock is not None else Clock()
+        self.reservation_ttl = reservation_ttl
         root.alive = True
-        self.nodes = [root]
+        self._nodes_by_address = {NetworkGraph.address_key(root.ip, root.port): root}
+        # depth -> reachable nodes with a free child slot; dicts are used as insertion ordered sets. A node is
+        # reachable if it and all of its ancestors up to the root are alive.
+        self._free_slots = {}
+        # The depths of _free_slots in ascending order; Kept sorted as depths come and go.
+        self._free_depths = []
+        self._update_free_slot(root)
+        # (latest_reunion_time, sequence, node) entries; An entry is stale if the node has said Reunion Hello again
+        # or has been removed since it was pushed.
+        self._reunion_deadlines = []
+        self._reunion_sequence = itertools.count()
+        # (reserved_until, sequence, node) entries; Stale once the reservation has ended or been renewed.
+        self._reservation_deadlines = []
+
+    @property
+    def nodes(self):
+        """
+        Every node of the graph, the root included; A view of our address index, so removing a node costs O(1).
+
+        :rtype: dict_values
+        """
+        return self._nodes_by_address.values()
+
+    @staticmethod
+    def address_key(ip, port):
+        """
+        Normalise an address to the key of our node index; The format is like ('192.168.001.001', '05335').
+
+        :param ip: IP address
+        :param port: Port
+
+        :type ip: str
+        :type port: str | int
+
+        :rtype: tuple
+        """
+        return '.'.join(str(int(part)).zfill(3) for part in ip.split('.')), str(int(port)).zfill(5)
 
     def find_live_node(self, sender):
         """
         Here we should find a neighbour for sender.
-        Best neighbour is the node who is nearest the root and has not more than 1 child.
+        Best neighbour is the node who is nearest the root and has less live and reserved children than its
+        capacity. A node counts from the moment add_node places it, so a burst of Advertise packets fills the tree
+        level by level although the Reunion Hellos of the new nodes have not arrived yet.
 
-        Code design suggestion:
-            1.Do a BFS algorithm to find the target.
+        Instead of a BFS over the whole graph we keep an index from depth to the reachable nodes with a free child
+        slot, which add_node, turn_on_node, turn_off_node, turn_off_subtree and remove_node keep up to date; So we
+        only look at the shallowest candidates, and only those deeper than sender need a walk up to tell whether
+        they are in its sub-tree.
 
         Warnings:
             1. Check whether there is sender node in our NetworkGraph or not; if exist doo not return sender node or
@@ -55,58 +127,316 @@ class NetworkGraph:
         :return: Best neighbour for sender.
         :rtype: GraphNode
         """
-        queue = [self.root]
-        while len(queue) > 0:
-            node = queue[0]
-            number_of_live_children = 0
-            if node.address is not sender:
-                if self.find_node(sender[0], sender[1]) is not None:
-                    if self.find_node(sender[0], sender[1]) is node:
-                        continue
-                    if self.find_node(sender[0], sender[1]).parent is not None:
-                        if node is self.find_node(sender[0], sender[1]).parent:
-                            continue
-            else:
-                continue
-            for child in node.children:
-                if child.alive:
-                    number_of_live_children += 1
-                    queue.append(child)
-            if number_of_live_children < 2 and node.address is not sender:
-                if self.find_node(sender[0], sender[1]) is not None:
-                    if self.find_node(sender[0], sender[1]).parent is not None:
-                        if node is not self.find_node(sender[0], sender[1]).parent:
-                            return node
-                    else:
-                        return node
-                else:
+        self._expire_reservations()
+        sender_node = self.find_node(sender[0], sender[1])
+        if sender_node is not None and sender_node.depth is None:
+            sender_node = None
+        excluded_parent = sender_node.parent if sender_node is not None else None
+        for depth in self._free_depths:
+            for node in self._free_slots[depth]:
+                if node is not excluded_parent and not self._is_in_subtree(node, sender_node):
                     return node
-            queue.pop(0)
         return self.root
 
+    @staticmethod
+    def _is_in_subtree(node, subtree_root):
+        """
+
+        :param node: The node we want to check.
+        :param subtree_root: Root of the sub-tree; None for no sub-tree.
+
+        :type node: GraphNode
+        :type subtree_root: GraphNode
+
+        :return: Whether node is subtree_root or one of its descendants; It takes time proportional to the depth
+                 difference of the two nodes.
+        :rtype: bool
+        """
+        if subtree_root is None:
+            return False
+        while node is not None and node.depth is not None and node.depth > subtree_root.depth:
+            node = node.parent
+        return node is subtree_root
+
+    @staticmethod
+    def _is_up(node):
+        """
+
+        :return: Whether the node is alive or has a reserved slot under its parent.
+        :rtype: bool
+        """
+        return node.alive or node.reserved_until is not None
+
+    def _is_reachable(self, node):
+        """
+        Check that the node and all of its ancestors are up, so a BFS over up nodes from the root would visit it.
+
+        :param node: The node we want to check.
+        :type node: GraphNode
+
+        :rtype: bool
+        """
+        while node is not None:
+            if not self._is_up(node):
+                return False
+            if node is self.root:
+                return True
+            node = node.parent
+        return False
+
+    def _update_free_slot(self, node, reachable=None):
+        """
+        Put the node in the free slot index of its depth if it is reachable and can accept another child, otherwise
+        take it out of the index.
+
+        :param node: The node whose state has just changed.
+        :param reachable: Whether the node is reachable, if the caller knows it; Otherwise we walk up its ancestors.
+
+        :type node: GraphNode
+        :type reachable: bool
+
+        :return:
+        """
+        if reachable is None:
+            reachable = self._is_reachable(node)
+        used = node.number_of_live_children + node.number_of_reserved_children
+        if reachable and used < self.get_capacity(node):
+            self._add_free_slot(node)
+        else:
+            self._discard_free_slot(node)
+
+    def _update_subtree(self, node):
+        """
+        Update the free slot index for the node and its sub-tree after the node has been turned on or off or moved.
+
+        Only up descendants reached through up nodes are visited; Below a dead node nothing is reachable before or
+        after the change, so nothing is indexed there.
+
+        :param node: Root of the sub-tree.
+        :type node: GraphNode
+
+        :return:
+        """
+        stack = [(node, self._is_reachable(node))]
+        while stack:
+            node, reachable = stack.pop()
+            self._update_free_slot(node, reachable)
+            stack.extend((child, reachable) for child in node.children if self._is_up(child))
+
+    def get_capacity(self, node):
+        """
+
+        :return: Maximum number of live and reserved children of the node.
+        :rtype: int
+        """
+        return node.capacity if node.capacity is not None else self.max_children
+
+    def _add_free_slot(self, node):
+        slots = self._free_slots.get(node.depth)
+        if slots is None:
+            slots = self._free_slots[node.depth] = {}
+            bisect.insort(self._free_depths, node.depth)
+        slots[node] = None
+
+    def _discard_free_slot(self, node):
+        """
+
+        :return: Whether the node was in the free slot index.
+        :rtype: bool
+        """
+        slots = self._free_slots.get(node.depth)
+        if slots is None or node not in slots:
+            return False
+        del slots[node]
+        if not slots:
+            del self._free_slots[node.depth]
+            del self._free_depths[bisect.bisect_left(self._free_depths, node.depth)]
+        return True
+
+    def _set_depth(self, node, depth):
+        """
+        Update the depth of the node and its whole sub-tree, moving indexed nodes between the free slot index depths;
+        A depth of None detaches the sub-tree from the index.
+
+        :return:
+        """
+        stack = [(node, depth)]
+        while stack:
+            node, depth = stack.pop()
+            if node.depth == depth:
+                continue
+            indexed = self._discard_free_slot(node)
+            node.depth = depth
+            if indexed and depth is not None:
+                self._add_free_slot(node)
+            stack.extend((child, depth + 1 if depth is not None else None) for child in node.children)
+
+    def _reserve(self, node):
+        """
+        Keep a slot for the node under its parent until its first Reunion Hello, or for reservation_ttl seconds.
+
+        :param node: A node which has just been placed and is not alive.
+        :type node: GraphNode
+
+        :return:
+        """
+        node.reserved_until = self.clock.time() + self.reservation_ttl
+        node.parent.number_of_reserved_children += 1
+        heapq.heappush(self._reservation_deadlines, (node.reserved_until, next(self._reunion_sequence), node))
+
+    def _release(self, node):
+        """
+        Give the reserved slot of the node back to its parent; The caller updates the free slot index.
+
+        :param node: The node.
+        :type node: GraphNode
+
+        :return: Whether the node had a reservation.
+        :rtype: bool
+        """
+        if node.reserved_until is None:
+            return False
+        node.reserved_until = None
+        if node.parent is not None:
+            node.parent.number_of_reserved_children -= 1
+        return True
+
+    def _expire_reservations(self):
+        """
+        Release the reservations of the nodes which have not said Reunion Hello within reservation_ttl seconds;
+        They and their sub-trees stop taking children until they do.
+
+        :return:
+        """
+        now = self.clock.time()
+        while self._reservation_deadlines and self._reservation_deadlines[0][0] <= now:
+            reserved_until, _, node = heapq.heappop(self._reservation_deadlines)
+            if node.reserved_until == reserved_until and self._release(node):
+                if node.parent is not None:
+                    self._update_free_slot(node.parent)
+                self._update_subtree(node)
+
     def find_node(self, ip, port):
-        for node in self.nodes:
-            if node.ip == ip and node.port == port:
-                return node
-        return None
+        return self._nodes_by_address.get(NetworkGraph.address_key(ip, port))
 
     def turn_on_node(self, node_address):
         node = self.find_node(node_address[0], node_address[1])
-        if node is not None:
+        if node is not None and not node.alive:
+            self._release(node)
             node.alive = True
+            if node.parent is not None:
+                node.parent.number_of_live_children += 1
+                self._update_free_slot(node.parent)
+            self._update_subtree(node)
 
     def turn_off_node(self, node_address):
         node = self.find_node(node_address[0], node_address[1])
-        if node is not None:
+        if node is None:
+            return
+        if node.alive:
             node.alive = False
+            if node.parent is not None:
+                node.parent.number_of_live_children -= 1
+        elif not self._release(node):
+            return
+        if node.parent is not None:
+            self._update_free_slot(node.parent)
+        self._update_subtree(node)
+
+    def turn_off_subtree(self, node_address):
+        """
+        Turn off the node and every node in its sub-tree; It takes time proportional to the sub-tree size.
+
+        :param node_address: Address of the sub-tree root.
+        :type node_address: tuple
+
+        :return:
+        """
+        node = self.find_node(node_address[0], node_address[1])
+        if node is None:
+            return
+        subtree_root = node
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.alive:
+                node.alive = False
+                if node.parent is not None:
+                    node.parent.number_of_live_children -= 1
+            self._release(node)
+            self._discard_free_slot(node)
+            stack.extend(node.children)
+        if subtree_root.parent is not None:
+            self._update_free_slot(subtree_root.parent)
+
+    def update_reunion_time(self, node_address, reunion_time=None):
+        """
+        Save the arrival time of the latest Reunion Hello of the node.
+
+        :param node_address: Address of the node.
+        :param reunion_time: Arrival time; Now by our clock by default.
+
+        :type node_address: tuple
+        :type reunion_time: float
+
+        :return:
+        """
+        node = self.find_node(node_address[0], node_address[1])
+        if node is None:
+            return
+        node.latest_reunion_time = self.clock.time() if reunion_time is None else reunion_time
+        self._push_reunion_deadline(node)
+
+    def _push_reunion_deadline(self, node):
+        heapq.heappush(self._reunion_deadlines, (node.latest_reunion_time, next(self._reunion_sequence), node))
+
+    def pop_expired_nodes(self, deadline):
+        """
+        Find the nodes whose latest Reunion Hello arrived before deadline; Only the expiring nodes are examined.
+
+        Warnings:
+            1. Every node is returned only once for the Reunion Hello it has missed; Updating its reunion time
+               makes it expire again later.
+
+        :param deadline: Latest acceptable Reunion Hello arrival time.
+        :type deadline: float
+
+        :return: The expired nodes.
+        :rtype: list
+        """
+        expired = []
+        while self._reunion_deadlines and self._reunion_deadlines[0][0] < deadline:
+            reunion_time, _, node = heapq.heappop(self._reunion_deadlines)
+            if node.latest_reunion_time == reunion_time and self.find_node(node.ip, node.port) is node:
+                expired.append(node)
+        return expired
 
     def remove_node(self, node_address):
+        """
+        Remove the node from our NetworkGraph.
+
+        Its children are detached: they keep their sub-trees but have no parent and no depth until they advertise
+        again, so a Reunion Hello of a detached node never counts for the removed node nor puts a detached node in
+        the free slot index.
+
+        :param node_address: Address of the node.
+        :type node_address: tuple
+
+        :return:
+        """
         node = self.find_node(node_address[0], node_address[1])
         if node is not None:
-            node.parent.children.remove(node)
-            self.nodes.remove(node)
+            self.turn_off_node(node_address)
+            if node.parent is not None:
+                node.parent.remove_child(node)
+            for child in node.children:
+                self._release(child)
+                child.set_parent(None)
+                self._set_depth(child, None)
+            node.children = []
+            del self._nodes_by_address[NetworkGraph.address_key(node.ip, node.port)]
 
-    def add_node(self, ip, port, father_address):
+    def add_node(self, ip, port, father_address, capacity=None):
         """
         Add a new node with node_address if it's not exist in our NetworkGraph and set it's father.
 
@@ -117,10 +447,15 @@ class NetworkGraph:
         :param ip: IP address of the new node.
         :param port: Port of the new node.
         :param father_address: Father address of the new node
+        :param capacity: Maximum number of children the new node accepts; None keeps its current capacity.
+
+        A node which is not alive reserves its slot under the father until its first Reunion Hello turns it on, or
+        for reservation_ttl seconds; See find_live_node.
 
         :type ip: str
         :type port: int
         :type father_address: tuple
+        :type capacity: int
 
 
         :return:
@@ -130,6 +465,28 @@ class NetworkGraph:
 
         if new_node is None:
             new_node = GraphNode((ip, port))
-            self.nodes.append(new_node)
+            new_node.latest_reunion_time = self.clock.time()
+            self._nodes_by_address[NetworkGraph.address_key(ip, port)] = new_node
+            self._push_reunion_deadline(new_node)
+        if capacity is not None:
+            new_node.capacity = capacity
+            self._update_free_slot(new_node)
+        if new_node.parent is father_node:
+            return
+        if new_node.parent is not None:
+            old_parent = new_node.parent
+            old_parent.remove_child(new_node)
+            if new_node.alive:
+                old_parent.number_of_live_children -= 1
+            self._release(new_node)
+            self._update_free_slot(old_parent)
+
         new_node.set_parent(father_node)
         father_node.add_child(new_node)
+        if new_node.alive:
+            father_node.number_of_live_children += 1
+        else:
+            self._reserve(new_node)
+        self._update_free_slot(father_node)
+        self._set_depth(new_node, father_node.depth + 1 if father_node.depth is not None else None)
+        self._update_subtree(new_node)
@@ -1,8 +1,20 @@
-from src.tools.simpletcp.clientsocket import ClientSocket
+from src.tools.Clock import Clock
+from src.tools.ConnectionPool import ConnectionPool
+from src.Packet import PacketFactory
+from collections import deque
+import socket
+import logging
+
+log = logging.getLogger(__name__)
 
 
 class Node:
-    def __init__(self, server_address, set_root=False, set_register=False):
+    QUEUE_POLICIES = ("block", "drop-oldest", "drop-newest", "disconnect")
+
+    def __init__(self, server_address, set_root=False, set_register=False, pipelined=False,
+                 max_queue_packets=None, max_queue_bytes=None, queue_policy="drop-oldest", send_timeout=None,
+                 batch_bytes=None, batch_linger=0, batch_source_address=None, connection_pool=None,
+                 clock=None):
         """
         The Node object constructor.
 
@@ -12,57 +24,439 @@ class Node:
         Warnings:
             1. Insert an exception handler when initialising the ClientSocket; when a socket closed here we will face to
                an exception and we should detach this Node and clear it's output buffer.
+            2. The ClientSocket comes from connection_pool; If connecting fails, or the connection breaks while
+               sending, out_buff is kept and send_message connects again once the pool allows it. Only after the
+               pool has given up on our address does send_message raise, so the Stream removes this Node.
 
         :param server_address:
         :param set_root:
         :param set_register:
+        :param pipelined: Send the whole out_buff with one write and do not wait for b'ACK' after every packet.
+        :param max_queue_packets: Maximum number of packets in out_buff; None means no limit.
+        :param max_queue_bytes: Maximum total bytes of the packets in out_buff; None means no limit.
+        :param queue_policy: What add_message_to_out_buff does when out_buff is full:
+                             "block" sends out_buff right away and waits for the network before adding the packet;
+                             If we cannot send, e.g. while disconnected, the new packet is dropped like with
+                             "drop-newest",
+                             "drop-oldest" drops the oldest packets to make room,
+                             "drop-newest" drops the new packet,
+                             "disconnect" drops everything and makes the next send_message raise, so the Stream
+                             removes this Node.
+        :param send_timeout: Without connection_pool; Seconds after which connecting, a write or waiting for b'ACK'
+                             fails with socket.timeout; None waits forever.
+        :param batch_bytes: Pack the packets of out_buff into Batch packets of at most this many bytes when sending
+                            them; None sends every packet on its own.
+        :param batch_linger: Seconds a packet may wait in out_buff for more packets to share its Batch; See
+                             is_lingering.
+        :param batch_source_address: Server address of our Stream; The source of our Batch packets.
+        :param connection_pool: Connections of our Stream; None makes a pool of our own.
+        :param clock: Source of the time packets are queued at, for batch_linger; Wall-clock time by default.
+
+        :type max_queue_packets: int
+        :type max_queue_bytes: int
+        :type queue_policy: str
+        :type send_timeout: float
+        :type batch_bytes: int
+        :type batch_linger: float
+        :type batch_source_address: tuple
+        :type connection_pool: ConnectionPool
+        :type clock: Clock
         """
+        if queue_policy not in Node.QUEUE_POLICIES:
+            raise Exception("Unknown queue policy.")
         self.server_ip = Node.parse_ip(server_address[0])
         self.server_port = Node.parse_port(server_address[1])
 
-        print("Server Address: ", server_address)
+        log.debug("Server Address: %s", server_address)
 
-        self.out_buff = []
+        self.out_buff = deque()
+        self.out_buff_bytes = 0
         self.is_root = set_root
         self.is_register_connection = set_register
+        self.pipelined = pipelined
+
+        self.max_queue_packets = max_queue_packets
+        self.max_queue_bytes = max_queue_bytes
+        self.queue_policy = queue_policy
+        self.dropped_packets = 0
+        self.dropped_bytes = 0
+        self.overflowed = False
+
+        self.send_timeout = send_timeout
+        # The batch a worker thread is sending; See send_message_in.
+        self._pending_send = None
+
+        self.batch_bytes = batch_bytes
+        self.batch_linger = batch_linger
+        self.batch_source_address = batch_source_address
+        self.clock = clock if clock is not None else Clock()
+        # When the oldest packet of out_buff was added.
+        self._first_queued_time = None
+
+        # Names of the Message codecs the Node accepts; Learned from its Join packet or the answer to ours.
+        self.codecs = frozenset()
 
+        self.connections = connection_pool if connection_pool is not None else ConnectionPool(timeout=send_timeout)
+        self.client = None
+        self._connect()
+
+    def _connect(self):
+        """
+        Take a ClientSocket to the Node TCPServer address from our connection pool.
+
+        :return: Whether we are connected.
+        :rtype: bool
+        """
         try:
-            self.client = ClientSocket(self.server_ip, int(self.server_port, 10), single_use=False)
-        except:
-            print("Node was detached.")
-            self.out_buff.clear()
+            self.client = self.connections.acquire(self.get_server_address())
+        except Exception:
+            log.info("Node %s: %s was detached.", self.server_ip, self.server_port)
+            self.client = None
+        return self.client is not None
+
+    def _ensure_connected(self):
+        """
+        Connect again if our connection has broken and the connection pool allows a new attempt.
+
+        :return: Whether we are connected.
+        :rtype: bool
+
+        :raise ConnectionError: If the connection pool has given up on our address.
+        """
+        if self.client is not None:
+            return True
+        if self.connections.is_unreachable(self.get_server_address()):
+            raise ConnectionError("Node is unreachable.")
+        return self._connect()
 
     def send_message(self):
         """
         Final function to send buffer to the clients socket.
 
+        In pipelined mode all packets are written back-to-back in one sendall; The receiver reassembles them by
+        their Length field and the b'ACK' responses are only drained afterwards, so we never wait a round trip per packet.
+
+        Warnings:
+            1. After an overflow with the "disconnect" queue policy this raises ConnectionError; The Stream should
+               remove this Node.
+            2. If send_message_in has handed a batch to a worker thread, we wait for it first so packets keep their
+               order; Its failure is raised here.
+            3. While we are not connected the packets stay in out_buff; See _ensure_connected.
+
         :return:
         """
-        for b in self.out_buff:
-            response = self.client.send(bytes(b))
+        self.wait_for_pending_send()
+        if self.overflowed:
+            raise ConnectionError("Node out_buff overflowed.")
+        if not self._ensure_connected():
+            return
 
-            print("Response: ", response)
-            if response != b'ACK':
-                print("The ", self.get_server_address()[0], ": ", self.get_server_address()[1],
-                      " did not response with b'ACK'. ", response)
+        try:
+            unsent = self._send_batch(self._take_out_buff())
+        except Exception:
+            self._close_client()
+            raise
+        self._requeue(unsent)
 
-        self.out_buff.clear()
+    def send_message_in(self, executor):
+        """
+        Hand over out_buff to a worker thread of the executor and return without waiting for the network.
+
+        A Node sends at most one batch at a time; While the previous batch is still being sent we do nothing and
+        the new packets wait in out_buff, bounded by our queue limits.
+
+        :param executor: Thread pool of our Stream.
+        :type executor: concurrent.futures.Executor
+
+        :return: Future of the handed over batch, or None if we have not handed over one.
+        :rtype: concurrent.futures.Future
+        """
+        if self._pending_send is not None and not self._pending_send.done():
+            return None
+        self.wait_for_pending_send()
+        if self.overflowed:
+            raise ConnectionError("Node out_buff overflowed.")
+        if not self.out_buff and not self.pipelined:
+            return None
+        if not self._ensure_connected():
+            return None
+
+        self._pending_send = executor.submit(self._send_batch, self._take_out_buff())
+        return self._pending_send
+
+    def wait_for_pending_send(self):
+        """
+        Wait until the batch handed over by send_message_in has been sent.
+
+        :return:
+        """
+        pending, self._pending_send = self._pending_send, None
+        if pending is None:
+            return
+        try:
+            unsent = pending.result()
+        except Exception:
+            self._close_client()
+            raise
+        self._requeue(unsent)
+
+    def _requeue(self, unsent):
+        """
+        After our connection has broken, put the packets which may not have arrived back in front of out_buff and
+        give the connection back to the pool as failed, so it schedules our next connection attempt.
+
+        :param unsent: What _send_batch has returned.
+        :type unsent: list
+
+        :return:
+        """
+        if unsent is None:
+            return
+        log.info("Connection to %s: %s has broken; %d packets are kept to be sent again.", self.server_ip,
+                 self.server_port, len(unsent))
+        self.connections.fail(self.get_server_address(), self.client)
+        self.client = None
+        for b in reversed(unsent):
+            self.out_buff.appendleft(b)
+            self.out_buff_bytes += len(b)
+        self._trim_out_buff()
+        if self.out_buff and self._first_queued_time is None:
+            self._first_queued_time = self.clock.time()
+
+    def _trim_out_buff(self):
+        """
+        Drop packets until out_buff is within our queue limits again, e.g. after the packets of a broken connection
+        have been put back; The oldest go with the "drop-oldest" policy, the newest with every other one.
+
+        :return:
+        """
+        while len(self.out_buff) > 1 and (
+                (self.max_queue_packets is not None and len(self.out_buff) > self.max_queue_packets) or
+                (self.max_queue_bytes is not None and self.out_buff_bytes > self.max_queue_bytes)):
+            b = self.out_buff.popleft() if self.queue_policy == "drop-oldest" else self.out_buff.pop()
+            self.out_buff_bytes -= len(b)
+            self._drop(b)
+
+    def _take_out_buff(self):
+        """
+        Take every packet of out_buff and leave an empty out_buff behind.
+
+        :return: The packets in order; Packed into Batch packets if we have batch_bytes.
+        :rtype: deque | list
+        """
+        batch = self.out_buff
+        self.out_buff = deque()
+        self.out_buff_bytes = 0
+        self._first_queued_time = None
+        if self.batch_bytes is not None and len(batch) > 1:
+            return self._pack_batches(batch)
+        return batch
+
+    def _pack_batches(self, packets):
+        """
+        Pack consecutive packets into Batch packets whose bodies are at most batch_bytes; A packet alone in its
+        Batch, e.g. a bigger one, is sent as it is.
+
+        :param packets: Packets in order.
+
+        :return: Packets and Batch packets in order.
+        :rtype: list
+        """
+        packed = []
+        group = []
+        group_bytes = 0
+        for packet in packets:
+            if group and group_bytes + len(packet) > self.batch_bytes:
+                packed.append(group[0] if len(group) == 1 else
+                              PacketFactory.new_batch_buffer(group, self.batch_source_address))
+                group = []
+                group_bytes = 0
+            group.append(packet)
+            group_bytes += len(packet)
+        if group:
+            packed.append(group[0] if len(group) == 1 else
+                          PacketFactory.new_batch_buffer(group, self.batch_source_address))
+        return packed
+
+    def is_lingering(self, now=None):
+        """
+        Whether out_buff should wait for more packets before it is sent: Only if we have a batch_linger, out_buff
+        is smaller than batch_bytes and its oldest packet has waited less than batch_linger seconds.
+
+        :param now: Current time.
+        :type now: float
+
+        :rtype: bool
+        """
+        if not self.batch_linger or self._first_queued_time is None:
+            return False
+        if self.batch_bytes is not None and self.out_buff_bytes >= self.batch_bytes:
+            return False
+        return (self.clock.time() if now is None else now) < self._first_queued_time + self.batch_linger
+
+    def get_linger_deadline(self):
+        """
+
+        :return: When out_buff stops lingering; None if it is not lingering.
+        :rtype: float
+        """
+        if not self.is_lingering():
+            return None
+        return self._first_queued_time + self.batch_linger
+
+    def _send_batch(self, batch):
+        """
+        Write the packets to our ClientSocket; It may run in a worker thread, so it only touches batch and the socket.
+
+        A broken connection is not raised but reported by returning the packets which may not have arrived; Every
+        packet from the first one without b'ACK', or the whole batch in pipelined mode. A timeout is raised.
+
+        :param batch: Packets in order.
+
+        :return: None if the connection is fine, otherwise the packets to send again.
+        :rtype: list
+        """
+        if self.pipelined:
+            try:
+                if batch:
+                    self.client.send_all(b''.join(bytes(b) for b in batch))
+                self.client.discard_responses()
+            except socket.timeout:
+                raise
+            except OSError:
+                return list(batch)
+            return None
+
+        for i, b in enumerate(batch):
+            try:
+                response = self.client.send(bytes(b))
+            except socket.timeout:
+                raise
+            except OSError:
+                return list(batch)[i:]
+
+            log.debug("Response: %s", response)
+            if response == b'':
+                # The TCPServer has closed our connection.
+                return list(batch)[i:]
+            if response != b'ACK':
+                log.warning("The %s: %s did not response with b'ACK'. %s", self.server_ip, self.server_port, response)
+        return None
 
     def add_message_to_out_buff(self, message):
         """
         Here we will add new message to the server out_buff, then in 'send_message' will send them.
 
+        If out_buff is full, our queue_policy decides what happens; Dropped packets are counted in dropped_packets
+        and dropped_bytes.
+
         :param message: The message we want to add to out_buff
-        :return:
+        :return: Whether the message was added.
+        :rtype: bool
         """
+        if self.overflowed:
+            self._drop(message)
+            return False
+
+        if self._is_full(len(message)):
+            if self.queue_policy == "block":
+                try:
+                    self.send_message()
+                except Exception:
+                    # The Stream will remove us on its next send_message.
+                    self.overflowed = True
+                    self.clear_out_buff()
+                    self._drop(message)
+                    return False
+                if self._is_full(len(message)):
+                    # We are disconnected or waiting to reconnect, so nothing has been sent.
+                    self._drop(message)
+                    return False
+            elif self.queue_policy == "drop-oldest":
+                while self.out_buff and self._is_full(len(message)):
+                    oldest = self.out_buff.popleft()
+                    self.out_buff_bytes -= len(oldest)
+                    self._drop(oldest)
+            elif self.queue_policy == "drop-newest":
+                self._drop(message)
+                return False
+            else:
+                log.warning("The %s: %s out_buff overflowed; Disconnecting.", self.server_ip, self.server_port)
+                while self.out_buff:
+                    self._drop(self.out_buff.popleft())
+                self.clear_out_buff()
+                self.overflowed = True
+                self._drop(message)
+                return False
+
+        if not self.out_buff:
+            self._first_queued_time = self.clock.time()
         self.out_buff.append(message)
+        self.out_buff_bytes += len(message)
+        return True
+
+    def _is_full(self, length):
+        """
+
+        :param length: Length of the packet we want to add.
+        :type length: int
+
+        :return: Whether adding the packet would exceed one of our queue limits; An empty out_buff always accepts
+                 one packet.
+        :rtype: bool
+        """
+        if not self.out_buff:
+            return False
+        if self.max_queue_packets is not None and len(self.out_buff) + 1 > self.max_queue_packets:
+            return True
+        if self.max_queue_bytes is not None and self.out_buff_bytes + length > self.max_queue_bytes:
+            return True
+        return False
+
+    def _drop(self, message):
+        """
+        Count a packet that will never be sent.
+
+        :param message: The dropped packet.
+
+        :return:
+        """
+        self.dropped_packets += 1
+        self.dropped_bytes += len(message)
+
+    def clear_out_buff(self):
+        """
+        Discard every packet in out_buff without counting them as dropped; e.g. after they are sent.
+
+        :return:
+        """
+        self.out_buff.clear()
+        self.out_buff_bytes = 0
+        self._first_queued_time = None
 
     def close(self):
         """
-        Closing client object.
+        Give our connection back to the connection pool, which keeps it open for a later Node of the same address;
+        Unless it may be in use by a worker thread or in an unknown state after a failure, then it is closed.
+        :return:
+        """
+        if self.client is None:
+            return
+        pending = self._pending_send
+        if self.overflowed or (pending is not None and (not pending.done() or pending.exception() is not None)):
+            return self._close_client()
+        self.connections.release(self.get_server_address(), self.client)
+        self.client = None
+
+    def _close_client(self):
+        """
+        Close our connection for good, e.g. after a timeout left it in an unknown state.
+
         :return:
         """
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
     def get_server_address(self):
         """
@@ -0,0 +1,229 @@
+import logging
+import multiprocessing
+import zlib
+
+from src.Packet import BinaryPacket, PacketFactory
+
+log = logging.getLogger(__name__)
+
+
+class PacketWorkerPool:
+    """
+    Worker processes for the root Peer, which parse arrived packets and prepare Reunion Hello Back answers.
+
+    Only Reunion Hello packets are worth the round trip to a worker; is_worker_packet tells them apart by their
+    header bytes, and the root handles every other packet itself. Packets are sharded between the workers by their
+    source server address, so the packets of every source are handled in order by one worker. The NetworkGraph stays
+    in the root process; Workers only send back compact results which the root applies:
+
+        (REUNION, [hello_address, ...], answer_address, answer_buffer)
+            Turn on the nodes which have said hello and send the answer.
+        (PACKET, buffer)
+            A packet the worker could not parse, or could not handle because it has died; The root handles it
+            itself. A worker which has died is started again.
+    """
+    REUNION = 1
+    PACKET = 2
+
+    def __init__(self, number_of_workers, server_address):
+        """
+
+        :param number_of_workers: Number of worker processes.
+        :param server_address: Root server address; The source of the answers.
+
+        :type number_of_workers: int
+        :type server_address: tuple
+        """
+        self.server_address = server_address
+        # Our process already runs threads, so workers must not be forked from it.
+        self._context = multiprocessing.get_context('spawn')
+        self._connections = [None] * number_of_workers
+        self._processes = [None] * number_of_workers
+        for index in range(number_of_workers):
+            self._start_worker(index)
+        # Number of workers started again after they have died.
+        self.restarts = 0
+
+    def _start_worker(self, index):
+        """
+        Start the worker process of a shard.
+
+        :param index: The shard.
+        :type index: int
+
+        :return:
+        """
+        connection, worker_connection = self._context.Pipe()
+        process = self._context.Process(target=_run_worker, args=(worker_connection, self.server_address),
+                                        daemon=True)
+        process.start()
+        worker_connection.close()
+        self._connections[index] = connection
+        self._processes[index] = process
+
+    def _restart_worker(self, index):
+        """
+        Replace the worker of a shard whose pipe has broken, e.g. because the worker has been killed.
+
+        :param index: The shard.
+        :type index: int
+
+        :return:
+        """
+        log.warning("Packet worker %d has died; Starting it again.", index)
+        self._connections[index].close()
+        process = self._processes[index]
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self.restarts += 1
+        self._start_worker(index)
+
+    @staticmethod
+    def is_worker_packet(buffer):
+        """
+        Tell from the header bytes alone whether the packet is one the workers handle: A Reunion Hello or an
+        Aggregated Hello.
+
+        :param buffer: An arrived packet in the network format.
+        :type buffer: bytes
+
+        :rtype: bool
+        """
+        if len(buffer) < 23:
+            return False
+        packet = BinaryPacket(buffer)
+        return packet.get_version() == 1 and packet.get_type() == 5 and buffer[20:23] in (b'REQ', b'AGG')
+
+    def submit(self, buffers):
+        """
+        Send every buffer to the worker of its shard without waiting for the results; Collect them with collect.
+
+        :param buffers: Arrived packets in the network format.
+        :type buffers: list
+
+        :return: What collect needs; (shard, buffers) pairs, and the results of the buffers no worker took.
+        :rtype: tuple
+        """
+        shards = [[] for _ in self._connections]
+        for buffer in buffers:
+            shards[zlib.crc32(buffer[8:20]) % len(shards)].append(buffer)
+
+        submitted = []
+        results = []
+        for index, shard in enumerate(shards):
+            if not shard:
+                continue
+            try:
+                self._connections[index].send(shard)
+            except (EOFError, OSError):
+                self._restart_worker(index)
+                results.extend((PacketWorkerPool.PACKET, buffer) for buffer in shard)
+                continue
+            submitted.append((index, shard))
+        return submitted, results
+
+    def collect(self, pending):
+        """
+        Wait for the results of the buffers submitted; A shard whose worker dies meanwhile comes back as PACKET
+        results, so the root handles its buffers itself.
+
+        :param pending: What submit has returned.
+        :type pending: tuple
+
+        :return: Results of the workers; Results of one source are in arrival order.
+        :rtype: list
+        """
+        submitted, results = pending
+        for index, shard in submitted:
+            try:
+                results.extend(self._connections[index].recv())
+            except (EOFError, OSError):
+                self._restart_worker(index)
+                results.extend((PacketWorkerPool.PACKET, buffer) for buffer in shard)
+        return results
+
+    def process(self, buffers):
+        """
+        Send every buffer to the worker of its shard and wait for all of the results.
+
+        :param buffers: Arrived packets in the network format.
+        :type buffers: list
+
+        :return: Results of the workers; Results of one source are in arrival order.
+        :rtype: list
+        """
+        return self.collect(self.submit(buffers))
+
+    def close(self, timeout=5):
+        """
+        Stop the workers and wait for their processes to exit; A worker which is still running after timeout
+        seconds is terminated. Closing again does nothing.
+
+        :param timeout: Seconds to wait for every worker.
+        :type timeout: float
+
+        :return:
+        """
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._processes = []
+
+    def is_alive(self):
+        """
+
+        :return: Whether any of our worker processes is running.
+        :rtype: bool
+        """
+        return any(process.is_alive() for process in self._processes)
+
+
+def _run_worker(connection, server_address):
+    """
+    Main loop of a worker process; A packet which fails to parse goes back to the root as it is, so one malformed
+    packet does not kill the worker.
+
+    :param connection: Our end of the pipe to the root process.
+    :param server_address: Root server address.
+
+    :type connection: multiprocessing.connection.Connection
+    :type server_address: tuple
+
+    :return:
+    """
+    while True:
+        try:
+            buffers = connection.recv()
+        except EOFError:
+            return
+        results = []
+        for buffer in buffers:
+            try:
+                results.append(_handle_buffer(buffer, server_address))
+            except Exception:
+                results.append((PacketWorkerPool.PACKET, buffer))
+        connection.send(results)
+
+
+def _handle_buffer(buffer, server_address):
+    packet = PacketFactory.parse_buffer(buffer)
+    if packet.get_version() != 1 or packet.get_type() != 5:
+        return PacketWorkerPool.PACKET, buffer
+    body = packet.get_body()
+    if packet.get_length() != len(body):
+        return PacketWorkerPool.PACKET, buffer
+
+    if body[0:3] == 'REQ':
+        hello_address, answer_address, answer = PacketFactory.new_reunion_hello_back(packet, server_address)
+        return PacketWorkerPool.REUNION, [hello_address], answer_address, bytes(answer.get_buf())
+    if body[0:3] == 'AGG':
+        nodes_array = PacketFactory.parse_aggregated_reunion_body(body)
+        answer = PacketFactory.new_reunion_packet('AGB', server_address, nodes_array)
+        return PacketWorkerPool.REUNION, nodes_array, packet.get_source_server_address(), bytes(answer.get_buf())
+    return PacketWorkerPool.PACKET, buffer
@@ -0,0 +1,106 @@
+from collections import Counter
+import os
+import sys
+import threading
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    A daemon Thread which looks at the stack of every other Thread of the process every interval seconds and counts
+    the stacks it sees; Functions which show up in many samples are where the time goes, including waiting for a
+    lock or a socket.
+
+    Unlike cProfile it does not slow down the profiled code, so it may run in a busy network; Its own cost grows with
+    the number of Threads and the depth of their stacks. dump writes the counts in the folded stack format of
+    flamegraph.pl, speedscope and inferno.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        """
+
+        :param interval: Seconds between two samples.
+        :param max_depth: Frames of a stack we keep at most, from its innermost one.
+
+        :type interval: float
+        :type max_depth: int
+        """
+        super().__init__(daemon=True, name="sampling-profiler")
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """
+        Stop sampling and wait for our Thread.
+
+        :return:
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+    def sample(self):
+        """
+        Count the current stack of every Thread but ours once.
+
+        :return:
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            functions = []
+            while frame is not None and len(functions) < self.max_depth:
+                code = frame.f_code
+                functions.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            functions.append(names.get(ident, str(ident)))
+            stacks.append(";".join(reversed(functions)))
+        with self._lock:
+            self._stacks.update(stacks)
+            self.samples += 1
+
+    def get_stacks(self):
+        """
+
+        :return: Folded stack -> number of samples it was seen in; A folded stack is the Thread name followed by
+                 file:function of every frame from the outermost one, separated by semicolons.
+        :rtype: Counter
+        """
+        with self._lock:
+            return Counter(self._stacks)
+
+    def get_top_functions(self, count=20):
+        """
+
+        :param count: How many functions to return.
+        :type count: int
+
+        :return: (file:function, samples) of the functions we have seen running most often, innermost frames only.
+        :rtype: list
+        """
+        functions = Counter()
+        for stack, samples in self.get_stacks().items():
+            functions[stack.rsplit(";", 1)[-1]] += samples
+        return functions.most_common(count)
+
+    def dump(self, path):
+        """
+        Write our stacks in the folded format, one "stack samples" line each.
+
+        :param path: File to write.
+        :type path: str
+
+        :return:
+        """
+        with open(path, "w") as file:
+            for stack, samples in sorted(self.get_stacks().items()):
+                file.write("%s %d\n" % (stack, samples))
@@ -0,0 +1,75 @@
+from src.tools.Clock import Clock
+from collections import OrderedDict
+
+
+class SeenCache:
+    """
+    A bounded set of recently seen keys, e.g. Message IDs.
+
+    A key is forgotten ttl seconds after it was last seen, or earlier if max_size newer keys have been seen since;
+    Keys are kept in the order they were last seen, so both happen from the front of an OrderedDict.
+    """
+
+    def __init__(self, max_size=4096, ttl=60, clock=None):
+        """
+
+        :param max_size: Maximum number of keys we remember.
+        :param ttl: Seconds we remember a key.
+        :param clock: Source of the time keys are seen at; Wall-clock time by default.
+
+        :type max_size: int
+        :type ttl: float
+        :type clock: Clock
+        """
+        if max_size < 1:
+            raise Exception("Seen cache size must be positive.")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock if clock is not None else Clock()
+        self._seen = OrderedDict()
+
+    def check_and_add(self, key, now=None):
+        """
+        Remember the key and tell whether we had seen it already.
+
+        :param key: Any hashable key.
+        :param now: Current time; For tests.
+
+        :type now: float
+
+        :return: Whether the key was already in the cache.
+        :rtype: bool
+        """
+        if now is None:
+            now = self.clock.time()
+        self._expire(now)
+
+        seen = key in self._seen
+        if seen:
+            self._seen.move_to_end(key)
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        return seen
+
+    def _expire(self, now):
+        """
+        Forget the keys which have not been seen for ttl seconds.
+
+        :param now: Current time.
+        :type now: float
+
+        :return:
+        """
+        deadline = now - self.ttl
+        while self._seen:
+            key, seen_time = next(iter(self._seen.items()))
+            if seen_time > deadline:
+                return
+            del self._seen[key]
+
+    def __len__(self):
+        return len(self._seen)
+
+    def __contains__(self, key):
+        return key in self._seen
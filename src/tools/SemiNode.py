@@ -1,7 +1,8 @@
 class SemiNode:
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, capacity=None):
         self.ip = ip
         self.port = port
+        self.capacity = capacity
 
     def get_ip(self):
         return self.ip
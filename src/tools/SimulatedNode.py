@@ -0,0 +1,87 @@
+from src.tools.Node import Node
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class SimulatedNode(Node):
+    def __init__(self, server_address, stream, set_root=False, set_register=False, **node_options):
+        """
+        The SimulatedNode object constructor.
+
+        This is the in-memory flavour of Node for a SimulatedStream; It has no socket, send_message hands out_buff
+        to the Simulator, which delivers it to the stream of server_address after the delay of the link. Adding a
+        packet to out_buff puts us in the queued_nodes of our stream.
+
+        Warnings:
+            1. If the peer of server_address is down or has never existed send_message raises ConnectionError, like
+               a Node whose connection pool has given up on its address, so the Stream removes this Node.
+
+        :param server_address:
+        :param stream: The SimulatedStream we belong to.
+        :param set_root:
+        :param set_register:
+        :param node_options: The out_buff options of Node: max_queue_packets, max_queue_bytes and queue_policy bound
+                             out_buff between two send_message calls, batch_bytes and batch_source_address pack it
+                             into Batch packets.
+
+        :type stream: SimulatedStream
+        """
+        self._stream = stream
+        super().__init__(server_address, set_root=set_root, set_register=set_register, **node_options)
+
+    def _connect(self):
+        """
+        There is nothing to connect to.
+
+        :return: Always True.
+        :rtype: bool
+        """
+        return True
+
+    def send_message(self):
+        """
+        Hand out_buff over to the Simulator.
+
+        :return:
+        """
+        if self.overflowed:
+            raise ConnectionError("Node out_buff overflowed.")
+        if not self.out_buff:
+            return
+        if not self._stream.simulator.send(self._stream.get_server_address(), self.get_server_address(),
+                                           list(self._take_out_buff())):
+            log.debug("Node %s: %s was detached.", self.server_ip, self.server_port)
+            raise ConnectionError("Node is down.")
+
+    def add_message_to_out_buff(self, message):
+        """
+        Add the message to out_buff like Node does and tell our stream that we have packets to send.
+
+        :param message: The message we want to add to out_buff
+        :return: Whether the message was added.
+        :rtype: bool
+        """
+        added = super().add_message_to_out_buff(message)
+        if self.out_buff or self.overflowed:
+            self._stream.queued_nodes[self] = None
+        return added
+
+    def send_message_in(self, executor):
+        """
+        send_message never waits, so we do not need the executor.
+
+        :param executor: Ignored.
+
+        :return: None; There is no future to wait for.
+        """
+        self.send_message()
+        return None
+
+    def close(self):
+        """
+        There is no connection to close; We only leave the queued_nodes of our stream.
+
+        :return:
+        """
+        self._stream.queued_nodes.pop(self, None)
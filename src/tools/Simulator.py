@@ -0,0 +1,249 @@
+from src.SimulatedStream import SimulatedStream
+from src.tools.Clock import VirtualClock
+import heapq
+import itertools
+import random
+
+
+class Simulator:
+    """
+    A discrete-event simulation of many Peers in one Thread, in virtual time and without sockets.
+
+    Every Peer is made with transport=simulator.make_stream, clock=simulator.clock and reunion_thread=False, then
+    handed to add_peer. From then on the Simulator runs its main loop iteration (Peer.run_once) whenever its stream
+    wakes up, e.g. because packets were delivered to it, and its Reunion daemon (Peer.reunion_step) at the virtual
+    times reunion_step returns or whenever reunion_wake_up is set.
+
+    Events are kept in a heap ordered by virtual time, and the clock jumps from one event to the next; So idle
+    time costs nothing. Packets handed to a link arrive after its delay, in the order they were sent like on a TCP
+    connection; Packets to a peer which is down are lost and its sender's Node fails, see SimulatedNode.
+    """
+
+    def __init__(self, link_delay=0.01, jitter=0, seed=None):
+        """
+
+        :param link_delay: Seconds a packet needs on a link, or a callable which returns them for the server
+                           addresses of the sender and the receiver.
+        :param jitter: Up to this many random seconds are added to the delay of every send; The order on a link is
+                       kept anyway.
+        :param seed: Seed of our random generator, for repeatable simulations.
+
+        :type link_delay: float | callable
+        :type jitter: float
+        :type seed: int
+        """
+        self.clock = VirtualClock()
+        self.link_delay = link_delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        # (time, sequence, callback, args); The sequence keeps events of the same time in the order they were added.
+        self._events = []
+        self._sequence = itertools.count()
+        # Server address -> SimulatedStream and Peer.
+        self.streams = {}
+        self.peers = {}
+        # Server addresses of the peers which have failed.
+        self.down = set()
+        # Server addresses whose main loop iteration is scheduled already.
+        self._woken = set()
+        # Server address -> token of the reunion_step event which is still valid.
+        self._reunion_tokens = {}
+        # (sender, receiver) -> arrival time of the last packets on that link.
+        self._link_times = {}
+        self.processed_events = 0
+        self.delivered_packets = 0
+        self.lost_packets = 0
+
+    def make_stream(self, ip, port, **stream_options):
+        """
+        Make a SimulatedStream of ours; Pass this as the transport of a Peer.
+
+        :param ip: 15 characters
+        :param port: 5 characters
+        :param stream_options: The queue and batch options of Stream.
+
+        :return: The new stream.
+        :rtype: SimulatedStream
+        """
+        return SimulatedStream(self, ip, port, **stream_options)
+
+    def bind(self, stream):
+        """
+        Give the server address of the stream to it.
+
+        :param stream: A new SimulatedStream.
+        :type stream: SimulatedStream
+
+        :return:
+        """
+        address = stream.get_server_address()
+        if address in self.streams and address not in self.down:
+            raise Exception("Address is already in use.")
+        self.streams[address] = stream
+        self.down.discard(address)
+
+    def add_peer(self, peer):
+        """
+        Start driving a Peer whose stream is one of ours.
+
+        :param peer: The Peer.
+        :type peer: Peer
+
+        :return:
+        """
+        address = peer.stream.get_server_address()
+        self.peers[address] = peer
+        self.wake(address)
+
+    def fail(self, address):
+        """
+        Stop the peer of the address at once, as if its process was killed; Packets to it are lost from now on.
+
+        :param address: Server address of the peer.
+        :type address: tuple
+
+        :return:
+        """
+        self.down.add(address)
+        self._reunion_tokens.pop(address, None)
+
+    def is_up(self, address):
+        """
+
+        :param address: Server address.
+        :type address: tuple
+
+        :return: Whether a peer of ours has the address and has not failed.
+        :rtype: bool
+        """
+        return address in self.peers and address not in self.down
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) after delay seconds of virtual time.
+
+        :param delay: Seconds from now; Not negative.
+        :param callback: What to call.
+
+        :type delay: float
+        :type callback: callable
+
+        :return:
+        """
+        heapq.heappush(self._events, (self.clock.time() + delay, next(self._sequence), callback, args))
+
+    def wake(self, address):
+        """
+        Schedule the main loop iteration of the peer of the address at the current virtual time, once.
+
+        :param address: Server address of the peer.
+        :type address: tuple
+
+        :return:
+        """
+        if address not in self._woken:
+            self._woken.add(address)
+            self.schedule(0, self._run_peer, address)
+
+    def send(self, sender, receiver, packets):
+        """
+        Deliver packets to the stream of the receiver after the delay of the link.
+
+        :param sender: Server address of the sending stream.
+        :param receiver: Server address of the receiving stream.
+        :param packets: Packets in the network format.
+
+        :type sender: tuple
+        :type receiver: tuple
+        :type packets: list
+
+        :return: Whether the receiver is up; Otherwise the packets are lost.
+        :rtype: bool
+        """
+        if receiver not in self.streams or receiver in self.down:
+            self.lost_packets += len(packets)
+            return False
+        now = self.clock.time()
+        arrival = now + self.get_link_delay(sender, receiver)
+        link = (sender, receiver)
+        arrival = max(arrival, self._link_times.get(link, now))
+        self._link_times[link] = arrival
+        self.schedule(arrival - now, self._deliver, receiver, packets)
+        return True
+
+    def get_link_delay(self, sender, receiver):
+        """
+
+        :param sender: Server address of the sender.
+        :param receiver: Server address of the receiver.
+
+        :type sender: tuple
+        :type receiver: tuple
+
+        :return: Seconds the next packets from the sender to the receiver will need.
+        :rtype: float
+        """
+        delay = self.link_delay(sender, receiver) if callable(self.link_delay) else self.link_delay
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        return delay
+
+    def run_until(self, end_time):
+        """
+        Process every event up to end_time and leave the clock there.
+
+        :param end_time: Virtual time.
+        :type end_time: float
+
+        :return:
+        """
+        events = self._events
+        while events and events[0][0] <= end_time:
+            event_time, _, callback, args = heapq.heappop(events)
+            self.clock.advance_to(event_time)
+            callback(*args)
+            self.processed_events += 1
+        self.clock.advance_to(max(end_time, self.clock.time()))
+
+    def run_for(self, seconds):
+        """
+        Process the events of the next seconds of virtual time.
+
+        :param seconds: Duration.
+        :type seconds: float
+
+        :return:
+        """
+        self.run_until(self.clock.time() + seconds)
+
+    def _deliver(self, receiver, packets):
+        if receiver in self.down:
+            self.lost_packets += len(packets)
+            return
+        self.delivered_packets += len(packets)
+        self.streams[receiver].deliver(packets)
+
+    def _run_peer(self, address):
+        self._woken.discard(address)
+        peer = self.peers.get(address)
+        if peer is None or address in self.down:
+            return
+        peer.run_once()
+        if peer.reunion_wake_up.is_set():
+            peer.reunion_wake_up.clear()
+            self._run_reunion(address)
+
+    def _run_reunion(self, address, token=None):
+        """
+        Run the reunion_step of the peer of the address and schedule the next one; A scheduled step whose token is
+        not the latest one of its peer is ignored, because the peer has been woken up earlier meanwhile.
+
+        :return:
+        """
+        if token is not None and self._reunion_tokens.get(address) != token:
+            return
+        if address in self.down:
+            return
+        delay = self.peers[address].reunion_step()
+        token = self._reunion_tokens[address] = next(self._sequence)
+        self.schedule(delay, self._run_reunion, address, token)
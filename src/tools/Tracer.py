@@ -0,0 +1,199 @@
+from collections import deque
+import json
+import threading
+import time
+
+
+class Tracer:
+    """
+    Records the stages every packet goes through in one or more Peers of this process, for finding out where the
+    time of a hop goes.
+
+    Every packet gets a span ID when it arrives at a Stream, or when a Peer makes it without handling a packet, e.g.
+    for a user command; The ID follows it through these stages:
+
+        ServerSocket:                The packet has arrived; An instant, in the server Thread.
+        Stream.in_buf:               From its arrival until our main loop takes it.
+        PacketFactory.parse_buffer:  Parsing it.
+        Peer.handle_packet:          Handling it; Packets made meanwhile, e.g. relayed Messages, get its span ID.
+        Node.out_buff:               From add_message_to_out_buff until send_out_buf_messages takes it.
+        Node.send_message:           Sending the out_buff of a node; Its args list the span IDs of the packets.
+
+    Buffers are matched to their span IDs by identity, so a tracer costs nothing but a few dict operations per
+    stage; Without a tracer the Peer and the Stream skip all of it. dump writes the events in the Chrome trace
+    format, for chrome://tracing, Perfetto or speedscope; Every Stream is a process there, named by its address.
+    """
+
+    def __init__(self, max_events=1000000, max_marks=65536):
+        """
+
+        :param max_events: We keep the latest this many events.
+        :param max_marks: Buffers we remember the span IDs of at most; e.g. packets that are dropped from a full
+                          out_buff are never taken back, so the oldest marks are forgotten.
+
+        :type max_events: int
+        :type max_marks: int
+        """
+        # Times of our events are in seconds of time.perf_counter, which every Thread shares.
+        self.clock = time.perf_counter
+        self.start_time = self.clock()
+        self.max_marks = max_marks
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=max_events)
+        self._metadata = []
+        self._processes = {}
+        self._threads = set()
+        self._next_span = 0
+        # (owner, id(buffer)) -> (buffer, span ID, time); The buffer is kept so its id is not reused meanwhile.
+        self._marks = {}
+        self._local = threading.local()
+
+    def add_process(self, name):
+        """
+
+        :param name: e.g. the server address of a Stream.
+        :type name: str
+
+        :return: Process ID of the name in our events.
+        :rtype: int
+        """
+        with self._lock:
+            pid = self._processes.get(name)
+            if pid is None:
+                pid = self._processes[name] = len(self._processes) + 1
+                self._metadata.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                                       "args": {"name": name}})
+            return pid
+
+    def new_span(self):
+        """
+
+        :return: A new span ID.
+        :rtype: int
+        """
+        with self._lock:
+            self._next_span += 1
+            return self._next_span
+
+    def get_current_span(self):
+        """
+
+        :return: Span ID of the packet the current Thread is handling; None if it handles none.
+        :rtype: int
+        """
+        return getattr(self._local, "span", None)
+
+    def set_current_span(self, span):
+        """
+
+        :param span: Span ID of the packet the current Thread starts handling; None when it is done.
+        :type span: int
+
+        :return:
+        """
+        self._local.span = span
+
+    def mark(self, owner, buffer, span=None):
+        """
+        Remember the span ID of a buffer and when it was marked, until take_mark.
+
+        :param owner: Whose buffer it is, e.g. (pid, "in") for the input buffer of a Stream; The same buffer object
+                      may be queued for many nodes.
+        :param buffer: The packet.
+        :param span: Its span ID; A new one by default.
+
+        :type buffer: bytes
+
+        :return: The span ID.
+        :rtype: int
+        """
+        if span is None:
+            span = self.new_span()
+        now = self.clock()
+        with self._lock:
+            self._marks[(owner, id(buffer))] = (buffer, span, now)
+            if len(self._marks) > self.max_marks:
+                del self._marks[next(iter(self._marks))]
+        return span
+
+    def take_mark(self, owner, buffer):
+        """
+        Forget the mark of a buffer.
+
+        :return: Its span ID and when it was marked; (None, None) if it has no mark.
+        :rtype: tuple
+        """
+        with self._lock:
+            mark = self._marks.pop((owner, id(buffer)), None)
+        if mark is None or mark[0] is not buffer:
+            return None, None
+        return mark[1], mark[2]
+
+    def record(self, pid, name, start, end=None, span=None, **args):
+        """
+        Add an event of the current Thread.
+
+        :param pid: Process ID from add_process.
+        :param name: The stage.
+        :param start: When it started, in our clock.
+        :param end: When it ended; None makes an instant event.
+        :param span: Span ID of its packet.
+        :param args: More to show with the event.
+
+        :type pid: int
+        :type name: str
+        :type start: float
+        :type end: float
+        :type span: int
+
+        :return:
+        """
+        thread = threading.current_thread()
+        tid = thread.ident
+        event = {"name": name, "ph": "X" if end is not None else "i", "pid": pid, "tid": tid,
+                 "ts": (start - self.start_time) * 1e6, "args": args}
+        if end is not None:
+            event["dur"] = (end - start) * 1e6
+        else:
+            event["s"] = "t"
+        if span is not None:
+            args["span"] = span
+        with self._lock:
+            if (pid, tid) not in self._threads:
+                self._threads.add((pid, tid))
+                self._metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                       "args": {"name": thread.name}})
+        self._events.append(event)
+
+    def get_events(self):
+        """
+
+        :return: Our events in the order they were recorded; Metadata events first.
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._metadata) + list(self._events)
+
+    def get_stage_totals(self):
+        """
+
+        :return: Stage name -> (number of events, their total seconds); Instant events have no seconds.
+        :rtype: dict
+        """
+        totals = {}
+        for event in list(self._events):
+            count, seconds = totals.get(event["name"], (0, 0.0))
+            totals[event["name"]] = (count + 1, seconds + event.get("dur", 0) / 1e6)
+        return totals
+
+    def dump(self, path):
+        """
+        Write our events as a Chrome trace JSON file.
+
+        :param path: File to write.
+        :type path: str
+
+        :return:
+        """
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.get_events(), "displayTimeUnit": "ms"}, file)
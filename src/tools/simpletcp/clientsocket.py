@@ -3,7 +3,7 @@ import socket
 
 
 class ClientSocket:
-    def __init__(self, mode, port, recv_bytes=2048, single_use=True):
+    def __init__(self, mode, port, recv_bytes=2048, single_use=True, timeout=None):
         # Handle the socket's mode.
         # The socket's mode determines the IP address it will
         # attempt to connect to.
@@ -24,6 +24,9 @@ class ClientSocket:
             raise ValueError
         # Actually create an INET, STREAMing socket.socket.
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Give up on connecting, sending and receiving after timeout
+        # seconds by raising socket.timeout; None waits forever.
+        self._socket.settimeout(timeout)
         # Save the number of bytes to be read in response
         self.recv_bytes = recv_bytes
         # Save whether this socket is single-use or not.
@@ -76,8 +79,9 @@ class ClientSocket:
         if type(data) != bytes:
             print("data must be a string or bytes", file=sys.stderr)
             raise ValueError
-        # Everything is setup, now we must send the data.
-        self._socket.send(data)
+        # Everything is setup, now we must send the data; All of it,
+        # a single send may write only a part of a large packet.
+        self._socket.sendall(data)
         # Keep track of the fact that we've sent data (or attempted to).
         self.used = True
         # Now read the response:
@@ -90,6 +94,39 @@ class ClientSocket:
         # Return the response
         return response
 
+    def send_all(self, data):
+        # This method takes one argument: data
+        # Unlike send, it writes all of data and returns immediately
+        # without reading the response of the server; Responses can
+        # be thrown away later with discard_responses.
+        # Only non single-use sockets can send this way.
+        if self.single_use:
+            print("send_all needs a non single-use socket", file=sys.stderr)
+            raise RuntimeError
+        # If data is a string, rather than bytes.
+        if type(data) == str:
+            # Turn it into UTF-8 bytes.
+            data = bytes(data, "UTF-8")
+        self._socket.sendall(data)
+        self.used = True
+
+    def discard_responses(self):
+        # Read and drop whatever the server has responded so far
+        # without blocking.
+        timeout = self._socket.gettimeout()
+        self._socket.setblocking(False)
+        try:
+            while True:
+                try:
+                    data = self._socket.recv(self.recv_bytes)
+                except BlockingIOError:
+                    return
+                if not data:
+                    # The server has closed the connection.
+                    raise ConnectionError
+        finally:
+            self._socket.settimeout(timeout)
+
     def close(self):
         # If the connection isn't already closed, close it.
         if not self.closed:
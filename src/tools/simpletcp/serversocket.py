@@ -1,13 +1,36 @@
-import errno
+import logging
 import queue
-import select
+import selectors
 import socket
 import sys
 
+log = logging.getLogger(__name__)
+
+# Selector data of the socket which close writes to, so run stops waiting.
+_WAKE_UP = object()
+
+
+class _Connection:
+    # State of one accepted connection.
+    __slots__ = ("sock", "ip", "queue", "buffer", "pending", "writing")
+
+    def __init__(self, sock, ip):
+        self.sock = sock
+        self.ip = ip
+        # A queue.Queue of data to be sent; The read callback gets it.
+        self.queue = queue.Queue()
+        # The received bytes that do not make a complete frame yet.
+        self.buffer = bytearray()
+        # The rest of a chunk that a send did not take completely.
+        self.pending = None
+        # Whether the selector watches the socket for write events.
+        self.writing = False
+
 
 class ServerSocket:
 
-    def __init__(self, mode, port, read_callback, max_connections, recv_bytes):
+    def __init__(self, mode, port, read_callback, max_connections, recv_bytes,
+                 frame_length=None):
         # Handle the socket's mode.
         # The socket's mode determines the IP address it binds to.
         # mode can be one of two special values:
@@ -39,88 +62,166 @@ class ServerSocket:
         if type(self._max_connections) != int:
             print("max_connections must be an int", file=sys.stderr)
             raise ValueError
+        # Start listening right away, so a client may connect as soon as
+        # the constructor returns even if run has not started yet in its
+        # thread; Until then connections wait in the backlog.
+        self._socket.listen(self._max_connections)
         # Save the number of bytes to be received each time we read from
         # a socket
         self.recv_bytes = recv_bytes
+        # Save the framing function. If it is None, the callback gets
+        # whatever a single recv returned. Otherwise it is called with
+        # the buffered bytes of a connection and must return the length
+        # of the first frame in them, or None if that is not known yet;
+        # the callback then gets exactly one complete frame per call.
+        # It may raise ValueError for a corrupted stream, which closes
+        # the connection.
+        self.frame_length = frame_length
+        # The selector tells us which sockets are ready; It is epoll on
+        # Linux, so it does not slow down with the number of connections
+        # and has no FD_SETSIZE limit like select.select.
+        self._selector = selectors.DefaultSelector()
+        # The listening socket has no connection state.
+        self._selector.register(self._socket, selectors.EVENT_READ, None)
+        # close asks run to stop through this pair of sockets.
+        self._closed = False
+        self._wake_up_reader, self._wake_up_writer = socket.socketpair()
+        self._selector.register(self._wake_up_reader, selectors.EVENT_READ, _WAKE_UP)
 
     def run(self):
-        # Start listening
-        self._socket.listen(self._max_connections)
-        # Create a list of readers (sockets that will be read from) and a list
-        # of writers (sockets that will be written to).
-        readers = [self._socket]
-        writers = []
-        # Create a dictionary of queue.Queues for data to be sent.
-        # This dictionary maps sockets to queue.Queue objects
-        queues = dict()
-        # Create a similar dictionary that stores IP addresses.
-        # This dictionary maps sockets to IP addresses
-        IPs = dict()
         # Now, the main loop.
-        while readers:
+        while not self._closed:
             # Block until a socket is ready for processing.
-            read, write, err = select.select(readers, writers, readers)
-            # Deal with sockets that need to be read from.
-            for sock in read:
-                if sock is self._socket:
-                    # We have a viable connection!
-                    client_socket, client_ip = self._socket.accept()
-                    # Make it a non-blocking connection.
-                    client_socket.setblocking(0)
-                    # Add it to our readers.
-                    readers.append(client_socket)
-                    # Make a queue for it.
-                    queues[client_socket] = queue.Queue()
-                    # Store its IP address.
-                    IPs[client_socket] = client_ip
-                else:
-                    # Someone sent us something! Let's receive it.
-                    try:
-                        data = sock.recv(self.recv_bytes)
-                    except socket.error as e:
-                        if e.errno is errno.ECONNRESET:
-                            # Consider 'Connection reset by peer'
-                            # the same as reading zero bytes
-                            data = None
-                        else:
-                            raise e
-                    if data:
-                        # Call the callback
-                        self.callback(IPs[sock], queues[sock], data)
-                        # Put the client socket in writers so we can write to it
-                        # later.
-                        if sock not in writers:
-                            writers.append(sock)
-                    else:
-                        # We received zero bytes, so we should close the stream
-                        # Stop writing to it.
-                        if sock in writers:
-                            writers.remove(sock)
-                        # Stop reading from it.
-                        readers.remove(sock)
-                        # Close the connection.
-                        sock.close()
-                        # Destroy is queue
-                        del queues[sock]
-            # Deal with sockets that need to be written to.
-            for sock in write:
+            for key, events in self._selector.select():
+                if key.data is None:
+                    # We have viable connections!
+                    self._accept()
+                    continue
+                if key.data is _WAKE_UP:
+                    continue
+                connection = key.data
+                try:
+                    keep = self._handle_events(connection, events)
+                except Exception:
+                    # e.g. the callback has failed; Only this connection
+                    # is closed and we keep serving the others.
+                    log.exception("Closing the connection from %s: %s", *connection.ip)
+                    keep = False
+                if not keep:
+                    self._close(connection)
+        # close has been called; Close every socket we have.
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        self._wake_up_writer.close()
+
+    def _handle_events(self, connection, events):
+        # Read and write what the selector says a connection is ready for.
+        # Returns False if the connection should be closed.
+        if events & selectors.EVENT_READ:
+            if not self._read(connection):
+                return False
+        if events & selectors.EVENT_WRITE:
+            return self._write(connection)
+        return True
+
+    def close(self):
+        # Stop run after its current round of events; It closes the
+        # listening socket and every connection.
+        self._closed = True
+        try:
+            self._wake_up_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def _accept(self):
+        # Accept every pending connection, not only one of them.
+        while True:
+            try:
+                client_socket, client_ip = self._socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            # Make it a non-blocking connection.
+            client_socket.setblocking(0)
+            # Everything we know about a connection lives in its
+            # _Connection, which the selector gives back with its events.
+            connection = _Connection(client_socket, client_ip)
+            self._selector.register(client_socket, selectors.EVENT_READ, connection)
+
+    def _read(self, connection):
+        # Someone sent us something! Let's receive it.
+        # Returns False if the connection should be closed.
+        try:
+            data = connection.sock.recv(self.recv_bytes)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            # Consider 'Connection reset by peer' and the other socket
+            # errors the same as reading zero bytes
+            return False
+        if not data:
+            # We received zero bytes, so we should close the stream
+            return False
+        if self.frame_length is not None:
+            # Call the callback once for every complete frame
+            try:
+                self._emit_frames(connection.ip, connection.queue, connection.buffer, data)
+            except ValueError:
+                # The stream is corrupted; drop the connection.
+                return False
+        else:
+            # Call the callback
+            self.callback(connection.ip, connection.queue, data)
+        # Write whatever the callback has queued for the connection.
+        return self._write(connection)
+
+    def _write(self, connection):
+        # Send the queued data of a connection until its queue is empty or
+        # the socket can not take more (EAGAIN); A partial send keeps the
+        # rest of its chunk for the next time the socket is writable.
+        # Returns False if the connection should be closed.
+        while True:
+            if not connection.pending:
                 try:
                     # Get the next chunk of data in the queue, but don't wait.
-                    data = queues[sock].get_nowait()
+                    connection.pending = memoryview(connection.queue.get_nowait())
                 except queue.Empty:
                     # The queue is empty -> nothing needs to be written.
-                    writers.remove(sock)
-                else:
-                    # The queue wasn't empty; we did, in fact, get something.
-                    # So send it.
-                    sock.send(data)
-            # Deal with erroring sockets.
-            for sock in err:
-                # Remove the socket from every list.
-                readers.remove(sock)
-                if sock in writers:
-                    writers.remove(sock)
-                # Close the connection.
-                sock.close()
-                # Destroy its queue.
-                del queues[sock]
+                    self._watch_writes(connection, False)
+                    return True
+            try:
+                sent = connection.sock.send(connection.pending)
+            except (BlockingIOError, InterruptedError):
+                # Wait until the socket is writable again.
+                self._watch_writes(connection, True)
+                return True
+            except OSError:
+                # e.g. 'Broken pipe'; The connection is gone.
+                return False
+            connection.pending = connection.pending[sent:]
+
+    def _watch_writes(self, connection, writing):
+        # Ask the selector for write events only while we have data that
+        # the socket did not take.
+        if connection.writing != writing:
+            connection.writing = writing
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ
+            self._selector.modify(connection.sock, events, connection)
+
+    def _close(self, connection):
+        # Stop watching the socket, close the connection and forget its
+        # queue and buffer.
+        self._selector.unregister(connection.sock)
+        connection.sock.close()
+
+    def _emit_frames(self, ip, queue, buffer, data):
+        # Append data to the reassembly buffer of a connection and call the
+        # callback for every complete frame at the start of it.
+        buffer.extend(data)
+        while True:
+            length = self.frame_length(buffer)
+            if length is None or len(buffer) < length:
+                return
+            frame = bytes(buffer[:length])
+            del buffer[:length]
+            self.callback(ip, queue, frame)
@@ -16,15 +16,23 @@ class TCPServer:
     # is a tunnel of data to send to the socket that it receieved from.
     # The third argument must be data, which is a string of bytes
     # that the server received.
+    # frame_length optionally turns the byte stream of every connection
+    # into frames: it is called with the buffered bytes of a connection
+    # and returns the length of the first frame (or None if it can not
+    # tell yet), and read_callback then receives one whole frame as data.
     def __init__(self, mode, port, read_callback,
-                 maximum_connections=5, recv_bytes=2048):
+                 maximum_connections=5, recv_bytes=2048, frame_length=None):
         self.serversocket = ServerSocket(
-            mode, port, read_callback, maximum_connections, recv_bytes
+            mode, port, read_callback, maximum_connections, recv_bytes,
+            frame_length
         )
 
     def run(self):
         self.serversocket.run()
 
+    def close(self):
+        self.serversocket.close()
+
     @property
     def ip(self):
         return self.serversocket.ip
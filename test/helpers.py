@@ -0,0 +1,109 @@
+"""
+    Shared helpers of the unit tests; Run the tests from the repository root with:
+
+        python -m pytest -q test
+"""
+import socket
+import time
+
+from src.AsyncStream import AsyncStream
+from src.Packet import PacketFactory
+from src.Peer import Peer
+from src.Stream import Stream
+
+LOCALHOST = "127.000.000.001"
+
+
+def free_port():
+    """
+    :return: A TCP port on the loopback address nobody listens on right now.
+    :rtype: int
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def new_stream(test, port=None, **options):
+    """
+    :return: A Stream on the port, or a free one, which is closed when the test ends.
+    :rtype: Stream
+    """
+    stream = Stream(LOCALHOST, free_port() if port is None else port, **options)
+    test.addCleanup(stream.close)
+    return stream
+
+
+def new_async_stream(test, port=None, **options):
+    """
+    :return: An AsyncStream on the port, or a free one, which is closed when the test ends.
+    :rtype: AsyncStream
+    """
+    stream = AsyncStream(LOCALHOST, free_port() if port is None else port, **options)
+    test.addCleanup(stream.close)
+    return stream
+
+
+def new_peer(test, port=None, **options):
+    """
+    :return: A Peer on the port, or a free one, which is closed when the test ends.
+    :rtype: Peer
+    """
+    peer = Peer(LOCALHOST, free_port() if port is None else port, **options)
+    test.addCleanup(peer.close)
+    return peer
+
+
+def new_pair(test, **sender_options):
+    """
+    :return: A receiver Stream, a sender Stream which has the receiver as its node, and that node; Both Streams are
+             closed when the test ends.
+    :rtype: tuple
+    """
+    receiver = new_stream(test)
+    sender = new_stream(test, **sender_options)
+    sender.add_node(receiver.get_server_address())
+    return receiver, sender, sender.get_node_by_server(*receiver.get_server_address())
+
+
+def wait_until(predicate, timeout=5, interval=0.01):
+    """
+    :return: Whether predicate() became true before the timeout.
+    :rtype: bool
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def message(text="hello", source=(LOCALHOST, "05335")):
+    """
+    :return: A Message packet in the network format.
+    :rtype: bytes
+    """
+    return bytes(PacketFactory.new_message_packet(text, source).get_buf())
+
+
+def message_text(buffer):
+    """
+    :return: The message of a Message packet in the network format, without its Message ID.
+    :rtype: str
+    """
+    return PacketFactory.parse_message(PacketFactory.parse_buffer(buffer))[1]
+
+
+def receive(stream, count, timeout=5):
+    """
+    :return: The packets arrived in the input buffer of the stream, once there are count of them or the timeout
+             has expired.
+    :rtype: list
+    """
+    received = []
+    deadline = time.time() + timeout
+    while len(received) < count and time.time() < deadline:
+        stream.wait_for_in_buf(0.1)
+        received.extend(stream.pop_in_buf())
+    return received
@@ -1,6 +1,8 @@
 from src.Peer import Peer
+from src.tools.Log import configure_logging
 
 if __name__ == "__main__":
+    configure_logging("INFO")
 
     client = Peer("127.000.000.001", 21225, is_root=False, root_address=("000.000.000.000", 5353))
 
@@ -1,6 +1,8 @@
 from src.Peer import Peer
+from src.tools.Log import configure_logging
 
 if __name__ == "__main__":
+    configure_logging("INFO")
     server = Peer("192.168.202.221", 5356, is_root=True)
     server.start_user_interface()
 
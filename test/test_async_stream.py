@@ -0,0 +1,52 @@
+import unittest
+
+from helpers import LOCALHOST, free_port, message_text, new_async_stream, receive, wait_until
+from src.Packet import PacketFactory
+
+
+class AsyncStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.receiver = new_async_stream(self)
+        self.sender = new_async_stream(self)
+        self.address = self.receiver.get_server_address()
+        self.sender.add_node(self.address)
+        self.node = self.sender.get_node_by_server(*self.address)
+
+    def test_packets_arrive_in_order(self):
+        for i in range(20):
+            buf = PacketFactory.new_message_packet("m%d" % i, self.sender.get_server_address()).get_buf()
+            self.sender.add_message_to_out_buff(self.address, buf)
+        self.sender.send_out_buf_messages()
+
+        received = receive(self.receiver, 20)
+        bodies = [message_text(b) for b in received]
+        self.assertEqual(bodies, ["m%d" % i for i in range(20)])
+
+    def test_send_to_a_closed_port_raises(self):
+        sender = new_async_stream(self, reconnect_attempts=1)
+        sender.add_node((LOCALHOST, str(free_port())))
+        node = sender.nodes[-1]
+        self.assertTrue(wait_until(lambda: node.detached))
+        with self.assertRaises(ConnectionError):
+            node.send_message()
+
+    def test_unsent_packets_are_sent_after_reconnecting(self):
+        port = free_port()
+        self.sender.add_node((LOCALHOST, str(port)))
+        node = self.sender.nodes[-1]
+        address = node.get_server_address()
+        self.assertTrue(wait_until(lambda: node.detached))
+        for i in range(5):
+            buf = PacketFactory.new_message_packet("m%d" % i, self.sender.get_server_address()).get_buf()
+            node.add_message_to_out_buff(buf)
+        node.send_message()
+        self.assertEqual([message_text(b) for b in node.out_buff], ["m%d" % i for i in range(5)])
+
+        receiver = new_async_stream(self, port)
+        self.assertTrue(wait_until(lambda: not node.connections.is_waiting(address)))
+        node.send_message()
+        self.assertEqual([message_text(b) for b in receive(receiver, 5)], ["m%d" % i for i in range(5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from helpers import new_stream, receive
+from src.Packet import PacketFactory
+
+
+class BroadcastTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = new_stream(self)
+        self.receivers = [new_stream(self) for _ in range(3)]
+        for r in self.receivers[:2]:
+            self.stream.add_node(r.get_server_address())
+        self.stream.add_node(self.receivers[2].get_server_address(), set_register_connection=True)
+        self.message = bytes(PacketFactory.new_message_packet("hello", self.stream.get_server_address()).get_buf())
+
+    def node(self, receiver):
+        return self.stream.get_node_by_server(*receiver.get_server_address())
+
+    def test_every_neighbour_gets_the_same_buffer(self):
+        self.stream.add_message_to_broadcast_buffs(self.message)
+        for r in self.receivers[:2]:
+            self.assertEqual(len(self.node(r).out_buff), 1)
+            self.assertIs(self.node(r).out_buff[0], self.message)
+
+    def test_register_connections_are_skipped(self):
+        self.stream.add_message_to_broadcast_buffs(self.message)
+        self.assertEqual(len(self.node(self.receivers[2]).out_buff), 0)
+
+    def test_the_sender_is_excluded(self):
+        self.stream.add_message_to_broadcast_buffs(self.message,
+                                                   exclude_address=self.receivers[0].get_server_address())
+        self.assertEqual(len(self.node(self.receivers[0]).out_buff), 0)
+        self.assertIs(self.node(self.receivers[1]).out_buff[0], self.message)
+
+    def test_broadcast_nodes_are_rebuilt_after_add_and_remove(self):
+        nodes = self.stream.get_broadcast_nodes()
+        self.assertIs(self.stream.get_broadcast_nodes(), nodes)
+        self.assertEqual(len(nodes), 2)
+
+        receiver = new_stream(self)
+        self.stream.add_node(receiver.get_server_address())
+        self.assertEqual(len(self.stream.get_broadcast_nodes()), 3)
+        self.stream.remove_node(self.node(self.receivers[0]))
+        self.assertEqual(len(self.stream.get_broadcast_nodes()), 2)
+
+    def test_broadcast_is_delivered(self):
+        self.stream.add_message_to_broadcast_buffs(self.message)
+        self.stream.send_out_buf_messages()
+        for r in self.receivers[:2]:
+            self.assertEqual(receive(r, 1), [self.message])
+
+
+if __name__ == "__main__":
+    unittest.main()
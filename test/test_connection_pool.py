@@ -0,0 +1,106 @@
+import select
+import socket
+import time
+import unittest
+
+from helpers import LOCALHOST, free_port, message, message_text, new_stream, receive, wait_until
+from src.tools.ConnectionPool import ConnectionPool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def test_backoff_doubles_up_to_the_maximum(self):
+        pool = ConnectionPool(backoff=1, max_backoff=3, max_failures=4)
+        address = (LOCALHOST, str(free_port()))
+        delays = []
+        for _ in range(4):
+            self.assertFalse(pool.is_unreachable(address))
+            pool.fail(address)
+            delays.append(round(pool.get_retry_time(address) - time.monotonic()))
+        self.assertEqual(delays, [1, 2, 3, 3])
+        self.assertTrue(pool.is_unreachable(address))
+
+    def test_waits_before_connecting_again(self):
+        pool = ConnectionPool(backoff=60)
+        address = (LOCALHOST, str(free_port()))
+        pool.fail(address)
+        with self.assertRaises(ConnectionError):
+            pool.acquire(address)
+        self.assertEqual(pool.connects, 0)
+
+    def test_connection_closed_while_idle_is_not_reused(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(2)
+        self.addCleanup(listener.close)
+        address = (LOCALHOST, str(listener.getsockname()[1]))
+        pool = ConnectionPool(backoff=60)
+        self.addCleanup(pool.close)
+        client = pool.acquire(address)
+        pool.release(address, client)
+        accepted = listener.accept()[0]
+        accepted.close()
+        self.assertTrue(wait_until(lambda: select.select([client._socket], [], [], 0)[0]))
+
+        fresh = pool.acquire(address)
+        self.assertIsNot(fresh, client)
+        self.assertTrue(client.closed)
+        self.assertEqual((pool.connects, pool.reuses), (2, 0))
+        self.assertIsNone(pool.get_retry_time(address))
+
+
+class ReconnectTest(unittest.TestCase):
+    def test_packets_wait_for_the_node_to_come_up(self):
+        port = free_port()
+        sender = new_stream(self, reconnect_backoff=0)
+        node = sender.add_node((LOCALHOST, port))
+        self.assertIsNone(node.client)
+        sender.add_message_to_out_buff((LOCALHOST, port), message("m0"))
+        sender.send_out_buf_messages()
+        self.assertEqual(len(node.out_buff), 1)
+
+        receiver = new_stream(self, port)
+        sender.add_message_to_out_buff((LOCALHOST, port), message("m1"))
+        sender.send_out_buf_messages()
+        self.assertEqual([message_text(b) for b in receive(receiver, 2)], ["m0", "m1"])
+        self.assertEqual(sender.nodes, [node])
+
+    def test_unreachable_node_is_removed(self):
+        sender = new_stream(self, reconnect_attempts=3, reconnect_backoff=0)
+        address = (LOCALHOST, str(free_port()))
+        sender.add_node(address)
+        for _ in range(3):
+            sender.send_out_buf_messages()
+        self.assertEqual(sender.nodes, [])
+
+    def test_broken_connection_keeps_the_packets(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        address = (LOCALHOST, str(listener.getsockname()[1]))
+        sender = new_stream(self, reconnect_backoff=60)
+        node = sender.add_node(address)
+        listener.accept()[0].close()
+        listener.close()
+
+        sender.add_message_to_out_buff(address, message("m0"))
+        sender.send_out_buf_messages()
+        self.assertIsNone(node.client)
+        self.assertEqual([message_text(b) for b in node.out_buff], ["m0"])
+        self.assertEqual(sender.nodes, [node])
+
+    def test_connection_is_reused_after_the_node_is_removed(self):
+        receiver = new_stream(self)
+        sender = new_stream(self)
+        node = sender.add_node(receiver.get_server_address())
+        self.assertIs(sender.add_node(receiver.get_server_address()), node)
+        sender.remove_node(node)
+
+        sender.add_node(receiver.get_server_address())
+        sender.add_message_to_out_buff(receiver.get_server_address(), message("m0"))
+        sender.send_out_buf_messages()
+        self.assertEqual([message_text(b) for b in receive(receiver, 1)], ["m0"])
+        self.assertEqual((sender.connections.connects, sender.connections.reuses), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
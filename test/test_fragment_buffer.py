@@ -0,0 +1,58 @@
+import unittest
+
+from src.tools.FragmentBuffer import FragmentBuffer
+
+
+class FragmentBufferTest(unittest.TestCase):
+    def test_message_is_complete_with_its_last_fragment(self):
+        fragments = FragmentBuffer()
+        self.assertIsNone(fragments.add("a", 2, 3, b"c", now=0))
+        self.assertIsNone(fragments.add("a", 0, 3, b"a", now=0))
+        self.assertEqual(fragments.add("a", 1, 3, b"b", now=0), b"abc")
+        self.assertEqual(len(fragments), 0)
+        self.assertEqual(fragments.add("b", 0, 1, b"single", now=0), b"single")
+
+    def test_count_mismatch_is_ignored(self):
+        fragments = FragmentBuffer()
+        fragments.add("a", 0, 2, b"a", now=0)
+        self.assertIsNone(fragments.add("a", 1, 3, b"b", now=0))
+        self.assertEqual(fragments.add("a", 1, 2, b"b", now=0), b"ab")
+
+    def test_size_and_ttl(self):
+        fragments = FragmentBuffer(max_messages=2, ttl=10)
+        for i, message_id in enumerate("abc"):
+            fragments.add(message_id, 0, 2, b"x", now=i)
+        self.assertEqual(len(fragments), 2)
+        self.assertIsNone(fragments.add("a", 1, 2, b"x", now=3))
+        self.assertIsNone(fragments.add("b", 1, 2, b"x", now=12))
+        self.assertEqual(fragments.dropped_messages, 3)
+
+    def test_message_which_can_not_fit_is_refused(self):
+        fragments = FragmentBuffer(max_message_bytes=100)
+        self.assertIsNone(fragments.add("a", 0, 99999999, b"x" * 10, now=0))
+        self.assertEqual(len(fragments), 0)
+        self.assertEqual(fragments.dropped_messages, 1)
+
+        # Fragments bigger than the first one do not let a message grow beyond its limit either.
+        fragments.add("b", 0, 3, b"x" * 10, now=0)
+        self.assertIsNone(fragments.add("b", 1, 3, b"x" * 95, now=0))
+        self.assertEqual(len(fragments), 0)
+        self.assertEqual(fragments.total_bytes, 0)
+
+    def test_total_bytes_evict_the_oldest_messages(self):
+        fragments = FragmentBuffer(max_message_bytes=100, max_total_bytes=100)
+        for message_id in "abc":
+            fragments.add(message_id, 0, 2, b"x" * 40, now=0)
+        self.assertEqual(len(fragments), 2)
+        self.assertEqual(fragments.total_bytes, 80)
+        self.assertEqual(fragments.dropped_messages, 1)
+        # "a" starts again and takes the room of "b"; A fragment which completes its message always fits.
+        self.assertIsNone(fragments.add("a", 1, 2, b"x" * 40, now=0))
+        self.assertEqual(fragments.dropped_messages, 2)
+        self.assertEqual(fragments.add("c", 1, 2, b"y" * 40, now=0), b"x" * 40 + b"y" * 40)
+        self.assertEqual(fragments.total_bytes, 40)
+        self.assertEqual(len(fragments), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import socket
+import struct
+import unittest
+
+from helpers import LOCALHOST, free_port, new_stream, receive, wait_until
+from src.Packet import PacketFactory
+from src.tools.simpletcp.serversocket import ServerSocket
+
+ADDRESS = (LOCALHOST, "05335")
+
+
+def frame(text):
+    return bytes(PacketFactory.new_message_packet(text, ADDRESS).get_buf())
+
+
+def header(length):
+    return struct.pack('!hhlhhhhi', 1, 4, length, 127, 0, 0, 1, 5335)
+
+
+class GetFrameLengthTest(unittest.TestCase):
+    def test_incomplete_header(self):
+        packet = frame("hello")
+        for cut in range(20):
+            self.assertIsNone(PacketFactory.get_frame_length(packet[:cut]))
+
+    def test_length_of_the_first_frame(self):
+        packet = frame("hello")
+        self.assertEqual(PacketFactory.get_frame_length(packet), len(packet))
+        self.assertEqual(PacketFactory.get_frame_length(packet[:20]), len(packet))
+        self.assertEqual(PacketFactory.get_frame_length(packet + frame("more")), len(packet))
+
+    def test_negative_length(self):
+        with self.assertRaises(ValueError):
+            PacketFactory.get_frame_length(header(-1))
+
+    def test_length_above_the_maximum(self):
+        self.assertEqual(PacketFactory.get_frame_length(header(PacketFactory.MAX_PACKET_LENGTH)),
+                         20 + PacketFactory.MAX_PACKET_LENGTH)
+        with self.assertRaises(ValueError):
+            PacketFactory.get_frame_length(header(PacketFactory.MAX_PACKET_LENGTH + 1))
+
+
+class EmitFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.frames = []
+        self.server = ServerSocket("127.0.0.1", free_port(), lambda ip, queue, data: self.frames.append(data), 5,
+                                   2048, frame_length=PacketFactory.get_frame_length)
+        self.buffer = bytearray()
+
+    def tearDown(self):
+        self.server._socket.close()
+
+    def emit(self, data):
+        self.server._emit_frames("127.0.0.1", None, self.buffer, data)
+
+    def test_split_at_every_byte(self):
+        packet = frame("hello world")
+        for cut in range(1, len(packet)):
+            self.frames.clear()
+            self.emit(packet[:cut])
+            self.assertEqual(self.frames, [], cut)
+            self.emit(packet[cut:])
+            self.assertEqual(self.frames, [packet], cut)
+            self.assertEqual(self.buffer, b'')
+
+    def test_byte_by_byte(self):
+        packet = frame("hello")
+        for i in range(len(packet)):
+            self.emit(packet[i:i + 1])
+        self.assertEqual(self.frames, [packet])
+
+    def test_several_frames_in_one_recv(self):
+        packets = [frame("m%d" % i) for i in range(5)]
+        self.emit(b''.join(packets))
+        self.assertEqual(self.frames, packets)
+        self.assertEqual(self.buffer, b'')
+
+    def test_partial_body_followed_by_the_next_header(self):
+        first, second = frame("first message"), frame("second")
+        self.emit(first[:25])
+        self.assertEqual(self.frames, [])
+        self.emit(first[25:] + second[:20])
+        self.assertEqual(self.frames, [first])
+        self.emit(second[20:])
+        self.assertEqual(self.frames, [first, second])
+
+    def test_empty_body(self):
+        packet = header(0)
+        self.emit(packet + packet[:3])
+        self.assertEqual(self.frames, [packet])
+        self.assertEqual(self.buffer, packet[:3])
+
+    def test_negative_length_raises(self):
+        with self.assertRaises(ValueError):
+            self.emit(header(-5))
+        self.assertEqual(self.frames, [])
+
+    def test_length_above_the_maximum_raises_before_buffering_the_body(self):
+        with self.assertRaises(ValueError):
+            self.emit(header(PacketFactory.MAX_PACKET_LENGTH + 1) + b'x' * 100)
+        self.assertEqual(self.frames, [])
+
+
+class ServerFramingTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = new_stream(self)
+        self.client = None
+        # The server Thread of the Stream starts listening a moment after the Stream is made.
+        self.assertTrue(wait_until(self.connect))
+
+    def connect(self):
+        try:
+            self.client = socket.create_connection(("127.0.0.1", int(self.stream.get_server_address()[1])), timeout=5)
+        except ConnectionRefusedError:
+            return False
+        return True
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_split_and_coalesced_packets_are_reassembled(self):
+        packets = [frame("m%d" % i) for i in range(3)]
+        data = b''.join(packets)
+        self.client.sendall(data[:7])
+        self.client.sendall(data[7:30])
+        self.client.sendall(data[30:])
+        self.assertEqual(receive(self.stream, 3), packets)
+
+    def test_oversized_packet_closes_the_connection(self):
+        self.client.sendall(header(PacketFactory.MAX_PACKET_LENGTH + 1))
+        self.assertEqual(self.client.recv(16), b'')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import io
+import logging
+import unittest
+
+from helpers import LOCALHOST
+from src.Packet import PacketFactory
+from src.tools.Log import configure_logging, stop_logging
+
+
+class LogTest(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+
+    def tearDown(self):
+        stop_logging()
+
+    def test_nothing_is_logged_by_default(self):
+        self.assertFalse(logging.getLogger("src.Packet").isEnabledFor(logging.WARNING - 1))
+        configure_logging("DEBUG", self.output)
+        stop_logging()
+        self.assertFalse(logging.getLogger("src.Packet").isEnabledFor(logging.DEBUG))
+
+    def test_level_gates_the_records(self):
+        configure_logging("INFO", self.output, queued=False, fmt="%(levelname)s %(name)s %(message)s")
+        buffer = bytes(PacketFactory.new_message_packet("hello", (LOCALHOST, "05335")).get_buf())
+        batch = bytearray(PacketFactory.new_batch_buffer([buffer], (LOCALHOST, "05335")))
+        batch[4:8] = (len(batch) - 20 - 3).to_bytes(4, 'big')
+        PacketFactory.split_batch(PacketFactory.parse_buffer(bytes(batch)))
+        self.assertEqual(self.output.getvalue(), "WARNING src.Packet Truncated packet in a Batch packet.\n")
+
+    def test_queued_records_are_written_by_stop(self):
+        configure_logging("DEBUG", self.output, fmt="%(message)s")
+        PacketFactory.new_register_packet("REQ", (LOCALHOST, "05335"), address=(LOCALHOST, "05335"))
+        stop_logging()
+        self.assertEqual(self.output.getvalue(), "Creating register packet\nRequest register packet created; "
+                                                 "Address for packet is: ('127.000.000.001', '05335')\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
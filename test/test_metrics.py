@@ -0,0 +1,123 @@
+import contextlib
+import io
+import unittest
+import urllib.request
+
+from helpers import message, new_peer, new_stream
+from src.Packet import PacketFactory
+from src.Peer import Peer
+from src.tools.Metrics import Histogram, Metrics
+from src.tools.MetricsServer import MetricsServer
+from src.tools.Simulator import Simulator
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram((1, 2, 5))
+        self.assertIsNone(histogram.get_percentile(50))
+        for value in (0.5, 0.5, 1.5, 4, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.buckets, [2, 1, 1, 1])
+        self.assertEqual(histogram.get_percentile(40), 1)
+        self.assertEqual(histogram.get_percentile(60), 2)
+        self.assertEqual(histogram.get_percentile(100), float('inf'))
+        self.assertAlmostEqual(histogram.get_mean(), 3.3)
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counters_by_labels(self):
+        self.metrics.increment("packets_in", type="Message")
+        self.metrics.increment("packets_in", 2, type="Message")
+        self.metrics.increment("packets_in", type="Join")
+        self.assertEqual(self.metrics.get_counter("packets_in", type="Message"), 3)
+        self.assertEqual(self.metrics.get_counter("packets_in", type="Join"), 1)
+        self.assertEqual(self.metrics.get_counter("packets_in", type="Reunion"), 0)
+
+    def test_snapshot_is_a_copy(self):
+        self.metrics.observe("loop_seconds", 0.001)
+        snapshot = self.metrics.get_snapshot()
+        self.metrics.observe("loop_seconds", 0.001)
+        self.assertEqual(snapshot["histograms"][("loop_seconds", ())].count, 1)
+        self.assertEqual(self.metrics.get_histogram("loop_seconds").count, 2)
+
+    def test_collectors_set_gauges(self):
+        depths = [3]
+        self.metrics.add_collector(lambda metrics: metrics.set_gauge("queue_packets", depths[0], node="a"))
+        self.assertEqual(self.metrics.get_snapshot()["gauges"], {("queue_packets", (("node", "a"),)): 3})
+        depths[0] = 0
+        self.assertEqual(self.metrics.get_snapshot()["gauges"], {("queue_packets", (("node", "a"),)): 0})
+
+    def test_render_text(self):
+        self.metrics.increment("packets_in", type="Message")
+        self.metrics.set_gauge("nodes", 2)
+        self.metrics.observe("handle_packet_seconds", 0.00002, type="Message")
+        lines = self.metrics.render_text().splitlines()
+        self.assertIn("# TYPE peer_packets_in counter", lines)
+        self.assertIn('peer_packets_in{type="Message"} 1', lines)
+        self.assertIn("peer_nodes 2", lines)
+        self.assertIn('peer_handle_packet_seconds_bucket{type="Message",le="1e-05"} 0', lines)
+        self.assertIn('peer_handle_packet_seconds_bucket{type="Message",le="2.5e-05"} 1', lines)
+        self.assertIn('peer_handle_packet_seconds_bucket{type="Message",le="+Inf"} 1', lines)
+        self.assertIn('peer_handle_packet_seconds_count{type="Message"} 1', lines)
+
+    def test_server(self):
+        self.metrics.increment("packets_in", type="Message")
+        server = MetricsServer(self.metrics, 0)
+        try:
+            url = "http://127.0.0.1:%d/metrics" % server.get_port()
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.read().decode('UTF-8'), self.metrics.render_text())
+        finally:
+            server.close()
+
+
+class PeerMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+
+    def test_packets_and_queues_are_counted(self):
+        root = new_stream(self)
+        neighbour = new_stream(self)
+        peer = new_peer(self, root_address=root.get_server_address())
+        peer.parent = peer.stream.add_node(neighbour.get_server_address())
+        peer.neighbours.append(neighbour.get_server_address())
+        relay = PacketFactory.new_relay_buffer(PacketFactory.parse_buffer(message("hi")),
+                                               neighbour.get_server_address())
+        peer.handle_packet(PacketFactory.parse_buffer(relay))
+        peer.send_message("hello")
+
+        metrics = peer.metrics
+        self.assertEqual(metrics.get_counter("packets_in", type="Message"), 1)
+        self.assertEqual(metrics.get_counter("bytes_in", type="Message"), len(relay))
+        self.assertEqual(metrics.get_histogram("handle_packet_seconds", type="Message").count, 1)
+        self.assertEqual(metrics.get_counter("packets_out", type="Message"), 1)
+        gauges = metrics.get_snapshot()["gauges"]
+        node = "%s:%s" % neighbour.get_server_address()
+        self.assertEqual(gauges[("queue_packets", (("node", node), ("kind", "neighbour")))], 1)
+
+    def test_reunion_and_advertise_times(self):
+        simulator = Simulator(link_delay=0.01)
+        options = {"transport": simulator.make_stream, "clock": simulator.clock, "reunion_thread": False}
+        root = Peer("000.000.000.001", 1, is_root=True, **options)
+        peer = Peer("000.000.000.002", 1, root_address=root.stream.get_server_address(), **options)
+        simulator.add_peer(root)
+        simulator.add_peer(peer)
+        peer.add_command("Register")
+        peer.add_command("Advertise")
+        simulator.run_for(10)
+
+        self.assertAlmostEqual(peer.metrics.get_histogram("advertise_response_seconds").sum, 0.02)
+        self.assertAlmostEqual(peer.metrics.get_histogram("reunion_rtt_seconds").get_mean(), 0.02)
+        self.assertGreater(peer.metrics.get_histogram("loop_seconds").count, 0)
+        self.assertEqual(root.metrics.get_snapshot()["gauges"][("live_graph_nodes", ())], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
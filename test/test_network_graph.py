@@ -0,0 +1,360 @@
+import random
+import unittest
+
+from src.tools.Clock import VirtualClock
+from src.tools.NetworkGraph import GraphNode, NetworkGraph
+
+ROOT = ("000.000.000.000", "00001")
+
+
+def address(i):
+    return "010.000.%03d.%03d" % (i // 250, i % 250), "00001"
+
+
+def join(graph, node_address, capacity=None):
+    """
+    Place a node like the root does: find_live_node, add_node and a Reunion Hello which turns it on.
+
+    :return: The parent of the node.
+    :rtype: GraphNode
+    """
+    parent = graph.find_live_node(node_address)
+    graph.add_node(node_address[0], node_address[1], parent.address, capacity=capacity)
+    graph.turn_on_node(node_address)
+    return parent
+
+
+class AddressIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = NetworkGraph(GraphNode(ROOT))
+
+    def test_find_node_normalises_the_address(self):
+        self.graph.add_node("10.0.0.1", 5335, ROOT)
+        node = self.graph.find_node("010.000.000.001", "05335")
+        self.assertIsNotNone(node)
+        self.assertIs(self.graph.find_node("10.0.0.1", "5335"), node)
+        self.assertIs(self.graph.find_node("10.0.0.1", 5335), node)
+        self.assertIs(self.graph.find_node(*ROOT), self.graph.root)
+
+    def test_unknown_address(self):
+        self.assertIsNone(self.graph.find_node("10.0.0.1", "05335"))
+
+    def test_add_node_twice_keeps_one_node(self):
+        self.graph.add_node("010.000.000.001", "05335", ROOT)
+        node = self.graph.find_node("010.000.000.001", "05335")
+        self.graph.add_node("10.0.0.1", "5335", ROOT)
+        self.assertIs(self.graph.find_node("010.000.000.001", "05335"), node)
+        self.assertEqual(self.graph.root.children, [node])
+
+    def test_removed_node_is_not_found(self):
+        join(self.graph, address(1))
+        self.graph.remove_node(address(1))
+        self.assertIsNone(self.graph.find_node(*address(1)))
+        self.assertEqual(self.graph.root.children, [])
+        self.graph.remove_node(address(1))
+
+
+def reference_depth(graph, sender):
+    """
+    Depth of the best neighbour for sender by a BFS over the up nodes, like find_live_node worked before it had
+    an index; A node is up if it is alive or has a reserved slot.
+
+    :return: Depth of the shallowest up node with a free child slot outside the sub-tree of sender; None if there is
+             no such node.
+    :rtype: int
+    """
+    sender_node = graph.find_node(*sender)
+    excluded_parent = sender_node.parent if sender_node is not None else None
+    queue = [graph.root]
+    for node in queue:
+        if node is sender_node:
+            continue
+        up_children = [child for child in node.children if is_up(child)]
+        if len(up_children) < graph.get_capacity(node) and node is not excluded_parent:
+            return node.depth
+        queue.extend(up_children)
+    return None
+
+
+def is_up(node):
+    return node.alive or node.reserved_until is not None
+
+
+class FreeSlotIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = NetworkGraph(GraphNode(ROOT))
+
+    def check_index(self):
+        """
+        Every node in the free slot index is up, hangs below the root through up nodes at its indexed depth and has a
+        free slot; Every such node is in the index.
+        """
+        indexed = set()
+        for depth, slots in self.graph._free_slots.items():
+            for node in slots:
+                self.assertEqual(node.depth, depth)
+                self.assertLess(node.number_of_live_children + node.number_of_reserved_children,
+                                self.graph.get_capacity(node))
+                ancestor = node
+                while ancestor.parent is not None:
+                    self.assertTrue(is_up(ancestor))
+                    self.assertEqual(ancestor.depth, ancestor.parent.depth + 1)
+                    ancestor = ancestor.parent
+                self.assertIs(ancestor, self.graph.root)
+                indexed.add(node)
+        self.assertEqual(self.graph._free_depths, sorted(self.graph._free_slots))
+
+        queue = [self.graph.root]
+        for node in queue:
+            up_children = [child for child in node.children if is_up(child)]
+            self.assertEqual(node.number_of_live_children, sum(child.alive for child in node.children))
+            self.assertEqual(node.number_of_reserved_children, len(up_children) - node.number_of_live_children)
+            if len(up_children) < self.graph.get_capacity(node):
+                self.assertIn(node, indexed)
+            queue.extend(up_children)
+
+    def test_tree_is_filled_level_by_level(self):
+        parents = [join(self.graph, address(i)) for i in range(6)]
+        self.assertEqual(parents[:2], [self.graph.root] * 2)
+        self.assertEqual([p.depth for p in parents[2:]], [1, 1, 1, 1])
+        self.assertEqual(self.graph.find_live_node(address(6)).depth, 2)
+
+    def test_dead_node_and_its_sub_tree_are_skipped(self):
+        for i in range(4):
+            join(self.graph, address(i))
+        self.graph.turn_off_node(address(0))
+        for i in range(10, 13):
+            node = self.graph.find_live_node(address(i))
+            while node is not None:
+                self.assertTrue(node.alive)
+                node = node.parent
+            join(self.graph, address(i))
+
+    def test_sender_sub_tree_is_skipped(self):
+        for i in range(6):
+            join(self.graph, address(i))
+        sender = self.graph.find_node(*address(0))
+        for i in range(20, 25):
+            node = self.graph.find_live_node(sender.address)
+            while node is not None:
+                self.assertIsNot(node, sender)
+                node = node.parent
+            join(self.graph, address(i))
+
+    def test_capacity_of_a_node_overrides_max_children(self):
+        join(self.graph, address(0), capacity=3)
+        join(self.graph, address(1), capacity=0)
+        parents = [join(self.graph, address(i)) for i in range(2, 5)]
+        self.assertEqual([p.address for p in parents], [address(0)] * 3)
+        self.assertEqual(self.graph.find_live_node(address(5)).depth, 2)
+
+    def test_index_follows_turn_on_and_off(self):
+        join(self.graph, address(0))
+        join(self.graph, address(1))
+        self.assertEqual(self.graph.find_live_node(address(2)).depth, 1)
+        self.graph.turn_off_node(address(1))
+        self.assertIs(self.graph.find_live_node(address(2)), self.graph.root)
+        self.graph.turn_on_node(address(1))
+        self.assertEqual(self.graph.find_live_node(address(2)).depth, 1)
+
+    def test_dead_sub_tree_leaves_the_index_until_revived(self):
+        for i in range(14):
+            join(self.graph, address(i))
+        parent = self.graph.find_node(*address(0))
+        subtree = [parent]
+        for node in subtree:
+            subtree.extend(node.children)
+
+        self.graph.turn_off_node(parent.address)
+        indexed = [node for slots in self.graph._free_slots.values() for node in slots]
+        self.assertFalse(set(subtree) & set(indexed))
+        self.check_index()
+
+        self.graph.turn_on_node(parent.address)
+        indexed = [node for slots in self.graph._free_slots.values() for node in slots]
+        self.assertTrue(set(subtree[3:]) <= set(indexed))
+        self.check_index()
+
+        self.graph.turn_off_subtree(parent.address)
+        indexed = [node for slots in self.graph._free_slots.values() for node in slots]
+        self.assertFalse(set(subtree) & set(indexed))
+        self.check_index()
+
+    def test_hello_of_a_child_of_an_expired_node(self):
+        for i in range(4):
+            join(self.graph, address(i))
+        parent = self.graph.find_node(*address(0))
+        orphan = self.graph.find_node(*address(2))
+        self.assertIs(orphan.parent, parent)
+
+        # The root expires the parent and turns off its sub-tree, then the orphan says Reunion Hello before it
+        # advertises again.
+        self.graph.turn_off_node(orphan.address)
+        self.graph.remove_node(parent.address)
+        live_children = parent.number_of_live_children
+        self.graph.turn_on_node(orphan.address)
+        self.assertIsNone(orphan.parent)
+        self.assertIsNone(orphan.depth)
+        self.assertEqual(parent.number_of_live_children, live_children)
+        self.check_index()
+        self.assertIs(self.graph.find_live_node(address(10)), self.graph.root)
+
+        # Once it advertises again it is placed in the tree like a new node.
+        join(self.graph, orphan.address)
+        self.assertIs(orphan.parent, self.graph.root)
+        self.assertEqual(orphan.depth, 1)
+        self.check_index()
+
+    def test_matches_a_bfs_on_random_operations(self):
+        rng = random.Random(7)
+        known = []
+        for step in range(2000):
+            operation = rng.random()
+            if operation < 0.5 or not known:
+                node_address = address(step)
+                self.assertEqual(self.graph.find_live_node(node_address).depth,
+                                 reference_depth(self.graph, node_address))
+                join(self.graph, node_address, capacity=rng.choice([None, None, 1, 3]))
+                known.append(node_address)
+            elif operation < 0.7:
+                self.graph.turn_off_node(rng.choice(known))
+            elif operation < 0.85:
+                self.graph.turn_on_node(rng.choice(known))
+            elif operation < 0.95:
+                node_address = rng.choice(known)
+                node = self.graph.find_live_node(node_address)
+                expected = reference_depth(self.graph, node_address)
+                if expected is not None:
+                    self.assertEqual(node.depth, expected)
+                self.graph.add_node(node_address[0], node_address[1], node.address)
+            else:
+                node_address = known.pop(rng.randrange(len(known)))
+                self.graph.remove_node(node_address)
+            self.check_index()
+
+
+
+class ReservationTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock(100)
+        self.graph = NetworkGraph(GraphNode(ROOT), clock=self.clock, reservation_ttl=10)
+
+    def advertise(self, node_address):
+        """
+        Place a node like the Advertise handler of the root, before its Reunion Hello.
+
+        :return: The parent of the node.
+        :rtype: GraphNode
+        """
+        parent = self.graph.find_live_node(node_address)
+        self.graph.add_node(node_address[0], node_address[1], parent.address)
+        return parent
+
+    def test_burst_of_advertises_keeps_the_fan_out(self):
+        parents = [self.advertise(address(i)) for i in range(14)]
+        self.assertEqual(len(self.graph.root.children), 2)
+        self.assertEqual([p.depth for p in parents], [0] * 2 + [1] * 4 + [2] * 8)
+        self.assertEqual(self.graph.root.number_of_reserved_children, 2)
+
+        for i in range(14):
+            self.graph.turn_on_node(address(i))
+        self.assertEqual(self.graph.root.number_of_reserved_children, 0)
+        self.assertEqual(self.graph.root.number_of_live_children, 2)
+        self.assertEqual(self.graph.find_live_node(address(20)).depth, 3)
+
+    def test_expired_reservation_frees_the_slot(self):
+        self.advertise(address(0))
+        self.advertise(address(1))
+        self.graph.turn_on_node(address(1))
+        self.assertEqual(self.advertise(address(2)).address, address(0))
+
+        self.clock.advance_to(110)
+        parent = self.advertise(address(3))
+        self.assertIs(parent, self.graph.root)
+        self.assertEqual(self.graph.root.number_of_reserved_children, 1)
+        self.assertIsNone(self.graph.find_node(*address(0)).reserved_until)
+
+        # A late Hello still turns the node on, and it takes a slot like any other live node.
+        self.graph.turn_on_node(address(0))
+        self.assertEqual((self.graph.root.number_of_live_children, self.graph.root.number_of_reserved_children),
+                         (2, 1))
+        self.assertNotIn(self.graph.root, self.graph._free_slots.get(0, {}))
+
+    def test_removed_reserved_node_frees_the_slot(self):
+        self.advertise(address(0))
+        self.advertise(address(1))
+        self.graph.remove_node(address(0))
+        self.assertEqual(self.graph.root.number_of_reserved_children, 1)
+        self.assertIs(self.advertise(address(2)), self.graph.root)
+
+
+class ReunionDeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = NetworkGraph(GraphNode(ROOT))
+
+    def test_nodes_expire_in_time_order_and_once(self):
+        for i in range(3):
+            join(self.graph, address(i))
+            self.graph.update_reunion_time(address(i), i)
+        self.assertEqual(self.graph.pop_expired_nodes(0), [])
+        self.assertEqual([n.address for n in self.graph.pop_expired_nodes(1.5)], [address(0), address(1)])
+        self.assertEqual(self.graph.pop_expired_nodes(1.5), [])
+        self.assertEqual([n.address for n in self.graph.pop_expired_nodes(10)], [address(2)])
+
+    def test_reunion_hello_postpones_the_expiry(self):
+        join(self.graph, address(0))
+        join(self.graph, address(1))
+        self.graph.update_reunion_time(address(0), 0)
+        self.graph.update_reunion_time(address(1), 0)
+        self.graph.update_reunion_time(address(0), 5)
+        self.assertEqual([n.address for n in self.graph.pop_expired_nodes(3)], [address(1)])
+        self.assertEqual([n.address for n in self.graph.pop_expired_nodes(6)], [address(0)])
+
+    def test_removed_node_does_not_expire(self):
+        join(self.graph, address(0))
+        self.graph.update_reunion_time(address(0), 0)
+        self.graph.remove_node(address(0))
+        self.assertEqual(self.graph.pop_expired_nodes(10), [])
+
+    def test_unknown_node_is_ignored(self):
+        self.graph.update_reunion_time(address(0), 5)
+        self.assertEqual(self.graph.pop_expired_nodes(10), [])
+
+
+class SubtreeTest(unittest.TestCase):
+    def setUp(self):
+        self.graph = NetworkGraph(GraphNode(ROOT))
+        for i in range(7):
+            join(self.graph, address(i))
+
+    def subtree(self, node_address):
+        nodes = [self.graph.find_node(*node_address)]
+        for node in nodes:
+            nodes.extend(node.children)
+        return nodes
+
+    def test_turn_off_subtree(self):
+        subtree = self.subtree(address(0))
+        self.assertEqual(len(subtree), 4)
+        self.graph.turn_off_subtree(address(0))
+        self.assertTrue(all(not n.alive for n in subtree))
+        self.assertTrue(all(n.alive for n in self.graph.nodes if n not in subtree))
+        self.assertEqual(self.graph.root.number_of_live_children, 1)
+        for i in range(20, 23):
+            self.assertNotIn(join(self.graph, address(i)), subtree)
+
+    def test_turn_off_unknown_subtree(self):
+        self.graph.turn_off_subtree(address(99))
+        self.assertTrue(all(n.alive for n in self.graph.nodes))
+
+    def test_nodes_is_keyed_by_address(self):
+        self.assertEqual(len(self.graph.nodes), 8)
+        leaf = self.subtree(address(0))[-1]
+        self.graph.remove_node(leaf.address)
+        self.assertEqual(len(self.graph.nodes), 7)
+        self.assertNotIn(leaf, self.graph.nodes)
+        self.assertIn(self.graph.root, self.graph.nodes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from helpers import LOCALHOST, free_port, message, message_text, new_pair, new_stream, receive
+
+
+def add_messages(sender, receiver, count):
+    for i in range(count):
+        sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i))
+
+
+def bodies(buffers):
+    return [message_text(b) for b in buffers]
+
+
+class BoundedQueueTest(unittest.TestCase):
+    def test_unbounded_by_default(self):
+        receiver, sender, node = new_pair(self)
+        add_messages(sender, receiver, 100)
+        self.assertEqual(len(node.out_buff), 100)
+        self.assertEqual(sender.get_dropped(), (0, 0))
+
+    def test_drop_oldest(self):
+        receiver, sender, node = new_pair(self, max_queue_packets=3, queue_policy="drop-oldest")
+        add_messages(sender, receiver, 5)
+        self.assertEqual(bodies(node.out_buff), ["m2", "m3", "m4"])
+        self.assertEqual(node.dropped_packets, 2)
+        self.assertEqual(node.out_buff_bytes, sum(len(b) for b in node.out_buff))
+
+    def test_drop_newest(self):
+        receiver, sender, node = new_pair(self, max_queue_packets=3, queue_policy="drop-newest")
+        add_messages(sender, receiver, 5)
+        self.assertEqual(bodies(node.out_buff), ["m0", "m1", "m2"])
+        self.assertEqual(sender.get_dropped(), (2, 2 * len(message("m3"))))
+
+    def test_byte_limit(self):
+        size = len(message("m0"))
+        receiver, sender, node = new_pair(self, max_queue_bytes=2 * size + 1, queue_policy="drop-newest")
+        add_messages(sender, receiver, 4)
+        self.assertEqual(len(node.out_buff), 2)
+        self.assertEqual(node.dropped_bytes, 2 * size)
+
+    def test_block_sends_before_adding(self):
+        receiver, sender, node = new_pair(self, max_queue_packets=3, queue_policy="block", pipelined=True)
+        add_messages(sender, receiver, 5)
+        self.assertEqual(bodies(node.out_buff), ["m3", "m4"])
+        sender.send_out_buf_messages()
+        self.assertEqual(bodies(receive(receiver, 5)), ["m%d" % i for i in range(5)])
+        self.assertEqual(node.dropped_packets, 0)
+
+    def test_block_drops_the_new_packet_while_disconnected(self):
+        sender = new_stream(self, max_queue_packets=3, queue_policy="block", reconnect_backoff=60)
+        address = (LOCALHOST, "%05d" % free_port())
+        sender.add_node(address)
+        node = sender.get_node_by_server(*address)
+        for i in range(5):
+            sender.add_message_to_out_buff(address, message("m%d" % i))
+        self.assertEqual(bodies(node.out_buff), ["m0", "m1", "m2"])
+        self.assertEqual(sender.get_dropped(), (2, 2 * len(message("m3"))))
+
+    def test_requeued_packets_keep_the_limit(self):
+        receiver, sender, node = new_pair(self, max_queue_packets=3, queue_policy="block")
+        add_messages(sender, receiver, 2)
+        node._requeue([message("r0"), message("r1")])
+        self.assertEqual(bodies(node.out_buff), ["r0", "r1", "m0"])
+        self.assertEqual(node.dropped_packets, 1)
+        self.assertEqual(node.out_buff_bytes, sum(len(b) for b in node.out_buff))
+
+    def test_disconnect_removes_the_node(self):
+        receiver, sender, node = new_pair(self, max_queue_packets=3, queue_policy="disconnect")
+        add_messages(sender, receiver, 5)
+        self.assertEqual(len(node.out_buff), 0)
+        sender.send_out_buf_messages()
+        self.assertEqual(sender.nodes, [])
+        self.assertEqual(sender.get_dropped()[0], 5)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(Exception):
+            new_stream(self, queue_policy="drop-everything")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import os
+import unittest
+
+from src.Packet import BinaryPacket, Packet, PacketFactory
+from src.tools.Codec import get_codec
+
+ADDRESS = ("192.168.001.002", "05335")
+
+
+class BinaryPacketTest(unittest.TestCase):
+    def test_from_fields_matches_the_string_packet(self):
+        packet = BinaryPacket.from_fields(1, 4, ADDRESS, "héllo")
+        parsed = PacketFactory.parse_buffer(bytes(packet.get_buf()), lazy=False)
+        self.assertIsInstance(parsed, Packet)
+        for getter in ("get_version", "get_type", "get_length", "get_body", "get_source_server_address"):
+            self.assertEqual(getattr(packet, getter)(), getattr(parsed, getter)(), getter)
+        self.assertEqual(bytes(parsed.get_buf()), bytes(packet.get_buf()))
+
+    def test_fields(self):
+        packet = BinaryPacket.from_fields(1, 3, ADDRESS, "body")
+        self.assertEqual(packet.get_version(), 1)
+        self.assertEqual(packet.get_type(), 3)
+        self.assertEqual(packet.get_length(), 4)
+        self.assertEqual(packet.get_source_server_ip(), "192.168.001.002")
+        self.assertEqual(packet.get_source_server_port(), "05335")
+        self.assertEqual(len(packet.get_header()), 20)
+
+    def test_get_buf_does_not_copy(self):
+        buf = bytearray(BinaryPacket.from_fields(1, 4, ADDRESS, "x").get_buf())
+        packet = PacketFactory.parse_buffer(buf)
+        self.assertIs(packet.get_buf(), buf)
+
+    def test_fields_are_read_lazily(self):
+        buf = bytearray(BinaryPacket.from_fields(1, 4, ADDRESS, "one").get_buf())
+        packet = PacketFactory.parse_buffer(buf)
+        buf[2:4] = b'\x00\x02'
+        self.assertEqual(packet.get_type(), 2)
+
+    def test_body_is_decoded_once(self):
+        buf = bytearray(BinaryPacket.from_fields(1, 4, ADDRESS, "one").get_buf())
+        packet = PacketFactory.parse_buffer(buf)
+        self.assertEqual(packet.get_body(), "one")
+        buf[20:] = b"two"
+        self.assertEqual(packet.get_body(), "one")
+
+    def test_relay_buffer_changes_only_the_source(self):
+        packet = PacketFactory.new_message_packet("hello", ADDRESS)
+        relayed = PacketFactory.parse_buffer(PacketFactory.new_relay_buffer(packet, ("010.000.000.001", "06000")))
+        self.assertEqual(relayed.get_source_server_address(), ("010.000.000.001", "06000"))
+        self.assertEqual(relayed.get_type(), 4)
+        self.assertEqual(relayed.get_body(), packet.get_body())
+
+
+class MessagePacketTest(unittest.TestCase):
+    def test_message_id(self):
+        packet = PacketFactory.new_message_packet("hello", ADDRESS, message_id="0123456789abcdef")
+        parsed = PacketFactory.parse_buffer(bytes(packet.get_buf()))
+        self.assertEqual(PacketFactory.get_message_id(parsed), "0123456789abcdef")
+        self.assertEqual(PacketFactory.parse_message(parsed), ("0123456789abcdef", "hello"))
+        self.assertEqual(PacketFactory.get_message_codec(parsed), "none")
+        self.assertEqual(parsed.get_length(), 16 + 4 + 5)
+
+    def test_new_ids_differ(self):
+        ids = {PacketFactory.get_message_id(PacketFactory.new_message_packet("x", ADDRESS)) for _ in range(100)}
+        self.assertEqual(len(ids), 100)
+        self.assertTrue(all(len(i) == PacketFactory.MESSAGE_ID_LENGTH for i in ids))
+
+    def test_compressed_message(self):
+        text = "Hello World! " * 100
+        packet = PacketFactory.new_message_packet(text, ADDRESS, codec="zlib")
+        parsed = PacketFactory.parse_buffer(bytes(packet.get_buf()))
+        self.assertEqual(PacketFactory.get_message_codec(parsed), "zlib")
+        self.assertLess(parsed.get_length(), len(text))
+        self.assertEqual(PacketFactory.parse_message(parsed)[1], text)
+
+        relayed = PacketFactory.parse_buffer(PacketFactory.new_uncompressed_relay_buffer(parsed, ADDRESS))
+        self.assertEqual(PacketFactory.get_message_codec(relayed), "none")
+        self.assertEqual(PacketFactory.parse_message(relayed), PacketFactory.parse_message(parsed))
+
+    def test_decompression_bomb_is_rejected(self):
+        text = "a" * (PacketFactory.MAX_PACKET_LENGTH + 1)
+        packet = PacketFactory.parse_buffer(bytes(PacketFactory.new_message_packet(text, ADDRESS, codec="zlib")
+                                                  .get_buf()))
+        self.assertLess(packet.get_length(), 64 * 1024)
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_message(packet)
+        with self.assertRaises(ValueError):
+            PacketFactory.new_uncompressed_relay_buffer(packet, ADDRESS)
+
+        codec = get_codec("zlib")
+        self.assertEqual(codec.decompress(codec.compress(b"a" * 100), 100), b"a" * 100)
+        with self.assertRaises(ValueError):
+            codec.decompress(codec.compress(b"a" * 101), 100)
+        with self.assertRaises(ValueError):
+            codec.decompress(codec.compress(b"a" * 100)[:-4], 100)
+
+    def test_short_or_incompressible_messages_are_not_compressed(self):
+        for text, threshold in (("Hello World! " * 100, 10000), ("x", 0)):
+            packet = PacketFactory.new_message_packet(text, ADDRESS, codec="zlib", compression_threshold=threshold)
+            self.assertEqual(PacketFactory.get_message_codec(packet), "none")
+        with self.assertRaises(Exception):
+            PacketFactory.new_message_packet("x", ADDRESS, codec="nope")
+
+    def test_unknown_codec(self):
+        packet = BinaryPacket.from_fields(1, 4, ADDRESS, b"0123456789abcdefabcd\x00")
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_message(packet)
+
+    def test_binary_and_non_ascii_messages(self):
+        for message in (bytes(range(256)), "héllo wörld €".encode("UTF-8")):
+            packet = PacketFactory.parse_buffer(bytes(PacketFactory.new_message_packet(message, ADDRESS).get_buf()))
+            self.assertEqual(packet.get_length(), 16 + 4 + len(message))
+            self.assertEqual(PacketFactory.parse_message_data(packet)[1], message)
+        packet = PacketFactory.new_message_packet("héllo", ADDRESS)
+        self.assertEqual(PacketFactory.parse_message(packet)[1], "héllo")
+
+    def test_string_packet_length_is_in_bytes(self):
+        packet = Packet("1" + "04" + "00000005" + ADDRESS[0] + ADDRESS[1] + "héllo")
+        buf = packet.get_buf()
+        self.assertEqual(PacketFactory.get_frame_length(buf), len(buf))
+        self.assertEqual(PacketFactory.parse_buffer(bytes(buf), lazy=False).get_body(), "héllo")
+
+
+class FragmentPacketTest(unittest.TestCase):
+    def test_fragments(self):
+        message = os.urandom(1000)
+        packets = PacketFactory.new_fragment_packets(message, ADDRESS, message_id="0123456789abcdef", fragment_size=300)
+        self.assertEqual([p.get_type() for p in packets], [7] * 4)
+        fields = [PacketFactory.parse_fragment(PacketFactory.parse_buffer(bytes(p.get_buf()))) for p in packets]
+        self.assertEqual([f[0:3] for f in fields], [("0123456789abcdef", i, 4) for i in range(4)])
+        self.assertEqual(b"".join(f[3] for f in fields), message)
+        self.assertEqual(len({PacketFactory.get_fragment_key(p) for p in packets}), 4)
+
+    def test_compressed_fragments(self):
+        message = b"Hello World! " * 100
+        packets = PacketFactory.new_fragment_packets(message, ADDRESS, codec="zlib", fragment_size=500)
+        self.assertTrue(all(PacketFactory.get_message_codec(p) == "zlib" for p in packets))
+        relayed = [PacketFactory.parse_buffer(PacketFactory.new_uncompressed_relay_buffer(p, ADDRESS)) for p in packets]
+        self.assertEqual([PacketFactory.get_message_codec(p) for p in relayed], ["none"] * 3)
+        self.assertEqual([PacketFactory.parse_fragment(p) for p in relayed],
+                         [PacketFactory.parse_fragment(p) for p in packets])
+
+    def test_irregular_fields(self):
+        packet = BinaryPacket.from_fields(1, 7, ADDRESS, b"0123456789abcdefnone0000000400000004x")
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_fragment(packet)
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_fragment(BinaryPacket.from_fields(1, 7, ADDRESS, b"0123456789abcdefnone0000"))
+
+
+class JoinPacketTest(unittest.TestCase):
+    def test_codecs(self):
+        self.assertEqual(PacketFactory.parse_join_codecs(PacketFactory.new_join_packet(ADDRESS).get_body()), [])
+        packet = PacketFactory.new_join_packet(ADDRESS, codecs=["zlib", "abcd"], type="JACK")
+        self.assertEqual(packet.get_body()[0:4], "JACK")
+        self.assertEqual(PacketFactory.parse_join_codecs(packet.get_body()), ["zlib", "abcd"])
+
+
+class BatchPacketTest(unittest.TestCase):
+    def test_split_returns_the_packets(self):
+        buffers = [bytes(PacketFactory.new_message_packet("m%d" % i, ADDRESS).get_buf()) for i in range(3)]
+        batch = PacketFactory.parse_buffer(PacketFactory.new_batch_buffer(buffers, ADDRESS))
+        self.assertEqual(batch.get_type(), 6)
+        self.assertEqual(batch.get_length(), sum(len(b) for b in buffers))
+        self.assertEqual(PacketFactory.split_batch(batch), buffers)
+
+    def test_truncated_packet_is_left_out(self):
+        buffers = [bytes(PacketFactory.new_message_packet("m%d" % i, ADDRESS).get_buf()) for i in range(2)]
+        batch = bytearray(PacketFactory.new_batch_buffer(buffers, ADDRESS))
+        batch[4:8] = (len(batch) - 20 - 3).to_bytes(4, 'big')
+        self.assertEqual(PacketFactory.split_batch(PacketFactory.parse_buffer(bytes(batch))), buffers[:1])
+
+    def test_unpack_batches_keeps_the_order(self):
+        buffers = [bytes(PacketFactory.new_message_packet("m%d" % i, ADDRESS).get_buf()) for i in range(4)]
+        arrived = [buffers[0], PacketFactory.new_batch_buffer(buffers[1:3], ADDRESS), buffers[3]]
+        self.assertEqual(PacketFactory.unpack_batches(arrived), buffers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+
+from helpers import new_peer
+from src.Packet import BinaryPacket, PacketFactory
+from src.tools.PacketWorkerPool import PacketWorkerPool
+
+ROOT = ("255.255.255.254", "05335")
+CHILD = ("010.000.000.001", "05335")
+
+
+class PacketWorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = PacketWorkerPool(2, ROOT)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results(self):
+        hello = bytes(PacketFactory.new_reunion_packet("REQ", CHILD, [CHILD]).get_buf())
+        message = bytes(PacketFactory.new_message_packet("hello", CHILD).get_buf())
+        results = self.pool.process([hello, message])
+        self.assertEqual(len(results), 2)
+        reunion = next(r for r in results if r[0] == PacketWorkerPool.REUNION)
+        self.assertEqual(reunion[1], [CHILD])
+        self.assertEqual(reunion[2], CHILD)
+        self.assertEqual(PacketFactory.parse_buffer(reunion[3]).get_body()[0:3], "RES")
+        self.assertIn((PacketWorkerPool.PACKET, message), results)
+
+    def test_corrupt_packet_does_not_kill_the_worker(self):
+        hello = bytearray(PacketFactory.new_reunion_packet("REQ", CHILD, [CHILD]).get_buf())
+        corrupt = bytes(hello[:20] + b'\xff' * (len(hello) - 20))
+        self.assertEqual(self.pool.process([corrupt]), [(PacketWorkerPool.PACKET, corrupt)])
+        results = self.pool.process([bytes(hello)])
+        self.assertEqual(results[0][:3], (PacketWorkerPool.REUNION, [CHILD], CHILD))
+        self.assertTrue(self.pool.is_alive())
+
+    def test_dead_worker_is_started_again(self):
+        hello = bytes(PacketFactory.new_reunion_packet("REQ", CHILD, [CHILD]).get_buf())
+        for process in self.pool._processes:
+            process.kill()
+            process.join()
+        self.assertEqual(self.pool.process([hello]), [(PacketWorkerPool.PACKET, hello)])
+        self.assertEqual(self.pool.restarts, 1)
+        self.assertEqual(self.pool.process([hello])[0][:3], (PacketWorkerPool.REUNION, [CHILD], CHILD))
+
+    def test_only_hellos_are_worker_packets(self):
+        hello = bytes(PacketFactory.new_reunion_packet("REQ", CHILD, [CHILD]).get_buf())
+        aggregated = bytes(PacketFactory.new_reunion_packet("AGG", CHILD, [CHILD]).get_buf())
+        hello_back = bytes(PacketFactory.new_reunion_packet("RES", ROOT, [CHILD]).get_buf())
+        register = bytes(PacketFactory.new_register_packet("REQ", CHILD, CHILD).get_buf())
+        self.assertEqual([PacketWorkerPool.is_worker_packet(b) for b in (hello, aggregated, hello_back, register)],
+                         [True, True, False, False])
+        self.assertFalse(PacketWorkerPool.is_worker_packet(hello[:21]))
+
+    def test_close_stops_the_workers(self):
+        self.assertTrue(self.pool.is_alive())
+        self.pool.close()
+        self.assertFalse(self.pool.is_alive())
+        self.pool.close()
+
+
+class ShardedPeerTest(unittest.TestCase):
+    def setUp(self):
+        self.peer = new_peer(self, is_root=True, root_workers=1)
+
+    def test_malformed_reunion_is_dropped(self):
+        not_utf8 = bytes(BinaryPacket.from_fields(1, 5, CHILD, "REQ01" + CHILD[0] + CHILD[1]).get_buf())
+        not_utf8 = not_utf8[:25] + b'\xff' * (len(not_utf8) - 25)
+        bad_count = bytes(BinaryPacket.from_fields(1, 5, CHILD, "REQxx" + CHILD[0] + CHILD[1]).get_buf())
+        register = bytes(PacketFactory.new_register_packet("REQ", CHILD, CHILD).get_buf())
+
+        with self.assertLogs("src.Peer", "WARNING") as logs:
+            self.peer.handle_buffers([not_utf8, bad_count, register])
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn(CHILD, self.peer.registered_nodes)
+        self.assertTrue(self.peer.packet_worker_pool.is_alive())
+
+    def test_dead_worker_does_not_stop_the_root(self):
+        register = bytes(PacketFactory.new_register_packet("REQ", CHILD, CHILD).get_buf())
+        hello = bytes(PacketFactory.new_reunion_packet("REQ", CHILD, [CHILD]).get_buf())
+        process = self.peer.packet_worker_pool._processes[0]
+        process.kill()
+        process.join()
+        with self.assertLogs("src.tools.PacketWorkerPool", "WARNING"):
+            self.peer.handle_buffers([register, hello])
+        self.assertIn(CHILD, self.peer.registered_nodes)
+        self.assertEqual(self.peer.metrics.get_counter("packets_in", type="Reunion"), 1)
+
+        self.peer.handle_buffers([hello])
+        self.assertEqual(self.peer.packet_worker_pool.restarts, 1)
+        self.assertEqual(self.peer.metrics.get_counter("packets_in", type="Reunion"), 2)
+        self.assertEqual(self.peer.metrics.get_counter("bytes_in", type="Reunion"), 2 * len(hello))
+        self.assertEqual(self.peer.metrics.get_counter("packets_in", type="Register"), 1)
+
+
+class PeerCloseTest(unittest.TestCase):
+    def test_main_loop_failure_closes_the_workers(self):
+        peer = new_peer(self, is_root=True, root_workers=1, idle_interval=0.01)
+        pool = peer.packet_worker_pool
+        self.assertTrue(pool.is_alive())
+
+        def fail():
+            raise RuntimeError("main loop failure")
+
+        peer.handle_user_interface_buffer = fail
+        with self.assertRaises(RuntimeError):
+            peer.run()
+        self.assertIsNone(peer.packet_worker_pool)
+        self.assertFalse(pool.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import unittest
+
+from helpers import message_text, new_peer, new_stream
+from src.Packet import BinaryPacket, PacketFactory
+from src.tools.Clock import VirtualClock
+
+NEIGHBOUR = ("010.000.000.001", "05335")
+OTHER = ("010.000.000.002", "05335")
+
+
+class RegisterCapacityTest(unittest.TestCase):
+    def test_capacity_out_of_range(self):
+        root = new_stream(self)
+        for capacity in (0, 100, -1):
+            with self.assertRaises(Exception):
+                PacketFactory.new_register_packet("REQ", NEIGHBOUR, NEIGHBOUR, capacity)
+            with self.assertRaises(Exception):
+                new_peer(self, root_address=root.get_server_address(), capacity=capacity)
+
+    def test_root_reads_the_capacity(self):
+        root = new_peer(self, is_root=True)
+        for capacity_field, capacity in (("", None), ("07", 7), ("99", 99), ("100", None), ("-1", None),
+                                         ("00", None), ("x1", None)):
+            client = new_stream(self)
+            address = client.get_server_address()
+            body = "REQ" + address[0] + address[1] + capacity_field
+            root.handle_packet(PacketFactory.parse_buffer(bytes(BinaryPacket.from_fields(1, 1, address, body)
+                                                                .get_buf())))
+            self.assertEqual(root.registered_nodes[address].capacity, capacity, capacity_field)
+
+
+class AggregatedHelloRelayTest(unittest.TestCase):
+    def test_peer_which_does_not_aggregate_relays_at_once(self):
+        root, parent = new_stream(self), new_stream(self)
+        peer = new_peer(self, root_address=root.get_server_address(), aggregate_reunion=False)
+        peer.stream.add_node(parent.get_server_address())
+        peer.parent = peer.stream.get_node_by_server(*parent.get_server_address())
+
+        hello = PacketFactory.new_reunion_packet("AGG", NEIGHBOUR, [NEIGHBOUR])
+        peer.handle_packet(PacketFactory.parse_buffer(bytes(hello.get_buf())))
+        relayed = [PacketFactory.parse_buffer(b) for b in peer.parent.out_buff]
+        self.assertEqual(len(relayed), 1)
+        self.assertEqual(relayed[0].get_source_server_address(), peer.stream.get_server_address())
+        self.assertEqual(PacketFactory.parse_aggregated_reunion_body(relayed[0].get_body()), [NEIGHBOUR])
+        self.assertEqual(peer.reunion_routes[NEIGHBOUR], NEIGHBOUR)
+        self.assertEqual(peer.reunion_batch, {})
+
+
+class ReunionRouteTest(unittest.TestCase):
+    def setUp(self):
+        root, parent, child = new_stream(self), new_stream(self), new_stream(self)
+        self.clock = VirtualClock(100)
+        self.peer = new_peer(self, root_address=root.get_server_address(), aggregate_reunion=True,
+                             reunion_thread=False, clock=self.clock)
+        self.peer.parent = self.peer.stream.add_node(parent.get_server_address())
+        self.child = self.peer.stream.add_node(child.get_server_address())
+
+    def hello(self, *addresses):
+        hello = PacketFactory.new_reunion_packet("AGG", self.child.get_server_address(), list(addresses))
+        self.peer.handle_packet(PacketFactory.parse_buffer(bytes(hello.get_buf())))
+
+    def hello_back(self, *addresses):
+        back = PacketFactory.new_reunion_packet("AGB", self.peer.parent.get_server_address(), list(addresses))
+        self.peer.handle_packet(PacketFactory.parse_buffer(bytes(back.get_buf())))
+
+    def test_routes_which_are_not_refreshed_expire(self):
+        self.hello(NEIGHBOUR)
+        self.clock.advance_to(120)
+        self.hello(OTHER)
+        self.clock.advance_to(139)
+        self.peer.reunion_step()
+        self.assertEqual(self.peer.reunion_routes, {OTHER: self.child.get_server_address()})
+        self.assertEqual(list(self.peer.reunion_route_times), [OTHER])
+
+    def test_hello_back_is_not_routed_to_a_removed_child(self):
+        self.hello(NEIGHBOUR, OTHER)
+        self.hello_back(NEIGHBOUR)
+        self.assertEqual(len(self.child.out_buff), 1)
+
+        self.peer.stream.remove_node(self.child)
+        self.hello_back(OTHER)
+        self.assertEqual(list(self.peer.reunion_routes), [NEIGHBOUR])
+
+    def test_reunion_failure_forgets_the_routes(self):
+        # Our first Aggregated Hello goes out a second after we start.
+        self.peer.reunion_step()
+        self.clock.advance_to(101)
+        self.peer.reunion_step()
+        self.assertTrue(self.peer.reunion_pending)
+        self.clock.advance_to(136)
+        self.hello(NEIGHBOUR)
+        self.clock.advance_to(140)
+        self.peer.reunion_step()
+        self.assertFalse(self.peer.reunion_accept)
+        self.assertEqual(self.peer.reunion_routes, {})
+
+
+class DuplicateMessageTest(unittest.TestCase):
+    def setUp(self):
+        root = new_stream(self)
+        self.neighbours = [new_stream(self) for _ in range(2)]
+        self.peer = new_peer(self, root_address=root.get_server_address())
+        for neighbour in self.neighbours:
+            self.peer.stream.add_node(neighbour.get_server_address())
+        self.peer.parent = self.peer.stream.get_node_by_server(*self.neighbours[0].get_server_address())
+        self.child = self.peer.stream.get_node_by_server(*self.neighbours[1].get_server_address())
+        self.peer.neighbours.append(self.child.get_server_address())
+
+    def arrive(self, packet, source):
+        self.peer.handle_packet(PacketFactory.parse_buffer(PacketFactory.new_relay_buffer(packet, source)))
+
+    def test_message_is_relayed_once(self):
+        packet = PacketFactory.new_message_packet("hello", NEIGHBOUR)
+        self.arrive(packet, self.neighbours[0].get_server_address())
+        self.assertEqual(len(self.child.out_buff), 1)
+        self.assertEqual(PacketFactory.get_message_id(PacketFactory.parse_buffer(self.child.out_buff[0])),
+                         PacketFactory.get_message_id(packet))
+
+        self.arrive(packet, self.neighbours[0].get_server_address())
+        self.assertEqual(len(self.child.out_buff), 1)
+        self.assertEqual(self.peer.metrics.get_counter("duplicate_messages", type="Message"), 1)
+
+        self.arrive(PacketFactory.new_message_packet("hello", NEIGHBOUR), self.neighbours[0].get_server_address())
+        self.assertEqual(len(self.child.out_buff), 2)
+
+    def test_packets_of_a_batch_are_handled(self):
+        source = self.neighbours[0].get_server_address()
+        buffers = [bytes(PacketFactory.new_message_packet("m%d" % i, source).get_buf()) for i in range(3)]
+        self.peer.handle_packet(PacketFactory.parse_buffer(PacketFactory.new_batch_buffer(buffers, source)))
+        self.assertEqual(len(self.child.out_buff), 3)
+
+    def test_our_own_message_is_not_relayed_back(self):
+        packet = PacketFactory.new_message_packet("hello", self.peer.stream.get_server_address())
+        self.peer.send_broadcast_packet(packet.get_buf())
+        self.assertEqual(len(self.child.out_buff), 1)
+        self.arrive(packet, self.neighbours[1].get_server_address())
+        self.assertEqual(len(self.peer.parent.out_buff), 1)
+        self.assertEqual(self.peer.metrics.get_counter("duplicate_messages", type="Message"), 1)
+
+
+class FragmentTest(unittest.TestCase):
+    def setUp(self):
+        root = new_stream(self)
+        self.neighbours = [new_stream(self) for _ in range(2)]
+        self.messages = []
+        self.peer = new_peer(self, root_address=root.get_server_address(), fragment_size=100,
+                         on_message=lambda message_id, message: self.messages.append(message))
+        for neighbour in self.neighbours:
+            self.peer.stream.add_node(neighbour.get_server_address())
+        self.parent, self.child = self.peer.stream.nodes[1:]
+        self.peer.parent = self.parent
+
+    def test_fragments_are_relayed_before_the_message_is_complete(self):
+        message = bytes(range(256))
+        packets = PacketFactory.new_fragment_packets(message, NEIGHBOUR, fragment_size=100)
+        source = self.parent.get_server_address()
+        for i, packet in enumerate(reversed(packets)):
+            self.peer.handle_packet(PacketFactory.parse_buffer(PacketFactory.new_relay_buffer(packet, source)))
+            self.assertEqual(len(self.child.out_buff), i + 1)
+        self.assertEqual(self.messages, [message])
+
+        self.peer.handle_packet(PacketFactory.parse_buffer(PacketFactory.new_relay_buffer(packets[0], source)))
+        self.assertEqual(len(self.child.out_buff), 3)
+        self.assertEqual(self.peer.metrics.get_counter("duplicate_messages", type="Fragment"), 1)
+
+    def test_send_message(self):
+        self.peer.send_message("x" * 50)
+        self.peer.send_message(b"y" * 250)
+        types = [PacketFactory.parse_buffer(b).get_type() for b in self.child.out_buff]
+        self.assertEqual(types, [4, 7, 7, 7])
+        self.assertEqual(message_text(self.child.out_buff[0]), "x" * 50)
+
+    def test_add_command(self):
+        self.peer.add_command("SendMessage hello world")
+        self.peer.handle_user_interface_buffer()
+        self.assertEqual(self.peer._user_interface.buffer, [])
+        self.assertEqual(message_text(self.child.out_buff[0]), "hello world")
+
+
+class ReunionFailureTest(unittest.TestCase):
+    def test_advertise_response_in_a_batch_rejoins(self):
+        root, parent = new_stream(self), new_stream(self)
+        peer = new_peer(self, root_address=root.get_server_address(), reunion_thread=False)
+        peer.reunion_accept = False
+        message = bytes(PacketFactory.new_message_packet("hello", NEIGHBOUR).get_buf())
+        response = PacketFactory.new_advertise_packet("RES", root.get_server_address(),
+                                                      neighbor=parent.get_server_address())
+        peer.stream._buffer_in_data(message)
+        peer.stream._buffer_in_data(PacketFactory.new_batch_buffer([message, response.get_buf()],
+                                                                   root.get_server_address()))
+
+        peer.run_once()
+        self.assertEqual(peer.parent.get_server_address(), parent.get_server_address())
+        self.assertEqual(peer.stream.pop_in_buf(), [message, message])
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        root = new_stream(self)
+        self.neighbours = [new_stream(self) for _ in range(3)]
+        self.peer = new_peer(self, root_address=root.get_server_address(), compression="zlib")
+        for neighbour in self.neighbours:
+            self.peer.stream.add_node(neighbour.get_server_address())
+        self.parent, self.old_child, self.new_child = self.peer.stream.nodes[1:]
+        self.peer.parent = self.parent
+        self.new_child.codecs = frozenset(["zlib"])
+
+    def test_join_with_codecs_is_answered(self):
+        joiner = new_stream(self)
+        join = PacketFactory.new_join_packet(joiner.get_server_address(), codecs=["zlib"])
+        self.peer.handle_packet(PacketFactory.parse_buffer(bytes(join.get_buf())))
+        node = self.peer.stream.get_node_by_server(*joiner.get_server_address())
+        self.assertEqual(node.codecs, frozenset(["zlib"]))
+        answer = PacketFactory.parse_buffer(node.out_buff[0])
+        self.assertEqual(answer.get_body()[0:4], "JACK")
+        self.assertIn("zlib", PacketFactory.parse_join_codecs(answer.get_body()))
+
+        jack = PacketFactory.new_join_packet(self.neighbours[0].get_server_address(), codecs=["zlib"], type="JACK")
+        self.peer.handle_packet(PacketFactory.parse_buffer(bytes(jack.get_buf())))
+        self.assertEqual(self.parent.codecs, frozenset(["zlib"]))
+
+    def test_compressed_message_is_relayed_per_link(self):
+        text = "Hello World! " * 100
+        packet = PacketFactory.new_message_packet(text, NEIGHBOUR, codec="zlib")
+        source = self.parent.get_server_address()
+        self.peer.handle_packet(PacketFactory.parse_buffer(PacketFactory.new_relay_buffer(packet, source)))
+
+        self.assertEqual(len(self.parent.out_buff), 0)
+        compressed = PacketFactory.parse_buffer(self.new_child.out_buff[0])
+        uncompressed = PacketFactory.parse_buffer(self.old_child.out_buff[0])
+        self.assertEqual(bytes(compressed.get_buf())[20:], bytes(packet.get_buf())[20:])
+        self.assertEqual(PacketFactory.get_message_codec(uncompressed), "none")
+        self.assertEqual(PacketFactory.parse_message(uncompressed)[1], text)
+
+
+if __name__ == "__main__":
+    unittest.main()
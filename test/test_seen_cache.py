@@ -0,0 +1,34 @@
+import unittest
+
+from src.tools.SeenCache import SeenCache
+
+
+class SeenCacheTest(unittest.TestCase):
+    def test_second_sight_is_reported(self):
+        cache = SeenCache()
+        self.assertFalse(cache.check_and_add("a", now=0))
+        self.assertTrue(cache.check_and_add("a", now=1))
+        self.assertFalse(cache.check_and_add("b", now=1))
+
+    def test_size_evicts_the_least_recently_seen(self):
+        cache = SeenCache(max_size=2)
+        cache.check_and_add("a", now=0)
+        cache.check_and_add("b", now=1)
+        cache.check_and_add("a", now=2)
+        cache.check_and_add("c", now=3)
+        self.assertEqual(len(cache), 2)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+    def test_ttl(self):
+        cache = SeenCache(ttl=10)
+        cache.check_and_add("a", now=0)
+        cache.check_and_add("b", now=5)
+        self.assertFalse(cache.check_and_add("c", now=10))
+        self.assertNotIn("a", cache)
+        self.assertIn("b", cache)
+        self.assertFalse(cache.check_and_add("a", now=11))
+
+
+if __name__ == "__main__":
+    unittest.main()
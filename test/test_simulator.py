@@ -0,0 +1,164 @@
+import contextlib
+import io
+import unittest
+
+from src.Peer import Peer
+from src.tools.Clock import VirtualClock
+from src.tools.NetworkGraph import GraphNode, NetworkGraph
+from src.tools.Simulator import Simulator
+
+ROOT = ("000.000.000.001", "00001")
+
+
+def address(i):
+    return "010.000.000.%03d" % i, "05335"
+
+
+class SimulatedNetworkTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(link_delay=0.01, jitter=0.005, seed=1)
+        self.options = {"transport": self.simulator.make_stream, "clock": self.simulator.clock,
+                        "reunion_thread": False}
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.root = Peer(ROOT[0], ROOT[1], is_root=True, max_children=1, **self.options)
+        self.simulator.add_peer(self.root)
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+
+    def join(self, i):
+        """
+        Start a peer which Registers and Advertises, then let it say its first Reunion Hello.
+
+        :rtype: Peer
+        """
+        peer = Peer(*address(i), root_address=ROOT, **self.options)
+        self.simulator.add_peer(peer)
+        peer.add_command("Register")
+        peer.add_command("Advertise")
+        self.simulator.run_for(10)
+        return peer
+
+    def test_peers_form_a_chain(self):
+        peers = [self.join(i) for i in range(1, 4)]
+        self.assertEqual(peers[0].parent.get_server_address(), ROOT)
+        self.assertEqual(peers[1].parent.get_server_address(), address(1))
+        self.assertEqual(peers[2].parent.get_server_address(), address(2))
+
+        self.simulator.run_for(60)
+        for peer in peers:
+            self.assertTrue(peer.reunion_accept)
+            self.assertTrue(self.root.network_graph.find_node(*peer.stream.get_server_address()).alive)
+
+    def test_peers_under_a_failed_peer_join_again(self):
+        peers = [self.join(i) for i in range(1, 4)]
+        self.simulator.fail(address(2))
+        self.simulator.run_for(37)
+        self.assertEqual(peers[2].parent.get_server_address(), address(2))
+
+        # Our Reunion Hello Back is 38 seconds late and the root forgets the failed peer after 36 seconds.
+        self.simulator.run_for(60)
+        self.assertTrue(peers[2].reunion_accept)
+        self.assertEqual(peers[2].parent.get_server_address(), address(1))
+        self.assertIsNone(self.root.network_graph.find_node(*address(2)))
+        self.assertGreater(self.simulator.lost_packets, 0)
+
+    def test_virtual_time_only_moves_with_events(self):
+        self.join(1)
+        self.assertEqual(self.simulator.clock.time(), 10)
+        self.simulator.run_until(1000)
+        self.assertEqual(self.simulator.clock.time(), 1000)
+
+
+class AggregatedReunionTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(link_delay=0.01, jitter=0.005, seed=3)
+        self.options = {"transport": self.simulator.make_stream, "clock": self.simulator.clock,
+                        "reunion_thread": False}
+        self.output = contextlib.redirect_stdout(io.StringIO())
+        self.output.__enter__()
+        self.root = Peer(ROOT[0], ROOT[1], is_root=True, max_children=2, **self.options)
+        self.simulator.add_peer(self.root)
+
+    def tearDown(self):
+        self.output.__exit__(None, None, None)
+
+    def test_aggregated_hellos_refresh_every_node(self):
+        peers = []
+        for i in range(1, 5):
+            peer = Peer(*address(i), root_address=ROOT, aggregate_reunion=True, **self.options)
+            self.simulator.add_peer(peer)
+            peer.add_command("Register")
+            peer.add_command("Advertise")
+            self.simulator.run_for(10)
+            peers.append(peer)
+        self.assertEqual([p.parent.get_server_address() for p in peers], [ROOT, ROOT, address(1), address(1)])
+
+        # Long past the 36 seconds after which the root forgets a node without a Reunion Hello.
+        self.simulator.run_for(120)
+        now = self.simulator.clock.time()
+        graph = self.root.network_graph
+        for peer in peers:
+            node = graph.find_node(*peer.stream.get_server_address())
+            self.assertTrue(node.alive)
+            self.assertGreater(node.latest_reunion_time, now - 6)
+            self.assertTrue(peer.reunion_accept)
+        self.assertEqual(graph.pop_expired_nodes(now - 36), [])
+
+        # The second level reaches the root only through the Aggregated Hellos of its parent, which routes the
+        # Hello Backs down again.
+        self.assertEqual(set(peers[0].reunion_routes), {address(3), address(4)})
+        for peer in peers[2:]:
+            self.assertGreater(peer.metrics.get_histogram("reunion_rtt_seconds").count, 10)
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_links_keep_their_order(self):
+        simulator = Simulator(link_delay=0.01, jitter=1, seed=2)
+        arrivals = []
+        simulator.streams[ROOT] = type("Receiver", (), {"deliver": lambda _, packets: arrivals.extend(packets)})()
+        for i in range(50):
+            simulator.schedule(i * 0.001, simulator.send, address(1), ROOT, [i])
+        simulator.run_for(5)
+        self.assertEqual(arrivals, list(range(50)))
+
+    def test_packets_to_an_unknown_peer_are_lost(self):
+        simulator = Simulator()
+        self.assertFalse(simulator.send(address(1), ROOT, [b"x"]))
+        self.assertEqual(simulator.lost_packets, 1)
+
+    def test_virtual_clock_does_not_go_backwards(self):
+        clock = VirtualClock(5)
+        clock.advance_to(7)
+        self.assertEqual(clock.time(), 7)
+        with self.assertRaises(Exception):
+            clock.advance_to(6)
+
+    def test_network_graph_uses_its_clock(self):
+        clock = VirtualClock(100)
+        graph = NetworkGraph(GraphNode(ROOT), clock=clock)
+        graph.add_node(*address(1), ROOT)
+        clock.advance_to(130)
+        self.assertEqual(graph.pop_expired_nodes(clock.time() - 36), [])
+        clock.advance_to(137)
+        self.assertEqual([n.address for n in graph.pop_expired_nodes(clock.time() - 36)], [address(1)])
+
+    def test_caches_use_the_clock_of_the_peer(self):
+        simulator = Simulator()
+        peer = Peer(*address(1), root_address=ROOT, transport=simulator.make_stream, clock=simulator.clock,
+                    reunion_thread=False, message_cache_ttl=60)
+        self.assertFalse(peer.seen_messages.check_and_add("m"))
+        self.assertIsNone(peer.fragments.add("f", 0, 2, b"x"))
+        simulator.clock.advance_to(59)
+        self.assertTrue(peer.seen_messages.check_and_add("m"))
+        self.assertEqual(len(peer.fragments), 1)
+        simulator.clock.advance_to(200)
+        self.assertFalse(peer.seen_messages.check_and_add("m"))
+        self.assertIsNone(peer.fragments.add("g", 0, 2, b"y"))
+        self.assertEqual(peer.fragments.dropped_messages, 1)
+        self.assertIs(peer.stream.clock, simulator.clock)
+
+
+if __name__ == "__main__":
+    unittest.main()
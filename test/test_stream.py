@@ -0,0 +1,239 @@
+import socket
+import threading
+import time
+import unittest
+
+from helpers import LOCALHOST, free_port, message, message_text, new_pair, new_peer, new_stream, receive, \
+    wait_until
+from src.Packet import PacketFactory
+from src.tools.Clock import VirtualClock
+
+
+class WakeUpTest(unittest.TestCase):
+    def test_wait_returns_as_soon_as_a_packet_arrives(self):
+        receiver, sender, _ = new_pair(self)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message(source=sender.get_server_address()))
+        threading.Timer(0.05, sender.send_out_buf_messages).start()
+
+        start = time.time()
+        self.assertTrue(receiver.wait_for_in_buf(5))
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(len(receive(receiver, 1)), 1)
+
+    def test_wait_times_out_without_packets(self):
+        receiver = new_stream(self)
+        self.assertFalse(receiver.wait_for_in_buf(0.05))
+
+    def test_wake_up_without_data(self):
+        receiver = new_stream(self)
+        threading.Timer(0.05, receiver.wake_up).start()
+        self.assertTrue(receiver.wait_for_in_buf(5))
+        self.assertEqual(receiver.pop_in_buf(), [])
+
+
+class CloseTest(unittest.TestCase):
+    def test_close_stops_the_server(self):
+        receiver, sender, _ = new_pair(self)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message())
+        sender.send_out_buf_messages()
+        self.assertEqual(len(receive(receiver, 1)), 1)
+        receiver.close()
+        self.assertTrue(wait_until(lambda: refused(receiver.port)))
+        receiver.close()
+
+    def test_peer_closes_its_stream(self):
+        peer = new_peer(self, is_root=True)
+        peer.close()
+        self.assertTrue(wait_until(lambda: refused(peer.stream.port)))
+        peer.close()
+
+
+def refused(port):
+    """
+    :return: Whether nobody listens on the port of the loopback address.
+    :rtype: bool
+    """
+    try:
+        socket.create_connection(("127.0.0.1", int(port)), timeout=1).close()
+    except ConnectionRefusedError:
+        return True
+    return False
+
+
+class SendFailureTest(unittest.TestCase):
+    def test_broken_node_is_removed(self):
+        receiver, sender, node = new_pair(self)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message())
+
+        def broken():
+            raise ConnectionError("Node is unreachable.")
+
+        node.send_message = broken
+        sender.send_out_buf_messages()
+        self.assertEqual(sender.nodes, [])
+
+    def test_programming_error_is_not_hidden(self):
+        receiver, sender, node = new_pair(self)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message())
+
+        def failing():
+            raise RuntimeError("bug")
+
+        node.send_message = failing
+        with self.assertRaises(RuntimeError):
+            sender.send_out_buf_messages()
+        self.assertEqual(sender.nodes, [node])
+
+
+class PipelinedTest(unittest.TestCase):
+    def check_delivery(self, pipelined):
+        receiver, sender, _ = new_pair(self, pipelined=pipelined)
+        for i in range(50):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i, sender.get_server_address()))
+        sender.send_out_buf_messages()
+
+        received = receive(receiver, 50)
+        bodies = [message_text(b) for b in received]
+        self.assertEqual(bodies, ["m%d" % i for i in range(50)])
+        node = sender.get_node_by_server(*receiver.get_server_address())
+        self.assertEqual(len(node.out_buff), 0)
+
+    def test_pipelined_sends_keep_order(self):
+        self.check_delivery(pipelined=True)
+
+    def test_ack_sends_keep_order(self):
+        self.check_delivery(pipelined=False)
+
+
+class NodeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = new_stream(self)
+        self.receiver = new_stream(self)
+        self.ip, self.port = self.receiver.get_server_address()
+
+    def test_lookup_normalises_the_address(self):
+        self.stream.add_node((self.ip, self.port))
+        node = self.stream.get_node_by_server(self.ip, self.port)
+        self.assertIsNotNone(node)
+        self.assertIs(self.stream.get_node_by_server("127.0.0.1", int(self.port)), node)
+        self.assertIsNone(self.stream.get_node_by_server("127.0.0.1", free_port()))
+
+    def test_remove_node_falls_back_to_the_other_node_of_the_address(self):
+        self.stream.add_node((self.ip, self.port), set_register_connection=True)
+        self.stream.add_node((self.ip, self.port))
+        register_node, node = self.stream.nodes
+        self.assertIs(self.stream.get_node_by_server(self.ip, self.port), register_node)
+
+        self.stream.remove_node(register_node)
+        self.assertIs(self.stream.get_node_by_server(self.ip, self.port), node)
+        self.stream.remove_node(node)
+        self.assertIsNone(self.stream.get_node_by_server(self.ip, self.port))
+
+
+class ConcurrentSendTest(unittest.TestCase):
+    def setUp(self):
+        # A neighbour which accepts our connection but never answers with b'ACK'.
+        self.silent = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.silent.bind(("127.0.0.1", 0))
+        self.silent.listen(1)
+        self.silent_address = (LOCALHOST, self.silent.getsockname()[1])
+
+    def tearDown(self):
+        self.silent.close()
+
+    def test_silent_node_does_not_delay_the_others(self):
+        receiver = new_stream(self)
+        sender = new_stream(self, send_workers=2, send_timeout=1)
+        sender.add_node(self.silent_address)
+        sender.add_node(receiver.get_server_address())
+        for address in (self.silent_address, receiver.get_server_address()):
+            sender.add_message_to_out_buff(address, message(source=sender.get_server_address()))
+
+        start = time.time()
+        sender.send_out_buf_messages()
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(len(receive(receiver, 1, timeout=0.5)), 1)
+
+        def silent_node_removed():
+            sender.send_out_buf_messages()
+            return sender.get_node_by_server(*self.silent_address) is None
+
+        self.assertTrue(wait_until(silent_node_removed, timeout=5))
+        self.assertEqual(len(sender.nodes), 1)
+
+    def test_order_is_kept_across_hand_overs(self):
+        receiver, sender, _ = new_pair(self, send_workers=2, pipelined=True)
+        for i in range(50):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i))
+            if i % 7 == 0:
+                sender.send_out_buf_messages()
+        node = sender.get_node_by_server(*receiver.get_server_address())
+        node.send_message()
+
+        bodies = [message_text(b) for b in receive(receiver, 50)]
+        self.assertEqual(bodies, ["m%d" % i for i in range(50)])
+
+
+class BatchTest(unittest.TestCase):
+    def test_packets_are_packed_and_delivered_in_order(self):
+        receiver, sender, _ = new_pair(self, batch_bytes=4096)
+        for i in range(50):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i))
+        sender.send_out_buf_messages()
+
+        received = receive(receiver, 1)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(PacketFactory.parse_buffer(received[0]).get_type(), 6)
+        unpacked = PacketFactory.unpack_batches(received)
+        self.assertEqual([message_text(b) for b in unpacked], ["m%d" % i for i in range(50)])
+
+    def test_batches_are_not_bigger_than_batch_bytes(self):
+        size = len(message("m0"))
+        receiver, sender, _ = new_pair(self, batch_bytes=3 * size)
+        for i in range(7):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i))
+        sender.send_out_buf_messages()
+        received = receive(receiver, 3)
+        self.assertEqual([len(PacketFactory.split_batch(PacketFactory.parse_buffer(b))) for b in received[:2]],
+                         [3, 3])
+        self.assertEqual(message_text(received[2]), "m6")
+
+    def test_linger(self):
+        receiver, sender, _ = new_pair(self, batch_bytes=4096, batch_linger=0.2)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message())
+        sender.send_out_buf_messages()
+        self.assertEqual(receive(receiver, 1, timeout=0.05), [])
+        self.assertLessEqual(sender.get_linger_timeout(), 0.2)
+
+        time.sleep(sender.get_linger_timeout())
+        sender.send_out_buf_messages()
+        self.assertEqual(len(receive(receiver, 1)), 1)
+        self.assertIsNone(sender.get_linger_timeout())
+
+    def test_linger_follows_the_clock(self):
+        clock = VirtualClock(100)
+        receiver, sender, _ = new_pair(self, batch_bytes=4096, batch_linger=5, clock=clock)
+        sender.add_message_to_out_buff(receiver.get_server_address(), message())
+        sender.send_out_buf_messages()
+        self.assertEqual(sender.get_linger_timeout(), 5)
+
+        clock.advance_to(104)
+        sender.send_out_buf_messages()
+        self.assertEqual(receive(receiver, 1, timeout=0.05), [])
+        self.assertEqual(sender.get_linger_timeout(), 1)
+        clock.advance_to(105)
+        sender.send_out_buf_messages()
+        self.assertEqual(len(receive(receiver, 1)), 1)
+
+    def test_register_connections_are_not_batched(self):
+        receiver = new_stream(self)
+        sender = new_stream(self, batch_bytes=4096, batch_linger=10)
+        sender.add_node(receiver.get_server_address(), set_register_connection=True)
+        for i in range(3):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("m%d" % i))
+        sender.send_out_buf_messages()
+        self.assertEqual([message_text(b) for b in receive(receiver, 3)], ["m0", "m1", "m2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
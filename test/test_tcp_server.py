@@ -0,0 +1,98 @@
+import socket
+import threading
+import unittest
+
+from helpers import free_port, wait_until
+from src.tools.simpletcp.tcpserver import TCPServer
+
+
+def connect(port):
+    """
+    :return: A connection to the server, once it is listening.
+    :rtype: socket.socket
+    """
+    connections = []
+
+    def try_connect():
+        try:
+            connections.append(socket.create_connection(("127.0.0.1", port), timeout=5))
+        except ConnectionRefusedError:
+            return False
+        return True
+
+    assert wait_until(try_connect)
+    return connections[0]
+
+
+def receive_exactly(connection, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
+
+
+class TCPServerTest(unittest.TestCase):
+    def start(self, callback):
+        self.port = free_port()
+        server = TCPServer("127.0.0.1", self.port, callback, maximum_connections=socket.SOMAXCONN)
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.close)
+        return server
+
+    def test_large_answers_are_sent_completely_and_in_order(self):
+        # Much more than a socket send buffer, so the server has to wait for the socket and resume partial sends.
+        answers = [bytes([i]) * (1 << 20) for i in range(4)]
+
+        def callback(ip, queue, data):
+            for answer in answers:
+                queue.put(answer)
+
+        self.start(callback)
+        connection = connect(self.port)
+        connection.sendall(b'x')
+        self.assertEqual(receive_exactly(connection, 4 << 20), b''.join(answers))
+        connection.close()
+
+    def test_many_connections(self):
+        self.start(lambda ip, queue, data: queue.put(b'ACK' + data))
+        connections = [connect(self.port) for _ in range(300)]
+        for i, connection in enumerate(connections):
+            connection.sendall(b'%05d' % i)
+        for i, connection in enumerate(connections):
+            self.assertEqual(receive_exactly(connection, 8), b'ACK%05d' % i)
+            connection.close()
+
+    def test_failing_callback_closes_only_its_connection(self):
+        def callback(ip, queue, data):
+            if data == b'boom':
+                raise RuntimeError("callback failure")
+            queue.put(b'ACK')
+
+        self.start(callback)
+        healthy, failing = connect(self.port), connect(self.port)
+        with self.assertLogs("src.tools.simpletcp.serversocket", "ERROR"):
+            failing.sendall(b'boom')
+            self.assertEqual(receive_exactly(failing, 1), b'')
+        failing.close()
+        healthy.sendall(b'x')
+        self.assertEqual(receive_exactly(healthy, 3), b'ACK')
+        healthy.close()
+
+    def test_closed_connections_are_forgotten(self):
+        server = self.start(lambda ip, queue, data: queue.put(b'ACK'))
+        for _ in range(3):
+            connection = connect(self.port)
+            connection.sendall(b'x')
+            self.assertEqual(receive_exactly(connection, 3), b'ACK')
+            connection.close()
+        # Only the listening socket and the socket close wakes us up with are left.
+        self.assertTrue(wait_until(lambda: len(server.serversocket._selector.get_map()) == 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from helpers import message, new_stream, receive
+from src.Peer import Peer
+from src.tools.SamplingProfiler import SamplingProfiler
+from src.tools.Simulator import Simulator
+from src.tools.Tracer import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def test_marks_are_taken_once(self):
+        tracer = Tracer(max_marks=2)
+        buffers = [b"a" * 30, b"b" * 30, b"c" * 30]
+        spans = [tracer.mark("node", b) for b in buffers]
+        self.assertEqual(spans, [1, 2, 3])
+        self.assertEqual(tracer.take_mark("node", buffers[0]), (None, None))
+        self.assertEqual(tracer.take_mark("node", buffers[2])[0], 3)
+        self.assertEqual(tracer.take_mark("node", buffers[2]), (None, None))
+        self.assertEqual(tracer.take_mark("other", buffers[1]), (None, None))
+
+    def test_streams_record_queueing_sending_and_arrival(self):
+        tracer = Tracer()
+        receiver = new_stream(self, tracer=tracer)
+        sender = new_stream(self, tracer=tracer)
+        sender.add_node(receiver.get_server_address())
+        with contextlib.redirect_stdout(io.StringIO()):
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("a"))
+            sender.add_message_to_out_buff(receiver.get_server_address(), message("b"))
+            sender.send_out_buf_messages()
+        receive(receiver, 2)
+
+        events = [e for e in tracer.get_events() if e["ph"] != "M"]
+        by_name = {}
+        for event in events:
+            by_name.setdefault(event["name"], []).append(event)
+        self.assertEqual([e["args"]["span"] for e in by_name["Node.out_buff"]], [1, 2])
+        self.assertEqual(by_name["Node.send_message"][0]["args"]["spans"], [1, 2])
+        self.assertEqual(len(by_name["ServerSocket"]), 2)
+        self.assertEqual({e["pid"] for e in by_name["ServerSocket"]}, {receiver.trace_pid})
+        self.assertEqual(tracer.get_stage_totals()["Node.out_buff"][0], 2)
+
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        tracer.dump(path)
+        with open(path) as file:
+            names = [e["args"]["name"] for e in json.load(file)["traceEvents"] if e["name"] == "process_name"]
+        self.assertEqual(names, ["%s:%s" % receiver.get_server_address(), "%s:%s" % sender.get_server_address()])
+
+    def test_a_message_keeps_its_span_through_a_peer(self):
+        simulator = Simulator(link_delay=0.01)
+        tracer = Tracer()
+        options = {"transport": simulator.make_stream, "clock": simulator.clock, "reunion_thread": False,
+                   "tracer": tracer}
+        with contextlib.redirect_stdout(io.StringIO()):
+            root = Peer("000.000.000.001", 1, is_root=True, max_children=1, **options)
+            peers = [Peer("000.000.000.%03d" % i, 1, root_address=root.stream.get_server_address(), **options)
+                     for i in (2, 3)]
+            simulator.add_peer(root)
+            for peer in peers:
+                simulator.add_peer(peer)
+                peer.add_command("Register")
+                peer.add_command("Advertise")
+                simulator.run_for(10)
+            peers[1].add_command("SendMessage hello")
+            simulator.run_for(1)
+
+        events = [e for e in tracer.get_events() if e["ph"] != "M"]
+        handled = [e for e in events if e["name"] == "Peer.handle_packet" and e["args"]["type"] == "Message"]
+        self.assertEqual([e["pid"] for e in handled], [peers[0].stream.trace_pid, root.stream.trace_pid])
+        self.assertEqual(len({e["args"]["message"] for e in handled}), 1)
+
+        # peers[0] relays the message it has received to root under the span of its arrival.
+        span = handled[0]["args"]["span"]
+        stages = [e["name"] for e in events if e["pid"] == peers[0].stream.trace_pid and
+                  (e["args"].get("span") == span or span in e["args"].get("spans", ()))]
+        self.assertEqual(stages, ["ServerSocket", "Stream.in_buf", "PacketFactory.parse_buffer",
+                                  "Peer.handle_packet", "Node.out_buff", "Node.send_message"])
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_samples_every_other_thread(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=spin, args=(stop,), name="spinner")
+        thread.start()
+        profiler = SamplingProfiler()
+        try:
+            for _ in range(5):
+                profiler.sample()
+        finally:
+            stop.set()
+            thread.join()
+
+        self.assertEqual(profiler.samples, 5)
+        stacks = profiler.get_stacks()
+        spinner = [s for s in stacks if s.startswith("spinner;")]
+        self.assertEqual(sum(stacks[s] for s in spinner), 5)
+        self.assertTrue(all("test_tracer.py:spin" in s for s in spinner))
+
+        path = os.path.join(tempfile.mkdtemp(), "stacks.txt")
+        profiler.dump(path)
+        with open(path) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(sum(int(line.rsplit(" ", 1)[1]) for line in lines), sum(stacks.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()